@@ -3,36 +3,46 @@
 import json
 import boto3
 import cfnresponse
+from concurrent.futures import ThreadPoolExecutor
 
 sm = boto3.client("sagemaker")
 ssm = boto3.client("ssm")
 org_client = boto3.client("organizations")
 
-def get_environment(project_name, ssm_params):
-    r = sm.describe_domain(
-            DomainId=sm.describe_project(
-                ProjectName=project_name
-                )["CreatedBy"]["DomainId"]
-        )
-    del r["ResponseMetadata"]
-    del r["CreationTime"]
-    del r["LastModifiedTime"]
-    r = {**r, **r["DefaultUserSettings"]}
-    del r["DefaultUserSettings"]
-
-    i = {
-        **r,
-        **{t["Key"]:t["Value"] 
-            for t in sm.list_tags(ResourceArn=r["DomainArn"])["Tags"] 
-            if t["Key"] in ["EnvironmentName", "EnvironmentType"]}
-    }
-
-    for p in ssm_params:
-        try:
-            i[p["VariableName"]] = ssm.get_parameter(Name=f"{i['EnvironmentName']}-{i['EnvironmentType']}-{p['ParameterName']}")["Parameter"]["Value"]
-        except:
-            i[p["VariableName"]] = ""
+def get_parameters(names):
+    try:
+        return {p["Name"]:p["Value"] for p in ssm.get_parameters(Names=names)["Parameters"]}
+    except Exception:
+        return {}
 
+def get_environment(project_name, ssm_params):
+    project = sm.describe_project(ProjectName=project_name)
+    domain_id = project["CreatedBy"]["DomainId"]
+    with ThreadPoolExecutor(4) as executor:
+        d = executor.submit(sm.describe_domain, DomainId=domain_id)
+        tags = executor.submit(sm.list_tags, ResourceArn=f"{project['ProjectArn'].rsplit(':', 1)[0]}:domain/{domain_id}")
+        r = d.result()
+        del r["ResponseMetadata"]
+        del r["CreationTime"]
+        del r["LastModifiedTime"]
+        r = {**r, **r["DefaultUserSettings"]}
+        del r["DefaultUserSettings"]
+
+        i = {
+            **r,
+            **{t["Key"]:t["Value"]
+                for t in tags.result()["Tags"]
+                if t["Key"] in ["EnvironmentName", "EnvironmentType"]}
+        }
+
+        # ssm:GetParameters takes up to 10 names
+        names = [f"{i.get('EnvironmentName')}-{i.get('EnvironmentType')}-{p['ParameterName']}" for p in ssm_params]
+        values = {}
+        for v in executor.map(get_parameters, [names[n:n + 10] for n in range(0, len(names), 10)]):
+            values.update(v)
+
+    for p, name in zip(ssm_params, names):
+        i[p["VariableName"]] = values.get(name, "")
     return i
 
 def lambda_handler(event, context):
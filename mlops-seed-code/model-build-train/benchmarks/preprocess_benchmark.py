@@ -0,0 +1,317 @@
+"""Measures the throughput of the abalone preprocessing script.
+
+Generates abalone-shaped synthetic CSV files, serves them from a local S3
+stand-in and runs the preprocessing logic of pipelines/abalone/preprocess.py
+against them, one fresh process per case so peak RSS is per case. Reports
+rows/sec, peak RSS and the time of each phase as measured by the profiler of
+preprocess.py, and stores the results as JSON. A case that crashes, is killed
+or runs out of time is recorded as failed.
+
+Example:
+    python benchmarks/preprocess_benchmark.py --rows 100000 1000000 \\
+        --output results.json --baseline baseline.json
+"""
+
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from pipelines.abalone import preprocess
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROWS = [100000, 1000000, 10000000, 100000000]
+MODES = ["in-memory", "streaming"]
+BUCKET = "benchmark"
+DEFAULT_TIMEOUT = 3600
+POLL_INTERVAL = 1
+
+# share of each sex in the UCI abalone dataset
+SEX_SHARES = {"M": 0.366, "F": 0.313, "I": 0.321}
+
+
+def synthetic_chunk(rng, rows, missing_rate=0.0):
+    """Generates rows with the columns, ranges and correlations of the abalone dataset."""
+    length = np.clip(rng.normal(0.52, 0.12, rows), 0.075, 0.815)
+    whole_weight = np.clip(4.0 * length**3 + rng.normal(0, 0.05, rows), 0.002, 2.8)
+    shell_weight = np.clip(0.29 * whole_weight + rng.normal(0, 0.02, rows), 0.0015, 1.0)
+    df = pd.DataFrame(
+        {
+            "sex": rng.choice(list(SEX_SHARES), size=rows, p=list(SEX_SHARES.values())),
+            "length": length,
+            "diameter": np.clip(0.8 * length + rng.normal(0, 0.015, rows), 0.05, 0.65),
+            "height": np.clip(0.27 * length + rng.normal(0, 0.02, rows), 0.0, 1.13),
+            "whole_weight": whole_weight,
+            "shucked_weight": np.clip(0.43 * whole_weight + rng.normal(0, 0.03, rows), 0.001, 1.5),
+            "viscera_weight": np.clip(
+                0.22 * whole_weight + rng.normal(0, 0.02, rows), 0.0005, 0.76
+            ),
+            "shell_weight": shell_weight,
+        }
+    )
+    df["rings"] = np.clip(np.rint(3 + 25 * shell_weight + rng.normal(0, 2.2, rows)), 1, 29)
+    if missing_rate:
+        for column in preprocess.feature_columns_names[1:]:
+            df.loc[rng.random(rows) < missing_rate, column] = np.nan
+    return df
+
+
+def generate_csv(path, rows, seed=0, missing_rate=0.0, chunk_rows=1000000):
+    """Writes a headerless synthetic abalone CSV with bounded memory."""
+    rng = np.random.default_rng(seed)
+    with open(path, "w") as f:
+        for start in range(0, rows, chunk_rows):
+            chunk = synthetic_chunk(rng, min(chunk_rows, rows - start), missing_rate)
+            chunk.to_csv(f, header=False, index=False, float_format="%.4f")
+
+
+class LocalS3Client:
+    """Serves the S3 calls of preprocess.py from files in a local directory.
+
+    The bucket name maps to root, keys map to paths below it.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": os.path.getsize(self._path(Key))}
+
+    def get_object(self, Bucket, Key, Range=None):
+        with open(self._path(Key), "rb") as f:
+            if Range is None:
+                return {"Body": io.BytesIO(f.read())}
+            first, last = (int(v) for v in Range[len("bytes=") :].split("-"))
+            f.seek(first)
+            return {"Body": io.BytesIO(f.read(last - first + 1))}
+
+    def list_objects_v2(self, Bucket, Prefix, **kwargs):
+        contents = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, self.root)
+                if key.startswith(Prefix):
+                    stat = os.stat(path)
+                    contents.append(
+                        {"Key": key, "Size": stat.st_size, "ETag": f'"{stat.st_mtime_ns}"'}
+                    )
+        return {"Contents": sorted(contents, key=lambda o: o["Key"])}
+
+
+def run_case(data_dir, key, mode, chunk_size, results, compact=False):
+    """Runs one benchmark case, meant to run in a fresh process.
+
+    The case runs preprocess_in_memory() or preprocess_streaming() as the job
+    does and times the phases of the basic profiler, which include the
+    overhead of tracemalloc.
+    """
+    s3_client = LocalS3Client(data_dir)
+    objects = preprocess.list_input_objects(s3_client, f"s3://{BUCKET}/{key}")
+
+    def source():
+        return preprocess.open_s3_input(s3_client, objects)
+
+    profiler = preprocess.profiler
+    preprocess.profiler = preprocess.PhaseProfiler("basic")
+    try:
+        with tempfile.TemporaryDirectory() as base_dir:
+            for split in preprocess.SPLIT_NAMES:
+                os.makedirs(os.path.join(base_dir, split))
+            start = time.perf_counter()
+            if mode == "streaming":
+                preprocess.preprocess_streaming(
+                    source, base_dir, chunk_size, seed=0, compact=compact
+                )
+            else:
+                preprocess.preprocess_in_memory(source, base_dir, seed=0, compact=compact)
+            total = time.perf_counter() - start
+            with open(os.path.join(base_dir, "manifest", "manifest.json")) as f:
+                manifest = json.load(f)
+        phases = preprocess.profiler.phases
+    finally:
+        preprocess.profiler = profiler
+    rows = sum(part["rows"] for split in preprocess.SPLIT_NAMES for part in manifest[split])
+    timings = {name: totals["wall_seconds"] for name, totals in phases.items()}
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        max_rss *= 1024
+    results.put(
+        {
+            "rows": rows,
+            "mode": mode,
+            "chunk_size": chunk_size if mode == "streaming" else None,
+            "compact_dtypes": compact,
+            "input_bytes": objects[0][2],
+            "seconds": {**timings, "total": total},
+            "rows_per_second": rows / total,
+            "peak_rss_bytes": max_rss,
+        }
+    )
+
+
+def wait_for_case(process, results, timeout=DEFAULT_TIMEOUT):
+    """Waits for the result of a case process.
+
+    Returns the result and None, or None and the error if the process exits
+    without a result, for example when it crashed or was killed for running
+    out of memory, or runs longer than timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        # a result put before the process exited is in the queue by then
+        alive = process.is_alive()
+        try:
+            return results.get(timeout=POLL_INTERVAL), None
+        except queue.Empty:
+            pass
+        if not alive:
+            process.join()
+            return None, f"exited with code {process.exitcode} without a result"
+        if time.monotonic() > deadline:
+            process.terminate()
+            process.join()
+            return None, f"timed out after {timeout}s"
+
+
+def run_benchmark(
+    rows_list,
+    modes,
+    data_dir,
+    chunk_size,
+    missing_rate=0.0,
+    compact=False,
+    timeout=DEFAULT_TIMEOUT,
+):
+    """Runs every mode on a synthetic file of each size and returns the results.
+
+    The result of a failed case has an error instead of the measurements.
+    """
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for rows in rows_list:
+        key = f"abalone-{rows}-{missing_rate}.csv"
+        path = os.path.join(data_dir, key)
+        if not os.path.exists(path):
+            logger.info("Generating %d rows to %s.", rows, path)
+            generate_csv(path, rows, missing_rate=missing_rate)
+        for mode in modes:
+            logger.info("Running %s with %d rows.", mode, rows)
+            results_queue = context.Queue()
+            process = context.Process(
+                target=run_case, args=(data_dir, key, mode, chunk_size, results_queue, compact)
+            )
+            process.start()
+            result, error = wait_for_case(process, results_queue, timeout)
+            process.join()
+            if error:
+                logger.error("%s with %d rows failed: %s.", mode, rows, error)
+                result = {
+                    "rows": rows,
+                    "mode": mode,
+                    "chunk_size": chunk_size if mode == "streaming" else None,
+                    "compact_dtypes": compact,
+                    "error": error,
+                }
+            else:
+                logger.info(json.dumps(result))
+            results.append(result)
+    return results
+
+
+def find_regressions(results, baseline, tolerance):
+    """Lists the phases that are more than tolerance slower than in the baseline."""
+
+    def case(r):
+        return r["rows"], r["mode"], r.get("compact_dtypes", False)
+
+    reference = {case(r): r["seconds"] for r in baseline}
+    regressions = []
+    for result in results:
+        seconds = reference.get(case(result))
+        if seconds is None or "error" in result:
+            continue
+        for phase, value in result["seconds"].items():
+            if phase in seconds and value > seconds[phase] * (1 + tolerance):
+                regressions.append(
+                    f"{result['mode']} with {result['rows']} rows: {phase} took "
+                    f"{value:.3f}s, baseline {seconds[phase]:.3f}s"
+                )
+    return regressions
+
+
+def main():
+    """Runs the benchmark and compares it to an optional baseline."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--chunk-size", type=int, default=1000000)
+    parser.add_argument("--missing-rate", type=float, default=0.0)
+    parser.add_argument("--compact-dtypes", action="store_true")
+    parser.add_argument(
+        "--data-dir",
+        default=os.path.join(tempfile.gettempdir(), "abalone-benchmark"),
+        help="Directory keeping the generated files between runs.",
+    )
+    parser.add_argument(
+        "--timeout", type=int, default=DEFAULT_TIMEOUT, help="Seconds a case may run."
+    )
+    parser.add_argument("--output", default="preprocess-benchmark.json")
+    parser.add_argument("--baseline", default=None, help="Results JSON of an earlier run.")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="Allowed slowdown of a phase, 0.2 is 20%%."
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = run_benchmark(
+        args.rows,
+        args.modes,
+        args.data_dir,
+        args.chunk_size,
+        args.missing_rate,
+        args.compact_dtypes,
+        args.timeout,
+    )
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info("Wrote results to %s.", args.output)
+
+    failed = any("error" in r for r in results)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            logger.error("Regression: %s", regression)
+        failed = failed or bool(regressions)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Measures the startup and render time of the pipeline definition CLI.
+
+Runs each case in fresh Python processes, as CI does on every build, and reports
+the median of each phase: the wall time of the CLI help, which needs no SDK, and
+for an offline render the time to import the driver, to build the pipeline with
+get_pipeline, which imports the SageMaker SDK, and to render its definition.
+The render uses an environment file, so no AWS calls are made or timed.
+
+Example:
+    python benchmarks/startup_benchmark.py --repeats 5 \\
+        --output startup.json --baseline baseline.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ENVIRONMENT = {
+    "SecurityGroups": ["sg-00000000"],
+    "SubnetIds": ["subnet-00000000"],
+    "ExecutionRole": "arn:aws:iam::111111111111:role/benchmark",
+    "DataBucketName": "benchmark-data",
+    "ModelBucketName": "benchmark-models",
+    "EbsKmsKeyArn": "arn:aws:kms:us-east-1:111111111111:key/ebs",
+    "S3KmsKeyId": "arn:aws:kms:us-east-1:111111111111:key/s3",
+}
+
+# runs in the measured process, reports its phases as the last line of the output
+RENDER = """
+import contextlib, io, json, sys, time
+start = time.perf_counter()
+from pipelines._utils import get_pipeline_driver
+seconds = {"import_driver": time.perf_counter() - start}
+with contextlib.redirect_stdout(io.StringIO()):
+    start = time.perf_counter()
+    pipeline = get_pipeline_driver(sys.argv[1], json.loads(sys.argv[2]))
+    seconds["get_pipeline"] = time.perf_counter() - start
+    start = time.perf_counter()
+    pipeline.definition()
+    seconds["definition"] = time.perf_counter() - start
+print(json.dumps(seconds))
+"""
+
+
+def run(command):
+    """Runs a command from the project root, returning its wall time and output."""
+    start = time.perf_counter()
+    output = subprocess.run(
+        command, cwd=ROOT, check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    ).stdout
+    return time.perf_counter() - start, output.decode()
+
+
+def measure_cli_help():
+    """Returns the phases of printing the CLI help."""
+    seconds, _ = run([sys.executable, "-m", "pipelines.get_pipeline_definition", "--help"])
+    return {"total": seconds}
+
+
+def measure_render(module_name, kwargs):
+    """Returns the phases of an offline render of the pipeline definition."""
+    seconds, output = run([sys.executable, "-c", RENDER, module_name, json.dumps(kwargs)])
+    return {**json.loads(output.strip().splitlines()[-1]), "total": seconds}
+
+
+def run_benchmark(module_name, region, repeats):
+    """Runs every case repeats times and returns the median of each phase."""
+    with tempfile.TemporaryDirectory() as directory:
+        environment_file = os.path.join(directory, "environment.json")
+        with open(environment_file, "w") as f:
+            json.dump(ENVIRONMENT, f)
+        kwargs = {"region": region, "environment_file": environment_file}
+        cases = {
+            "cli_help": measure_cli_help,
+            "render": lambda: measure_render(module_name, kwargs),
+        }
+        results = []
+        for case, measure in cases.items():
+            runs = [measure() for _ in range(repeats)]
+            seconds = {phase: statistics.median(r[phase] for r in runs) for phase in runs[0]}
+            logger.info("%s: %s", case, json.dumps(seconds))
+            results.append({"case": case, "seconds": seconds})
+    return results
+
+
+def find_regressions(results, baseline, tolerance):
+    """Lists the phases that are more than tolerance slower than in the baseline."""
+    reference = {r["case"]: r["seconds"] for r in baseline}
+    regressions = []
+    for result in results:
+        seconds = reference.get(result["case"], {})
+        for phase, value in result["seconds"].items():
+            if phase in seconds and value > seconds[phase] * (1 + tolerance):
+                regressions.append(
+                    f"{result['case']}: {phase} took {value:.3f}s, baseline {seconds[phase]:.3f}s"
+                )
+    return regressions
+
+
+def main():
+    """Runs the benchmark and compares it to an optional baseline."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module-name", default="pipelines.abalone.pipeline")
+    parser.add_argument("--region", default="us-east-1")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", default="startup-benchmark.json")
+    parser.add_argument("--baseline", default=None, help="Results JSON of an earlier run.")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="Allowed slowdown of a phase, 0.2 is 20%%."
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    results = run_benchmark(args.module_name, args.region, args.repeats)
+    report = {"python": platform.python_version(), "cpus": os.cpu_count(), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info("Wrote results to %s.", args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            logger.error("Regression: %s", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
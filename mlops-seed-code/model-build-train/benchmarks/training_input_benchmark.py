@@ -0,0 +1,120 @@
+"""Compares the time to the first boosting round of training jobs by input mode.
+
+Reads finished training jobs, given by name or as the training and tuning steps
+of pipeline executions, and reports for each the time spent downloading the
+channels, the time from the start of the job to the first round the XGBoost
+container logs, and the total training time. The medians are grouped by the
+input mode of the train channel, so executions with TrainingInputMode set to
+File, FastFile and Pipe show the effect of streaming.
+
+Example:
+    python benchmarks/training_input_benchmark.py \\
+        --pipeline-executions <execution arn of a File run> <execution arn of a FastFile run> \\
+        --output training-input-benchmark.json
+"""
+import argparse
+import json
+import logging
+import re
+import statistics
+
+import boto3
+
+logger = logging.getLogger(__name__)
+
+LOG_GROUP = "/aws/sagemaker/TrainingJobs"
+# first evaluation line of XGBoost, such as "[0]#011train-rmse:9.1 validation-rmse:9.2"
+FIRST_ROUND = re.compile(r"^\[0\]\s*(#011)?\s*\w+-")
+METRICS = ["download_seconds", "first_round_seconds", "training_seconds"]
+
+
+def get_pipeline_training_jobs(sm_client, execution_arn):
+    """Lists the training jobs run by the training and tuning steps of a pipeline execution."""
+    jobs = []
+    paginator = sm_client.get_paginator("list_pipeline_execution_steps")
+    for page in paginator.paginate(PipelineExecutionArn=execution_arn):
+        for step in page["PipelineExecutionSteps"]:
+            metadata = step.get("Metadata", {})
+            if "TrainingJob" in metadata:
+                jobs.append(metadata["TrainingJob"]["Arn"].rsplit("/", 1)[-1])
+            elif "TuningJob" in metadata:
+                tuning_job = metadata["TuningJob"]["Arn"].rsplit("/", 1)[-1]
+                summaries = sm_client.get_paginator(
+                    "list_training_jobs_for_hyper_parameter_tuning_job"
+                ).paginate(HyperParameterTuningJobName=tuning_job)
+                jobs += [s["TrainingJobName"] for p in summaries for s in p["TrainingJobSummaries"]]
+    return jobs
+
+
+def get_first_round_time(logs_client, job_name):
+    """Returns the epoch seconds of the first boosting round logged by any instance, or None."""
+    paginator = logs_client.get_paginator("filter_log_events")
+    times = []
+    for page in paginator.paginate(logGroupName=LOG_GROUP, logStreamNamePrefix=f"{job_name}/"):
+        times += [e["timestamp"] / 1000 for e in page["events"] if FIRST_ROUND.match(e["message"])]
+    return min(times) if times else None
+
+
+def measure_job(sm_client, logs_client, job_name):
+    """Returns the input mode and the timings of a finished training job."""
+    job = sm_client.describe_training_job(TrainingJobName=job_name)
+    channel_modes = {c["ChannelName"]: c.get("InputMode") for c in job["InputDataConfig"]}
+    start = job["TrainingStartTime"].timestamp()
+
+    download_seconds = None
+    for transition in job.get("SecondaryStatusTransitions", []):
+        if transition["Status"] == "Downloading" and "EndTime" in transition:
+            download_seconds = (transition["EndTime"] - transition["StartTime"]).total_seconds()
+
+    first_round = get_first_round_time(logs_client, job_name)
+    return {
+        "training_job": job_name,
+        "input_mode": channel_modes.get("train")
+        or job["AlgorithmSpecification"]["TrainingInputMode"],
+        "instance_count": job["ResourceConfig"]["InstanceCount"],
+        "download_seconds": download_seconds,
+        "first_round_seconds": None if first_round is None else first_round - start,
+        "training_seconds": job["TrainingEndTime"].timestamp() - start,
+    }
+
+
+def summarize(results):
+    """Returns the median of each timing over the jobs of each input mode."""
+    summary = {}
+    for mode in sorted({r["input_mode"] for r in results}):
+        jobs = [r for r in results if r["input_mode"] == mode]
+        summary[mode] = {"jobs": len(jobs)}
+        for metric in METRICS:
+            values = [r[metric] for r in jobs if r[metric] is not None]
+            summary[mode][metric] = statistics.median(values) if values else None
+    return summary
+
+
+def main():
+    """Measures the training jobs and reports the timings by input mode."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--training-jobs", nargs="*", default=[])
+    parser.add_argument("--pipeline-executions", nargs="*", default=[])
+    parser.add_argument("--output", default="training-input-benchmark.json")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    sm_client = boto3.client("sagemaker")
+    logs_client = boto3.client("logs")
+    jobs = list(args.training_jobs)
+    for execution_arn in args.pipeline_executions:
+        jobs += get_pipeline_training_jobs(sm_client, execution_arn)
+    if not jobs:
+        parser.error("no training jobs to measure")
+
+    results = [measure_job(sm_client, logs_client, job) for job in jobs]
+    report = {"results": results, "summary": summarize(results)}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for mode, timings in report["summary"].items():
+        logger.info("%s: %s", mode, json.dumps(timings))
+    logger.info("Wrote results to %s.", args.output)
+
+
+if __name__ == "__main__":
+    main()
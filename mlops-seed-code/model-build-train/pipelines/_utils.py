@@ -14,24 +14,107 @@
 from __future__ import absolute_import
 
 import ast
+import hashlib
+import importlib
+import json
 
 
 def get_pipeline_driver(module_name, passed_args=None):
     """Gets the driver for generating your pipeline definition.
 
-    Pipeline modules must define a get_pipeline() module-level method.
+    Pipeline modules must define a get_pipeline() module-level method. The module,
+    and with it the SageMaker SDK, is only imported when the driver is requested,
+    so the CLIs parse their arguments and fail on bad ones without that cost.
 
     Args:
         module_name: The module name of your pipeline.
-        passed_args: Optional passed arguments that your pipeline may be templated by.
+        passed_args: Optional passed arguments that your pipeline may be templated by,
+            as a dict string or a dict.
 
     Returns:
         The SageMaker Workflow pipeline.
     """
-    _imports = __import__(module_name, fromlist=["get_pipeline"])
-    kwargs = convert_struct(passed_args)
-    return _imports.get_pipeline(**kwargs)
+    module = importlib.import_module(module_name)
+    kwargs = passed_args if isinstance(passed_args, dict) else convert_struct(passed_args)
+    return module.get_pipeline(**kwargs)
 
 
 def convert_struct(str_struct=None):
     return ast.literal_eval(str_struct) if str_struct else {}
+
+
+def get_step_cache_keys(definition, parameters=None):
+    """Computes a cache key for each cached step of a pipeline definition.
+
+    Like SageMaker Pipelines, two executions of a step match when its arguments
+    are the same once the pipeline parameters are resolved. The property of an
+    upstream step resolves to that step's key, so a changed upstream step
+    changes the keys of everything downstream.
+
+    Args:
+        definition: the pipeline definition JSON string.
+        parameters: optional dict of parameter values overriding their defaults.
+
+    Returns:
+        A dict of the cache key of each step with caching enabled.
+    """
+    definition = json.loads(definition)
+    values = {p["Name"]: p.get("DefaultValue") for p in definition.get("Parameters", [])}
+    values.update(parameters or {})
+    step_keys = {}
+
+    def resolve(value):
+        if isinstance(value, dict):
+            reference = value.get("Get")
+            if isinstance(reference, str) and len(value) == 1:
+                kind, _, path = reference.partition(".")
+                if kind == "Parameters":
+                    return values[path]
+                if kind == "Steps":
+                    step, _, attribute = path.partition(".")
+                    return f"{step_keys.get(step, step)}.{attribute}"
+            return {k: resolve(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [resolve(v) for v in value]
+        return value
+
+    cache_keys = {}
+    for step in definition["Steps"]:
+        content = json.dumps([step["Type"], resolve(step.get("Arguments"))], sort_keys=True)
+        step_keys[step["Name"]] = hashlib.sha256(content.encode()).hexdigest()
+        if step.get("CacheConfig", {}).get("Enabled"):
+            cache_keys[step["Name"]] = step_keys[step["Name"]]
+    return cache_keys
+
+
+def get_parameter_values(definition, parameters=None):
+    """Returns the value of each pipeline parameter as a string, as executions list them.
+
+    Args:
+        definition: the pipeline definition JSON string.
+        parameters: optional dict of parameter values overriding their defaults.
+    """
+    values = {
+        p["Name"]: p.get("DefaultValue") for p in json.loads(definition).get("Parameters", [])
+    }
+    values.update(parameters or {})
+    return {name: str(value) for name, value in values.items()}
+
+
+def get_definition_hash(definition, parameters=None):
+    """Computes a hash of a pipeline definition and parameter values.
+
+    The definition is hashed in a canonical form, so definitions that differ only
+    in key order or whitespace have the same hash.
+
+    Args:
+        definition: the pipeline definition JSON string.
+        parameters: optional dict of parameter values, included in the hash.
+
+    Returns:
+        The SHA-256 hex digest.
+    """
+    content = json.dumps(
+        [json.loads(definition), parameters or {}], sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(content.encode()).hexdigest()
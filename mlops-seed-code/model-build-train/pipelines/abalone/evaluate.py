@@ -1,61 +1,732 @@
-"""Evaluation script for measuring mean squared error."""
+"""Evaluation script for measuring regression metrics overall and per segment."""
+import argparse
+import collections
+import contextlib
+import cProfile
+import glob
+import io
+import itertools
 import json
 import logging
+import os
 import pathlib
 import pickle
 import tarfile
+import time
+import tracemalloc
+
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
 import xgboost
 
-from sklearn.metrics import mean_squared_error
+from sklearn.datasets import load_svmlight_file
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.StreamHandler())
 
 
+DEFAULT_BATCH_SIZE = 100000
 
-if __name__ == "__main__":
-    logger.info("Starting evaluation.")
-    model_path = "/opt/ml/processing/model/model.tar.gz"
-    with tarfile.open(model_path) as tar:
-        tar.extractall(path=".")
-
-    logger.info("Loading xgboost model.")
-    model = pickle.load(open("xgboost-model", "rb"))
-
-    logger.info("Reading test data.")
-    test_path = "/opt/ml/processing/test/test.csv"
-    df = pd.read_csv(test_path, header=None)
-
-    logger.info("Reading test data.")
-    y_test = df.iloc[:, 0].to_numpy()
-    df.drop(df.columns[0], axis=1, inplace=True)
-    X_test = xgboost.DMatrix(df.values)
-
-    logger.info("Performing predictions against test data.")
-    predictions = model.predict(X_test)
-
-    logger.info("Calculating mean squared error.")
-    mse = mean_squared_error(y_test, predictions)
-    std = np.std(y_test - predictions)
-    report_dict = {
-        "regression_metrics": {
-            "mse": {
-                "value": mse,
-                "standard_deviation": std
+MODEL_FILE_NAME = "xgboost-model"
+NATIVE_MODEL_SUFFIXES = [".json", ".ubj"]
+PICKLE_MAGIC = b"\x80"
+
+# Layout of the features written by preprocess.py: the scaled numerics, then
+# the one-hot encoded sex in sorted category order.
+NUMERIC_FEATURE_COUNT = 7
+SEX_SEGMENTS = ["F", "I", "M", "missing", "unknown"]
+RINGS_BUCKET_EDGES = np.array([5, 10, 15, 20])
+RINGS_SEGMENTS = ["<5", "5-9", "10-14", "15-19", ">=20"]
+
+RESIDUAL_RANGE = 30.0
+QUANTILE_BIN_WIDTH = 0.01
+HISTOGRAM_BIN_WIDTH = 1.0
+RESIDUAL_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+DEFAULT_BOOTSTRAP_RESAMPLES = 1000
+BOOTSTRAP_BUCKETS = 10000
+BOOTSTRAP_BLOCK_SIZE = 100
+BOOTSTRAP_STATISTICS = ["count", "squares", "absolutes", "labels", "label_squares"]
+BOOTSTRAP_METRICS = ["mse", "rmse", "mae", "r2"]
+
+MOMENT_ARRAYS = ["count", "mean", "m2", "mean_square", "mean_abs", "label_mean", "label_m2"]
+
+# Written by SageMaker into every processing container.
+RESOURCE_CONFIG_PATH = "/opt/ml/config/resourceconfig.json"
+
+# Profiling mode used when --profile is not given.
+PROFILE_ENVIRONMENT_VARIABLE = "PROCESSING_PROFILE"
+PROFILE_MODES = ["off", "basic", "cprofile"]
+
+
+class PhaseProfiler:
+    """Sums wall time, CPU time and the tracemalloc peak of each phase of the evaluation.
+
+    Off by default, "basic" measures and "cprofile" also collects a cProfile
+    per phase. Phases are flat and may repeat, like the phases of each batch.
+    """
+
+    def __init__(self, mode="off"):
+        """Starts a profiler without phases in mode."""
+        self.mode = mode
+        self.phases = collections.OrderedDict()
+        self.profiles = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Measures the enclosed block as the phase name."""
+        if self.mode == "off":
+            yield
+            return
+        tracemalloc.stop()
+        tracemalloc.start()
+        profile = None
+        if self.mode == "cprofile":
+            profile = self.profiles.setdefault(name, cProfile.Profile())
+            profile.enable()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            if profile is not None:
+                profile.disable()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            totals = self.phases.setdefault(
+                name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_bytes": 0}
+            )
+            totals["calls"] += 1
+            totals["wall_seconds"] += wall
+            totals["cpu_seconds"] += cpu
+            totals["peak_bytes"] = max(totals["peak_bytes"], peak)
+
+    def write(self, output_dir, host):
+        """Writes profile-<host>.json and a <phase>-<host>.prof per cProfile to output_dir."""
+        if self.mode == "off":
+            return
+        pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
+        for name, totals in self.phases.items():
+            logger.info(
+                "Phase %s: %d calls, %.3fs wall, %.3fs CPU, %.1f MiB peak.",
+                name,
+                totals["calls"],
+                totals["wall_seconds"],
+                totals["cpu_seconds"],
+                totals["peak_bytes"] / 2 ** 20,
+            )
+        with open(f"{output_dir}/profile-{host}.json", "w") as f:
+            json.dump({"host": host, "mode": self.mode, "phases": self.phases}, f, indent=2)
+        for name, profile in self.profiles.items():
+            profile.dump_stats(f"{output_dir}/{name}-{host}.prof")
+
+
+profiler = PhaseProfiler()
+
+
+def iter_test_batches(test_dir, batch_size=DEFAULT_BATCH_SIZE):
+    """Yields the labels and features of the test part files in test_dir batch by batch.
+
+    The part files are CSV or libsvm as written by preprocess.py, with the label
+    in the first column. Parquet files are read too where pyarrow is installed.
+    """
+    for path in sorted(glob.glob(f"{test_dir}/*")):
+        logger.info("Reading %s.", path)
+        if path.endswith(".libsvm"):
+            batches = iter_libsvm_batches(path, batch_size)
+        elif path.endswith(".parquet"):
+            # the XGBoost container does not ship pyarrow, preprocess.py never writes the
+            # test split as Parquet
+            import pyarrow.parquet as pq
+
+            batches = (
+                batch.to_pandas().to_numpy()
+                for batch in pq.ParquetFile(path).iter_batches(batch_size)
+            )
+        else:
+            batches = (df.to_numpy() for df in pd.read_csv(path, header=None, chunksize=batch_size))
+        for batch in batches:
+            if isinstance(batch, tuple):
+                yield batch
+            else:
+                yield batch[:, 0], batch[:, 1:]
+
+
+def iter_libsvm_batches(path, batch_size):
+    """Yields the labels and sparse features of a libsvm file batch_size lines at a time."""
+    with open(path, "rb") as f:
+        while True:
+            lines = list(itertools.islice(f, batch_size))
+            if not lines:
+                return
+            X, y = load_svmlight_file(io.BytesIO(b"".join(lines)), zero_based=True)
+            yield y, X
+
+
+def merge_moments(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    """Merges counts, means and sums of squared deviations elementwise (Chan et al.)."""
+    n = n_a + n_b
+    weight = np.divide(n_b, n, out=np.zeros_like(n), where=n > 0)
+    delta = mean_b - mean_a
+    return mean_a + delta * weight, m2_a + m2_b + delta ** 2 * n_a * weight
+
+
+class RegressionMoments:
+    """Running moments of the labels and residuals of an array of segments.
+
+    Each batch is reduced per segment with np.bincount and merged into the
+    running values with the parallel form of Welford's algorithm, so memory is
+    bounded by the batch.
+    """
+
+    def __init__(self, shape=(1,)):
+        """Starts zero moments for an array of segments of shape."""
+        self.shape = shape
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.mean_square = np.zeros(shape)
+        self.mean_abs = np.zeros(shape)
+        self.label_mean = np.zeros(shape)
+        self.label_m2 = np.zeros(shape)
+
+    def update(self, y, predictions, segments=None):
+        """Merges a batch of labels and predictions, segments holds their flat segment indices."""
+        size = self.count.size
+        if segments is None:
+            segments = np.zeros(len(y), dtype=np.intp)
+        residuals = y - predictions
+        n_b = np.bincount(segments, minlength=size).astype(float)
+
+        def segment_mean(values):
+            sums = np.bincount(segments, weights=values, minlength=size)
+            return np.divide(sums, n_b, out=np.zeros_like(sums), where=n_b > 0)
+
+        def segment_m2(values, means):
+            return np.bincount(
+                segments, weights=np.square(values - means[segments]), minlength=size
+            )
+
+        mean_b = segment_mean(residuals)
+        label_mean_b = segment_mean(y)
+        n_a = self.count.ravel()
+        n = n_a + n_b
+        weight = np.divide(n_b, n, out=np.zeros_like(n), where=n > 0)
+        mean_square = self.mean_square.ravel()
+        mean_square += (segment_mean(np.square(residuals)) - mean_square) * weight
+        mean_abs = self.mean_abs.ravel()
+        mean_abs += (segment_mean(np.abs(residuals)) - mean_abs) * weight
+        mean, m2 = merge_moments(
+            n_a, self.mean.ravel(), self.m2.ravel(), n_b, mean_b, segment_m2(residuals, mean_b)
+        )
+        label_mean, label_m2 = merge_moments(
+            n_a,
+            self.label_mean.ravel(),
+            self.label_m2.ravel(),
+            n_b,
+            label_mean_b,
+            segment_m2(y, label_mean_b),
+        )
+        self.count = n.reshape(self.shape)
+        self.mean_square = mean_square.reshape(self.shape)
+        self.mean_abs = mean_abs.reshape(self.shape)
+        self.mean = mean.reshape(self.shape)
+        self.m2 = m2.reshape(self.shape)
+        self.label_mean = label_mean.reshape(self.shape)
+        self.label_m2 = label_m2.reshape(self.shape)
+
+    def merge(self, other):
+        """Merges the moments of the same segments accumulated elsewhere."""
+        n = self.count + other.count
+        weight = np.divide(other.count, n, out=np.zeros_like(n), where=n > 0)
+        self.mean_square += (other.mean_square - self.mean_square) * weight
+        self.mean_abs += (other.mean_abs - self.mean_abs) * weight
+        self.mean, self.m2 = merge_moments(
+            self.count, self.mean, self.m2, other.count, other.mean, other.m2
+        )
+        self.label_mean, self.label_m2 = merge_moments(
+            self.count,
+            self.label_mean,
+            self.label_m2,
+            other.count,
+            other.label_mean,
+            other.label_m2,
+        )
+        self.count = n
+
+    def reduce(self, axis):
+        """Returns the moments with the segments along axis merged together."""
+        count = self.count.sum(axis=axis, keepdims=True)
+        weights = np.divide(self.count, count, out=np.zeros_like(self.count), where=count > 0)
+        reduced = RegressionMoments(np.squeeze(count, axis=axis).shape or (1,))
+
+        def merged_mean(values):
+            return (values * weights).sum(axis=axis).reshape(reduced.shape)
+
+        def merged_m2(m2, mean, merged):
+            deviations = self.count * (mean - merged.reshape(count.shape)) ** 2
+            return (m2 + deviations).sum(axis=axis).reshape(reduced.shape)
+
+        reduced.count = count.reshape(reduced.shape)
+        reduced.mean_square = merged_mean(self.mean_square)
+        reduced.mean_abs = merged_mean(self.mean_abs)
+        reduced.mean = merged_mean(self.mean)
+        reduced.m2 = merged_m2(self.m2, self.mean, reduced.mean)
+        reduced.label_mean = merged_mean(self.label_mean)
+        reduced.label_m2 = merged_m2(self.label_m2, self.label_mean, reduced.label_mean)
+        return reduced
+
+    def metrics(self, segment=0):
+        """Returns the count, MSE, RMSE, MAE, R² and residual mean and deviation of a segment."""
+        count = self.count[segment]
+        mse = self.mean_square[segment]
+        label_m2 = self.label_m2[segment]
+        return {
+            "count": int(count),
+            "mse": mse,
+            "rmse": np.sqrt(mse),
+            "mae": self.mean_abs[segment],
+            "r2": 1 - mse * count / label_m2 if label_m2 else None,
+            "residual_mean": self.mean[segment],
+            "residual_standard_deviation": np.sqrt(self.m2[segment] / count),
+        }
+
+
+class ResidualHistogram:
+    """Counts of the residuals in fine fixed-width bins, with underflow and overflow bins.
+
+    Quantiles are interpolated within a bin, so they are exact to the bin width.
+    """
+
+    def __init__(self, low=-RESIDUAL_RANGE, high=RESIDUAL_RANGE, width=QUANTILE_BIN_WIDTH):
+        """Starts empty bins of width from low to high."""
+        self.low = low
+        self.width = width
+        self.bins = int(round((high - low) / width))
+        self.counts = np.zeros(self.bins + 2, dtype=np.int64)
+
+    def update(self, residuals):
+        """Counts a batch of residuals."""
+        index = np.floor((residuals - self.low) / self.width)
+        index = np.clip(index, -1, self.bins).astype(np.intp) + 1
+        self.counts += np.bincount(index, minlength=len(self.counts))
+
+    def merge(self, other):
+        """Adds the counts of a histogram with the same bins."""
+        self.counts += other.counts
+
+    def quantiles(self, qs):
+        """Returns the interpolated quantiles qs, clamped to the histogram range."""
+        cumulative = np.cumsum(self.counts[1:-1]) + self.counts[0]
+        ranks = np.asarray(qs) * self.counts.sum()
+        index = np.clip(np.searchsorted(cumulative, ranks), 0, self.bins - 1)
+        below = np.where(index > 0, cumulative[index - 1], self.counts[0])
+        inside = self.counts[1:-1][index]
+        fraction = np.clip(
+            np.divide(ranks - below, inside, out=np.zeros_like(ranks), where=inside > 0), 0, 1
+        )
+        return self.low + (index + fraction) * self.width
+
+    def coarse(self, width):
+        """Returns the edges and counts of bins merged to width, the outer bins open-ended."""
+        factor = int(round(width / self.width))
+        counts = self.counts[1:-1].reshape(-1, factor).sum(axis=1)
+        counts[0] += self.counts[0]
+        counts[-1] += self.counts[-1]
+        edges = self.low + np.arange(len(counts) + 1) * width
+        return edges, counts
+
+
+class BootstrapBuckets:
+    """Sums of the residual and label statistics of rows dealt round-robin into buckets.
+
+    The rows are already shuffled by the split, so resampling the buckets with
+    replacement is a bootstrap of the rows with a cost independent of their
+    number, and an exact row bootstrap while there are no more rows than buckets.
+    """
+
+    def __init__(self, buckets=BOOTSTRAP_BUCKETS):
+        """Starts the given number of buckets with zero sums."""
+        self.rows = 0
+        self.label_shift = None
+        self.sums = np.zeros((buckets, len(BOOTSTRAP_STATISTICS)))
+
+    def update(self, y, predictions):
+        """Adds a batch of labels and predictions."""
+        if self.label_shift is None:
+            # labels are summed around the first batch's mean to keep R² accurate
+            self.label_shift = float(np.mean(y)) if len(y) else 0.0
+        residuals = y - predictions
+        shifted = y - self.label_shift
+        buckets = (self.rows + np.arange(len(y))) % len(self.sums)
+        for j, values in enumerate(
+            [np.ones(len(y)), np.square(residuals), np.abs(residuals), shifted, np.square(shifted)]
+        ):
+            self.sums[:, j] += np.bincount(buckets, weights=values, minlength=len(self.sums))
+        self.rows += len(y)
+
+    def merge(self, other):
+        """Adds the bucket sums of another part of the test set.
+
+        The other sums are shifted to this label shift first, bucket i of each
+        part still holds a random subset of the rows.
+        """
+        if other.label_shift is None:
+            return
+        if self.label_shift is None:
+            self.label_shift = other.label_shift
+        count, squares, absolutes, labels, label_squares = other.sums.T
+        shift = other.label_shift - self.label_shift
+        shifted_squares = label_squares + 2 * shift * labels + shift ** 2 * count
+        shifted = np.column_stack(
+            [count, squares, absolutes, labels + shift * count, shifted_squares]
+        )
+        self.sums += shifted
+        self.rows += other.rows
+
+    def confidence_intervals(self, resamples, seed=None, level=0.95, workers=None):
+        """Returns the percentile bootstrap interval of each of BOOTSTRAP_METRICS.
+
+        The resamples are drawn in blocks of BOOTSTRAP_BLOCK_SIZE, each seeded
+        from seed and its index so the intervals do not depend on workers, and
+        spread over a process pool of workers processes. Without rows there is
+        nothing to resample and no intervals are returned.
+        """
+        if self.rows == 0:
+            return {}
+        sums = self.sums[self.sums[:, 0] > 0]
+        entropy = np.random.SeedSequence(seed).entropy
+        sizes = [
+            min(BOOTSTRAP_BLOCK_SIZE, resamples - start)
+            for start in range(0, resamples, BOOTSTRAP_BLOCK_SIZE)
+        ]
+        blocks = len(sizes)
+        with ProcessPoolExecutor(workers) as executor:
+            metrics = np.concatenate(
+                list(
+                    executor.map(
+                        bootstrap_block, [sums] * blocks, sizes, [entropy] * blocks, range(blocks)
+                    )
+                )
+            )
+        alpha = (1 - level) / 2
+        lower, upper = np.nanquantile(metrics, [alpha, 1 - alpha], axis=0)
+        return {
+            name: {"lower": lower[j], "upper": upper[j]} for j, name in enumerate(BOOTSTRAP_METRICS)
+        }
+
+
+def bootstrap_block(sums, size, entropy, block):
+    """Returns the BOOTSTRAP_METRICS of size resamples of the bucket sums."""
+    rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(block,)))
+    buckets = len(sums)
+    weights = rng.multinomial(buckets, np.full(buckets, 1 / buckets), size=size)
+    count, squares, absolutes, labels, label_squares = (weights @ sums).T
+    mse = squares / count
+    label_m2 = label_squares - np.square(labels) / count
+    r2 = 1 - np.divide(squares, label_m2, out=np.full(size, np.nan), where=label_m2 > 0)
+    return np.column_stack([mse, np.sqrt(mse), absolutes / count, r2])
+
+
+def get_sex_segments(X):
+    """Indexes SEX_SEGMENTS from the one-hot sex columns following the numeric features."""
+    onehot = X[:, NUMERIC_FEATURE_COUNT:]
+    # a row's code is the position of its one, counted from 1, or 0 without one
+    codes = np.asarray(onehot @ np.arange(1, onehot.shape[1] + 1, dtype=onehot.dtype))
+    codes = codes.ravel().astype(np.intp)
+    return np.where(codes > 0, codes - 1, len(SEX_SEGMENTS) - 1)
+
+
+def get_rings_segments(y):
+    """Indexes RINGS_SEGMENTS from the labels."""
+    return np.searchsorted(RINGS_BUCKET_EDGES, y, side="right")
+
+
+class RegressionEvaluation:
+    """Accumulates the metrics per sex and rings segment and the residual histogram.
+
+    A single pass keeps the moments of every (sex, rings) pair, the per sex,
+    per rings and overall metrics are exact merges of those.
+    """
+
+    def __init__(self):
+        """Starts empty moments, histogram and bootstrap buckets."""
+        self.moments = RegressionMoments((len(SEX_SEGMENTS), len(RINGS_SEGMENTS)))
+        self.histogram = ResidualHistogram()
+        self.bootstrap = BootstrapBuckets()
+
+    def update(self, y, predictions, X):
+        """Merges a batch of labels, predictions and features."""
+        segments = get_sex_segments(X) * len(RINGS_SEGMENTS) + get_rings_segments(y)
+        self.moments.update(y, predictions, segments)
+        self.histogram.update(y - predictions)
+        self.bootstrap.update(y, predictions)
+
+    def merge(self, other):
+        """Merges the evaluation of another part of the test set."""
+        self.moments.merge(other.moments)
+        self.histogram.merge(other.histogram)
+        self.bootstrap.merge(other.bootstrap)
+
+    def to_bytes(self):
+        """Serializes the accumulated state, the partial result of one instance."""
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            histogram=self.histogram.counts,
+            bootstrap_rows=self.bootstrap.rows,
+            bootstrap_label_shift=(
+                np.nan if self.bootstrap.label_shift is None else self.bootstrap.label_shift
+            ),
+            bootstrap_sums=self.bootstrap.sums,
+            **{f"moments_{name}": getattr(self.moments, name) for name in MOMENT_ARRAYS},
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Restores an evaluation serialized by to_bytes()."""
+        evaluation = cls()
+        with np.load(io.BytesIO(data)) as f:
+            evaluation.histogram.counts = f["histogram"]
+            evaluation.bootstrap.rows = int(f["bootstrap_rows"])
+            label_shift = float(f["bootstrap_label_shift"])
+            evaluation.bootstrap.label_shift = None if np.isnan(label_shift) else label_shift
+            evaluation.bootstrap.sums = f["bootstrap_sums"]
+            for name in MOMENT_ARRAYS:
+                setattr(evaluation.moments, name, f[f"moments_{name}"])
+        return evaluation
+
+    def report(self, resamples=0, seed=None, level=0.95, workers=None):
+        """Returns the evaluation report, regression_metrics.mse as before.
+
+        With resamples, confidence_intervals holds the bootstrap intervals of
+        the regression metrics at the confidence level, it is left out for an
+        empty test set.
+        """
+        metrics = self.moments.reduce((0, 1)).metrics()
+        edges, counts = self.histogram.coarse(HISTOGRAM_BIN_WIDTH)
+        report = {
+            "regression_metrics": {
+                "mse": {
+                    "value": metrics["mse"],
+                    "standard_deviation": metrics["residual_standard_deviation"],
+                },
+                "rmse": {"value": metrics["rmse"]},
+                "mae": {"value": metrics["mae"]},
+                "r2": {"value": metrics["r2"]},
+            },
+            "residuals": {
+                "mean": metrics["residual_mean"],
+                "quantiles": dict(
+                    zip(
+                        [f"p{round(q * 100):02d}" for q in RESIDUAL_QUANTILES],
+                        self.histogram.quantiles(RESIDUAL_QUANTILES).tolist(),
+                    )
+                ),
+                "histogram": {"edges": edges.tolist(), "counts": counts.tolist()},
+            },
+            "segments": {
+                "sex": segment_metrics(self.moments.reduce(1), SEX_SEGMENTS),
+                "rings": segment_metrics(self.moments.reduce(0), RINGS_SEGMENTS),
             },
-        },
-    }
+        }
+        intervals = resamples and self.bootstrap.confidence_intervals(
+            resamples, seed, level, workers
+        )
+        if intervals:
+            report["confidence_intervals"] = {
+                "confidence_level": level,
+                "resamples": resamples,
+                **intervals,
+            }
+        return report
+
+
+def segment_metrics(moments, names):
+    """Returns the metrics of the non-empty segments by name."""
+    return {name: moments.metrics(i) for i, name in enumerate(names) if moments.count[i] > 0}
+
+
+def evaluate(model, test_dir, batch_size=DEFAULT_BATCH_SIZE):
+    """Predicts the test set batch by batch and returns the accumulated evaluation."""
+    evaluation = RegressionEvaluation()
+    batches = iter_test_batches(test_dir, batch_size)
+    while True:
+        with profiler.phase("read"):
+            batch = next(batches, None)
+        if batch is None:
+            return evaluation
+        y, X = batch
+        with profiler.phase("predict"):
+            predictions = model.predict(xgboost.DMatrix(X))
+        with profiler.phase("metrics"):
+            evaluation.update(y, predictions, X)
+
+
+def read_model_bytes(model_path):
+    """Reads the model file out of the model.tar.gz stream into memory.
+
+    A native XGBoost JSON or UBJSON file is preferred over the xgboost-model
+    file written by the training container.
+    """
+    with tarfile.open(model_path, "r:*") as tar:
+        members = {os.path.normpath(m.name): m for m in tar.getmembers() if m.isfile()}
+        for suffix in NATIVE_MODEL_SUFFIXES:
+            native = sorted(name for name in members if name.endswith(suffix))
+            if native:
+                return tar.extractfile(members[native[0]]).read()
+        if MODEL_FILE_NAME not in members:
+            raise ValueError(f"No model file in {model_path}: {sorted(members)}")
+        return tar.extractfile(members[MODEL_FILE_NAME]).read()
+
+
+def load_booster(data):
+    """Loads a booster from its native format, or unpickles it from older containers."""
+    if not data.startswith(PICKLE_MAGIC):
+        booster = xgboost.Booster()
+        try:
+            booster.load_model(bytearray(data))
+            return booster
+        except xgboost.core.XGBoostError:
+            logger.info("The model is not in a native format, unpickling it.")
+    return pickle.loads(data)
+
+
+_model_cache = {}
+
+
+def load_model(model_path):
+    """Returns the booster in model_path, loaded once per process and file version."""
+    stat = os.stat(model_path)
+    key = (os.path.abspath(model_path), stat.st_mtime_ns, stat.st_size)
+    if key not in _model_cache:
+        _model_cache[key] = load_booster(read_model_bytes(model_path))
+    return _model_cache[key]
+
+
+def get_current_host(path=RESOURCE_CONFIG_PATH):
+    """Returns the name of the current host of the processing job."""
+    if not os.path.exists(path):
+        return "algo-1"
+    with open(path) as f:
+        return json.load(f)["current_host"]
+
+
+def reduce_partials(partials_dir):
+    """Merges the partial evaluations written by every instance of the map stage."""
+    paths = sorted(glob.glob(f"{partials_dir}/*.npz"))
+    if not paths:
+        raise ValueError(f"No partial evaluations in {partials_dir}")
+    evaluation = RegressionEvaluation()
+    for path in paths:
+        logger.info("Merging %s.", path)
+        with open(path, "rb") as f:
+            evaluation.merge(RegressionEvaluation.from_bytes(f.read()))
+    return evaluation
+
+
+def main():
+    """Evaluates the model on the test set and writes evaluation.json.
+
+    With --partial-output this instance only scores its shard of the test set
+    and writes its partial evaluation, with --reduce-input the partials of all
+    instances are merged into evaluation.json.
+    """
+    logger.info("Starting evaluation.")
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="Rows of the test set read and predicted at a time.",
+    )
+    parser.add_argument(
+        "--bootstrap-resamples",
+        type=int,
+        default=DEFAULT_BOOTSTRAP_RESAMPLES,
+        help="Bootstrap resamples of the confidence intervals, 0 skips them.",
+    )
+    parser.add_argument("--bootstrap-seed", type=int, default=None)
+    parser.add_argument("--confidence-level", type=float, default=0.95)
+    parser.add_argument(
+        "--bootstrap-workers",
+        type=int,
+        default=None,
+        help="Processes drawing the resamples, all cores by default.",
+    )
+    parser.add_argument(
+        "--partial-output",
+        type=str,
+        default=None,
+        help="Map stage: write the partial evaluation of this instance's shard to this directory.",
+    )
+    parser.add_argument(
+        "--reduce-input",
+        type=str,
+        default=None,
+        help="Reduce stage: merge the partial evaluations in this directory.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=os.environ.get(PROFILE_ENVIRONMENT_VARIABLE, "off"),
+        choices=PROFILE_MODES,
+        help="Time and trace the memory of each phase into profile/, cprofile also dumps cProfile.",
+    )
+    args = parser.parse_args()
+    profiler.mode = args.profile
+    profile_dir = "/opt/ml/processing/profile"
+
+    if args.reduce_input:
+        logger.info("Merging the partial evaluations in %s.", args.reduce_input)
+        with profiler.phase("reduce"):
+            evaluation = reduce_partials(args.reduce_input)
+    else:
+        logger.info("Loading xgboost model.")
+        with profiler.phase("load_model"):
+            model = load_model("/opt/ml/processing/model/model.tar.gz")
+
+        logger.info("Performing predictions against test data in batches of %d.", args.batch_size)
+        evaluation = evaluate(model, "/opt/ml/processing/test", args.batch_size)
+
+    if args.partial_output:
+        pathlib.Path(args.partial_output).mkdir(parents=True, exist_ok=True)
+        partial_path = f"{args.partial_output}/partial-{get_current_host()}.npz"
+        logger.info("Writing out the partial evaluation to %s.", partial_path)
+        with open(partial_path, "wb") as f:
+            f.write(evaluation.to_bytes())
+        profiler.write(profile_dir, get_current_host())
+        return
+
+    logger.info("Calculating regression metrics.")
+    with profiler.phase("report"):
+        report_dict = evaluation.report(
+            args.bootstrap_resamples,
+            args.bootstrap_seed,
+            args.confidence_level,
+            args.bootstrap_workers,
+        )
+    mse = report_dict["regression_metrics"]["mse"]["value"]
+    std = report_dict["regression_metrics"]["mse"]["standard_deviation"]
 
     output_dir = "/opt/ml/processing/evaluation"
     pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
 
     logger.info("Writing out evaluation report with mse: %f and std: %f", mse, std)
+    if "confidence_intervals" in report_dict:
+        interval = report_dict["confidence_intervals"]["mse"]
+        logger.info("MSE confidence interval: [%f, %f]", interval["lower"], interval["upper"])
     evaluation_path = f"{output_dir}/evaluation.json"
     with open(evaluation_path, "w") as f:
         f.write(json.dumps(report_dict))
+    profiler.write(profile_dir, get_current_host())
 
-    logger.info("Model evaluation completed.")
\ No newline at end of file
+    logger.info("Model evaluation completed.")
+
+
+if __name__ == "__main__":
+    main()
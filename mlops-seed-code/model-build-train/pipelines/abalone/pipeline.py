@@ -9,73 +9,52 @@
 Implements a get_pipeline(**kwargs) method.
 """
 import os
+import hashlib
 import json
-import boto3
-import sagemaker
-import sagemaker.session
-
-from sagemaker.estimator import Estimator
-from sagemaker.inputs import TrainingInput
-from sagemaker.model_metrics import (
-    MetricsSource,
-    ModelMetrics,
-)
-from sagemaker.processing import (
-    ProcessingInput,
-    ProcessingOutput,
-    ScriptProcessor,
-)
-from sagemaker.sklearn.processing import SKLearnProcessor
-from sagemaker.workflow.conditions import ConditionLessThanOrEqualTo
-from sagemaker.workflow.condition_step import (
-    ConditionStep,
-    JsonGet,
-)
-from sagemaker.workflow.parameters import (
-    ParameterInteger,
-    ParameterString,
-)
-from sagemaker.workflow.pipeline import Pipeline
-from sagemaker.workflow.properties import PropertyFile
-from sagemaker.workflow.steps import (
-    ProcessingStep,
-    TrainingStep,
-)
-from sagemaker.workflow.step_collections import RegisterModel
-from sagemaker.network import NetworkConfig
 
+# the SageMaker SDK and boto3 take seconds to import, so they are imported by the
+# functions that use them and importing this module for its constants stays fast
+from pipelines.environment import get_environment, load_environment_file
 
-BASE_DIR = os.path.dirname(os.path.realpath(__file__))
-
-def get_environment(project_name, ssm_params):
-    sm = boto3.client("sagemaker")
-    ssm = boto3.client("ssm")
 
-    r = sm.describe_domain(
-            DomainId=sm.describe_project(
-                ProjectName=project_name
-                )["CreatedBy"]["DomainId"]
-        )
-    del r["ResponseMetadata"]
-    del r["CreationTime"]
-    del r["LastModifiedTime"]
-    r = {**r, **r["DefaultUserSettings"]}
-    del r["DefaultUserSettings"]
-
-    i = {
-        **r,
-        **{t["Key"]:t["Value"] 
-            for t in sm.list_tags(ResourceArn=r["DomainArn"])["Tags"] 
-            if t["Key"] in ["EnvironmentName", "EnvironmentType"]}
-    }
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 
-    for p in ssm_params:
-        try:
-            i[p["VariableName"]] = ssm.get_parameter(Name=f"{i['EnvironmentName']}-{i['EnvironmentType']}-{p['ParameterName']}")["Parameter"]["Value"]
-        except:
-            i[p["VariableName"]] = ""
+# Content type of the XGBoost training channels for each preprocess.py output format
+TRAINING_CONTENT_TYPES = {
+    "csv": "text/csv",
+    "libsvm": "text/libsvm",
+    "parquet": "application/x-parquet",
+    "recordio-protobuf": "application/x-recordio-protobuf",
+}
+
+# Input modes of the training channels. Pipe streams the concatenated part files of a
+# channel, which the XGBoost container parses for CSV and RecordIO-protobuf only.
+TRAINING_INPUT_MODES = ["File", "FastFile", "Pipe"]
+PIPE_MODE_FORMATS = ["csv", "recordio-protobuf"]
+
+# Hyperparameters of the XGBoost training job, training_hyperparameters overrides them
+DEFAULT_HYPERPARAMETERS = {
+    "objective": "reg:linear",
+    "num_round": 50,
+    "max_depth": 5,
+    "eta": 0.2,
+    "gamma": 4,
+    "min_child_weight": 6,
+    "subsample": 0.7,
+    "silent": 0,
+}
+
+# Ranges searched by the optional tuning stage, as (type, min, max) of each hyperparameter
+TUNING_HYPERPARAMETER_RANGES = {
+    "eta": ("continuous", 0.05, 0.5),
+    "max_depth": ("integer", 3, 10),
+    "min_child_weight": ("continuous", 1, 10),
+    "subsample": ("continuous", 0.5, 1.0),
+    "gamma": ("continuous", 0, 5),
+}
+TUNING_STRATEGIES = ["Bayesian", "Hyperband"]
+TUNING_OBJECTIVE_METRIC = "validation:rmse"
 
-    return i
 
 def get_session(region, default_bucket):
     """Gets the sagemaker session based on the region.
@@ -87,6 +66,8 @@ def get_session(region, default_bucket):
     Returns:
         sagemaker.session.Session instance
     """
+    import boto3
+    import sagemaker.session
 
     boto_session = boto3.Session(region_name=region)
 
@@ -99,12 +80,130 @@ def get_session(region, default_bucket):
         default_bucket=default_bucket,
     )
 
+
+def get_offline_session(region, default_bucket):
+    """Gets a sagemaker session that renders a pipeline definition without AWS calls.
+
+    The default bucket is taken as given instead of being looked up or created, and
+    uploads only return the S3 URI the data would be uploaded to.
+
+    Args:
+        region: the aws region of the pipeline
+        default_bucket: the bucket to use for storing the artifacts
+
+    Returns:
+        sagemaker.session.Session instance
+    """
+    import boto3
+    import sagemaker.session
+
+    class OfflineSession(sagemaker.session.Session):
+        def default_bucket(self):
+            return default_bucket
+
+        def upload_data(self, path, bucket=None, key_prefix="data", extra_args=None):
+            return f"s3://{bucket or default_bucket}/{key_prefix}/{os.path.basename(path)}"
+
+    return OfflineSession(
+        boto_session=boto3.Session(region_name=region), default_bucket=default_bucket
+    )
+
+
+def upload_code(sagemaker_session, path, bucket, prefix):
+    """Uploads a processing script under a key derived from its content.
+
+    The SDK uploads code under the timestamped job name, which changes the
+    step arguments of every definition and so defeats step caching.
+
+    Returns:
+        the S3 URI of the script
+    """
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return sagemaker_session.upload_data(
+        path=path, bucket=bucket, key_prefix=f"{prefix}/code/{digest}"
+    )
+
+
+def get_tuning_step(
+    estimator, inputs, strategy, max_jobs, max_parallel_jobs, num_round, cache_config
+):
+    """Gets a tuning step searching TUNING_HYPERPARAMETER_RANGES for the lowest validation RMSE.
+
+    Bayesian search stops unpromising training jobs early with automatic early stopping,
+    Hyperband with its own early stopping over 1/10 to all of the boosting rounds.
+
+    Returns:
+        sagemaker.workflow.steps.TuningStep instance
+    """
+    # tuning steps and Hyperband need a newer SDK than the training-only pipeline
+    from sagemaker.tuner import (
+        ContinuousParameter,
+        HyperbandStrategyConfig,
+        HyperparameterTuner,
+        IntegerParameter,
+        StrategyConfig,
+    )
+    from sagemaker.workflow.steps import TuningStep
+
+    parameter_types = {"continuous": ContinuousParameter, "integer": IntegerParameter}
+    strategy_config = None
+    if strategy == "Hyperband":
+        strategy_config = StrategyConfig(
+            hyperband_strategy_config=HyperbandStrategyConfig(
+                max_resource=num_round, min_resource=max(1, num_round // 10)
+            )
+        )
+    tuner = HyperparameterTuner(
+        estimator=estimator,
+        objective_metric_name=TUNING_OBJECTIVE_METRIC,
+        objective_type="Minimize",
+        hyperparameter_ranges={
+            name: parameter_types[kind](min_value, max_value)
+            for name, (kind, min_value, max_value) in TUNING_HYPERPARAMETER_RANGES.items()
+        },
+        strategy=strategy,
+        strategy_config=strategy_config,
+        max_jobs=max_jobs,
+        max_parallel_jobs=max_parallel_jobs,
+        # Hyperband stops jobs itself and rejects the automatic early stopping
+        early_stopping_type="Off" if strategy == "Hyperband" else "Auto",
+    )
+    return TuningStep(
+        name="TuneAbaloneModel",
+        tuner=tuner,
+        inputs=inputs,
+        cache_config=cache_config,
+    )
+
+
 def get_pipeline(
     region,
     project_name=None,
     model_package_group_name="AbalonePackageGroup",
     pipeline_name="AbalonePipeline",
     base_job_prefix="Abalone",
+    preprocess_chunk_size=0,
+    output_format="csv",
+    output_float32=False,
+    split_seed=42,
+    split_stratify_bins=0,
+    preprocess_cache=True,
+    preprocess_compact_dtypes=False,
+    split_parts=1,
+    split_write_workers=1,
+    split_write_executor="thread",
+    bootstrap_resamples=1000,
+    bootstrap_seed=0,
+    evaluation_instance_count=1,
+    profile="off",
+    training_hyperparameters=None,
+    step_caching=False,
+    cache_expire_after="P30D",
+    tuning_strategy=None,
+    tuning_max_jobs=20,
+    tuning_max_parallel_jobs=4,
+    environment_file=None,
 ):
     """Gets a SageMaker ML Pipeline instance working with on abalone data.
 
@@ -113,10 +212,75 @@ def get_pipeline(
         processing_role: IAM role to create and run processing steps
         training_role: IAM role to create and run training steps
         data_bucket: the bucket to use for storing the artifacts
+        preprocess_chunk_size: rows per chunk for out-of-core preprocessing, 0 loads the input at once
+        output_format: format of the data splits, one of TRAINING_CONTENT_TYPES, the Pipe
+            TrainingInputMode needs one of PIPE_MODE_FORMATS
+        output_float32: write the data splits with 32-bit floats
+        split_seed: seed of the train/validation/test split, None for a new split on every run
+        split_stratify_bins: stratify the split on this many quantile bins of rings, 0 disables
+        preprocess_cache: reuse the datasets of a previous run with the same input, code and split
+        preprocess_compact_dtypes: parse numerics as float32 and sex as a categorical
+        split_parts: part files per data split, at least the largest TrainingInstanceCount
+            so that every training instance gets part files of its own
+        split_write_workers: part files written concurrently by the preprocessing job
+        split_write_executor: "thread" or "process", processes need the in-memory mode
+        bootstrap_resamples: bootstrap resamples of the evaluation metrics, the model is
+            registered if the upper bound of the MSE interval passes, 0 gates on the MSE itself
+        bootstrap_seed: seed of the bootstrap resamples
+        evaluation_instance_count: instances scoring shards of the test part files, above 1 a
+            single-instance step merges their partial results, best with split_parts above 1
+        profile: "basic" or "cprofile" to profile the phases of the processing scripts into an
+            extra profile output of each processing step, "off" by default
+        training_hyperparameters: dict of XGBoost hyperparameters overriding DEFAULT_HYPERPARAMETERS
+        step_caching: reuse the results of a previous execution of a step with the same
+            arguments, preprocessing is only cached with a split_seed. The arguments hold the
+            InputDataUrl but not its content, so only enable it when new data gets a new URL
+        cache_expire_after: ISO 8601 duration after which a cached step result is not reused
+        tuning_strategy: "Bayesian" or "Hyperband" to replace the training step with a tuning
+            job over TUNING_HYPERPARAMETER_RANGES, whose best model is evaluated and registered
+        tuning_max_jobs: training jobs of the tuning job
+        tuning_max_parallel_jobs: training jobs the tuning job runs at the same time
+        environment_file: JSON file with the environment values to render the definition
+            offline, without any AWS calls, instead of reading them from the project
 
     Returns:
         an instance of a pipeline
     """
+    import sagemaker
+    import sagemaker.session
+
+    from sagemaker.estimator import Estimator
+    from sagemaker.inputs import TrainingInput
+    from sagemaker.model_metrics import (
+        MetricsSource,
+        ModelMetrics,
+    )
+    from sagemaker.processing import (
+        ProcessingInput,
+        ProcessingOutput,
+        ScriptProcessor,
+    )
+    from sagemaker.sklearn.processing import SKLearnProcessor
+    from sagemaker.workflow.conditions import ConditionLessThanOrEqualTo
+    from sagemaker.workflow.execution_variables import ExecutionVariables
+    from sagemaker.workflow.condition_step import (
+        ConditionStep,
+        JsonGet,
+    )
+    from sagemaker.workflow.functions import Join
+    from sagemaker.workflow.parameters import (
+        ParameterInteger,
+        ParameterString,
+    )
+    from sagemaker.workflow.pipeline import Pipeline
+    from sagemaker.workflow.properties import PropertyFile
+    from sagemaker.workflow.steps import (
+        CacheConfig,
+        ProcessingStep,
+        TrainingStep,
+    )
+    from sagemaker.workflow.step_collections import RegisterModel
+    from sagemaker.network import NetworkConfig
 
     # Dynamically load environmental SSM parameters - provide the list of the variables to load from SSM parameter store
     ssm_parameters = [
@@ -126,7 +290,14 @@ def get_pipeline(
         {"VariableName":"EbsKmsKeyArn", "ParameterName":"kms-ebs-key-arn"},
     ]
 
-    env_data = get_environment(project_name=project_name, ssm_params=ssm_parameters)
+    if environment_file:
+        env_data = load_environment_file(
+            environment_file,
+            ssm_params=ssm_parameters,
+            required=["SecurityGroups", "SubnetIds", "ExecutionRole"],
+        )
+    else:
+        env_data = get_environment(project_name=project_name, ssm_params=ssm_parameters)
     print(f"Environment data:\n{json.dumps(env_data, indent=2)}")
 
     security_group_ids = env_data["SecurityGroups"]
@@ -138,7 +309,10 @@ def get_pipeline(
     ebs_kms_id = env_data["EbsKmsKeyArn"]
     s3_kms_id = env_data["S3KmsKeyId"]
 
-    sagemaker_session = get_session(region, data_bucket)
+    if environment_file:
+        sagemaker_session = get_offline_session(region, data_bucket)
+    else:
+        sagemaker_session = get_session(region, data_bucket)
 
     if processing_role is None:
         processing_role = sagemaker.session.get_execution_role(sagemaker_session)
@@ -148,6 +322,15 @@ def get_pipeline(
         model_bucket = sagemaker_session.default_bucket()
 
 
+    # content-addressed code keeps the step arguments, and so the cache keys, stable
+    preprocess_code = upload_code(
+        sagemaker_session, os.path.join(BASE_DIR, "preprocess.py"), model_bucket, base_job_prefix
+    )
+    evaluate_code = upload_code(
+        sagemaker_session, os.path.join(BASE_DIR, "evaluate.py"), model_bucket, base_job_prefix
+    )
+    cache_config = CacheConfig(enable_caching=step_caching, expire_after=cache_expire_after)
+
     print(f"Creating the pipeline '{pipeline_name}':")
     print(f"Parameters:{region}\n{security_group_ids}\n{subnets}\n{processing_role}\n\
     {training_role}\n{data_bucket}\n{model_bucket}\n{model_package_group_name}\n\
@@ -161,6 +344,15 @@ def get_pipeline(
     training_instance_type = ParameterString(
         name="TrainingInstanceType", default_value="ml.m5.xlarge"
     )
+    training_instance_count = ParameterInteger(name="TrainingInstanceCount", default_value=1)
+    training_input_mode = ParameterString(
+        name="TrainingInputMode",
+        default_value="File",
+        enum_values=[
+            mode for mode in TRAINING_INPUT_MODES
+            if mode != "Pipe" or output_format in PIPE_MODE_FORMATS
+        ],
+    )
     model_approval_status = ParameterString(
         name="ModelApprovalStatus", default_value="PendingManualApproval"
     )
@@ -169,6 +361,12 @@ def get_pipeline(
         default_value=f"s3://{sagemaker_session.default_bucket()}/datasets/abalone-dataset.csv",
     )
 
+    if output_format not in TRAINING_CONTENT_TYPES:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    training_content_type = TRAINING_CONTENT_TYPES[output_format]
+    if tuning_strategy is not None and tuning_strategy not in TUNING_STRATEGIES:
+        raise ValueError(f"Unsupported tuning strategy: {tuning_strategy}")
+
     # configure network for encryption, network isolation and VPC configuration
     # Since the preprocessor job takes the data from S3, enable_network_isolation must be set to False
     # see https://github.com/aws/amazon-sagemaker-examples/issues/1689
@@ -191,16 +389,70 @@ def get_pipeline(
         output_kms_key=s3_kms_id
     )
     
+    preprocess_arguments = [
+        "--input-data", input_data,
+        "--chunk-size", str(preprocess_chunk_size),
+        # hosts of a multi-instance job exchange partial statistics here
+        "--exchange-prefix", f"s3://{model_bucket}/{base_job_prefix}/preprocess-exchange",
+        "--output-format", output_format,
+        "--stratify-bins", str(split_stratify_bins),
+        "--split-parts", str(split_parts),
+        "--write-workers", str(split_write_workers),
+        "--write-executor", split_write_executor,
+    ]
+    if output_float32:
+        preprocess_arguments.append("--float32")
+    if split_seed is not None:
+        preprocess_arguments += ["--seed", str(split_seed)]
+    if preprocess_compact_dtypes:
+        preprocess_arguments.append("--compact-dtypes")
+    if preprocess_cache:
+        preprocess_arguments += [
+            "--cache-prefix", f"s3://{model_bucket}/{base_job_prefix}/preprocess-cache"
+        ]
+
+    def processing_output(step_name, output_name):
+        # an explicit destination, the SDK pinned in buildspec.yml derives the default one
+        # from a timestamped job name, which would change the step arguments on every build
+        return ProcessingOutput(
+            output_name=output_name,
+            source=f"/opt/ml/processing/{output_name}",
+            destination=Join(
+                on="/",
+                values=[
+                    "s3:/",
+                    sagemaker_session.default_bucket(),
+                    pipeline_name,
+                    ExecutionVariables.PIPELINE_EXECUTION_ID,
+                    step_name,
+                    "output",
+                    output_name,
+                ],
+            ),
+        )
+
+    # opt-in phase timings, memory peaks and cProfile dumps of the processing scripts
+    profile_arguments = []
+    if profile != "off":
+        profile_arguments = ["--profile", profile]
+
+    def profile_outputs(step_name):
+        return [processing_output(step_name, "profile")] if profile_arguments else []
+
+    preprocess_arguments += profile_arguments
+
     step_process = ProcessingStep(
         name="PreprocessAbaloneData",
         processor=sklearn_processor,
         outputs=[
-            ProcessingOutput(output_name="train", source="/opt/ml/processing/train"),
-            ProcessingOutput(output_name="validation", source="/opt/ml/processing/validation"),
-            ProcessingOutput(output_name="test", source="/opt/ml/processing/test"),
-        ],
-        code=os.path.join(BASE_DIR, "preprocess.py"),
-        job_arguments=["--input-data", input_data],
+            processing_output("PreprocessAbaloneData", name)
+            for name in ["train", "validation", "test", "manifest"]
+        ]
+        + profile_outputs("PreprocessAbaloneData"),
+        code=preprocess_code,
+        job_arguments=preprocess_arguments,
+        # an unseeded split is meant to differ on every execution
+        cache_config=cache_config if split_seed is not None else None,
     )
 
     # training step for generating model artifacts
@@ -215,7 +467,8 @@ def get_pipeline(
     xgb_train = Estimator(
         image_uri=image_uri,
         instance_type=training_instance_type,
-        instance_count=1,
+        # XGBoost trains across all instances with Rabit when there are several
+        instance_count=training_instance_count,
         output_path=model_path,
         base_job_name=f"{base_job_prefix}/abalone-train",
         sagemaker_session=sagemaker_session,
@@ -225,37 +478,54 @@ def get_pipeline(
         encrypt_inter_container_traffic=True,
         enable_network_isolation=False,
         volume_kms_key=ebs_kms_id,
-        output_kms_key=s3_kms_id
-    )
-    xgb_train.set_hyperparameters(
-        objective="reg:linear",
-        num_round=50,
-        max_depth=5,
-        eta=0.2,
-        gamma=4,
-        min_child_weight=6,
-        subsample=0.7,
-        silent=0,
-    )
-    
-    step_train = TrainingStep(
-        name="TrainAbaloneModel",
-        estimator=xgb_train,
-        inputs={
-            "train": TrainingInput(
-                s3_data=step_process.properties.ProcessingOutputConfig.Outputs[
-                    "train"
-                ].S3Output.S3Uri,
-                content_type="text/csv",
-            ),
-            "validation": TrainingInput(
-                s3_data=step_process.properties.ProcessingOutputConfig.Outputs[
-                    "validation"
-                ].S3Output.S3Uri,
-                content_type="text/csv",
-            ),
-        },
+        output_kms_key=s3_kms_id,
+        # the default profiler rule is named with a timestamp, which defeats step caching
+        disable_profiler=True,
     )
+    hyperparameters = {**DEFAULT_HYPERPARAMETERS, **(training_hyperparameters or {})}
+    xgb_train.set_hyperparameters(**hyperparameters)
+
+    training_inputs = {
+        "train": TrainingInput(
+            s3_data=step_process.properties.ProcessingOutputConfig.Outputs[
+                "train"
+            ].S3Output.S3Uri,
+            content_type=training_content_type,
+            # each training instance reads its own subset of the part files, replicated
+            # data would count every row once per instance in the distributed histograms
+            distribution="ShardedByS3Key",
+            input_mode=training_input_mode,
+        ),
+        "validation": TrainingInput(
+            s3_data=step_process.properties.ProcessingOutputConfig.Outputs[
+                "validation"
+            ].S3Output.S3Uri,
+            content_type=training_content_type,
+            input_mode=training_input_mode,
+        ),
+    }
+    if tuning_strategy is None:
+        step_train = TrainingStep(
+            name="TrainAbaloneModel",
+            estimator=xgb_train,
+            inputs=training_inputs,
+            cache_config=cache_config,
+        )
+        model_artifacts = step_train.properties.ModelArtifacts.S3ModelArtifacts
+    else:
+        step_train = get_tuning_step(
+            xgb_train,
+            training_inputs,
+            tuning_strategy,
+            tuning_max_jobs,
+            tuning_max_parallel_jobs,
+            hyperparameters["num_round"],
+            cache_config,
+        )
+        # the best training job writes its model under its own name in the output path
+        model_artifacts = step_train.get_top_model_s3_uri(
+            top_k=0, s3_bucket=model_bucket, prefix=f"{base_job_prefix}/AbaloneTrain"
+        )
 
     # processing step for evaluation
     script_eval = ScriptProcessor(
@@ -276,33 +546,94 @@ def get_pipeline(
         output_name="evaluation",
         path="evaluation.json",
     )
-    step_eval = ProcessingStep(
-        name="EvaluateAbaloneModel",
-        processor=script_eval,
-        inputs=[
-            ProcessingInput(
-                source=step_train.properties.ModelArtifacts.S3ModelArtifacts,
-                destination="/opt/ml/processing/model",
-            ),
-            ProcessingInput(
-                source=step_process.properties.ProcessingOutputConfig.Outputs[
-                    "test"
-                ].S3Output.S3Uri,
-                destination="/opt/ml/processing/test",
-            ),
-        ],
-        outputs=[
-            ProcessingOutput(output_name="evaluation", source="/opt/ml/processing/evaluation"),
-        ],
-        code=os.path.join(BASE_DIR, "evaluate.py"),
-        property_files=[evaluation_report],
+    model_input = ProcessingInput(
+        source=model_artifacts,
+        destination="/opt/ml/processing/model",
     )
+    test_source = step_process.properties.ProcessingOutputConfig.Outputs["test"].S3Output.S3Uri
+    evaluate_arguments = [
+        "--bootstrap-resamples", str(bootstrap_resamples),
+        "--bootstrap-seed", str(bootstrap_seed),
+    ] + profile_arguments
+    if evaluation_instance_count == 1:
+        step_eval = ProcessingStep(
+            name="EvaluateAbaloneModel",
+            processor=script_eval,
+            inputs=[
+                model_input,
+                ProcessingInput(source=test_source, destination="/opt/ml/processing/test"),
+            ],
+            outputs=[processing_output("EvaluateAbaloneModel", "evaluation")]
+            + profile_outputs("EvaluateAbaloneModel"),
+            code=evaluate_code,
+            job_arguments=evaluate_arguments,
+            property_files=[evaluation_report],
+            cache_config=cache_config,
+        )
+        evaluation_steps = [step_eval]
+    else:
+        # map: every instance scores the test part files of its shard
+        step_map_eval = ProcessingStep(
+            name="EvaluateAbaloneModelShards",
+            processor=ScriptProcessor(
+                image_uri=image_uri,
+                command=["python3"],
+                instance_type=processing_instance_type,
+                instance_count=evaluation_instance_count,
+                base_job_name=f"{base_job_prefix}/script-abalone-eval-map",
+                sagemaker_session=sagemaker_session,
+                role=processing_role,
+                network_config=network_config,
+                volume_kms_key=ebs_kms_id,
+                output_kms_key=s3_kms_id
+            ),
+            inputs=[
+                model_input,
+                ProcessingInput(
+                    source=test_source,
+                    destination="/opt/ml/processing/test",
+                    s3_data_distribution_type="ShardedByS3Key",
+                ),
+            ],
+            outputs=[processing_output("EvaluateAbaloneModelShards", "partials")]
+            + profile_outputs("EvaluateAbaloneModelShards"),
+            code=evaluate_code,
+            job_arguments=["--partial-output", "/opt/ml/processing/partials"] + profile_arguments,
+            cache_config=cache_config,
+        )
+        # reduce: merge the partial statistics into the single evaluation report
+        step_eval = ProcessingStep(
+            name="EvaluateAbaloneModel",
+            processor=script_eval,
+            inputs=[
+                ProcessingInput(
+                    source=step_map_eval.properties.ProcessingOutputConfig.Outputs[
+                        "partials"
+                    ].S3Output.S3Uri,
+                    destination="/opt/ml/processing/partials",
+                ),
+            ],
+            outputs=[processing_output("EvaluateAbaloneModel", "evaluation")]
+            + profile_outputs("EvaluateAbaloneModel"),
+            code=evaluate_code,
+            cache_config=cache_config,
+            job_arguments=evaluate_arguments + ["--reduce-input", "/opt/ml/processing/partials"],
+            property_files=[evaluation_report],
+        )
+        evaluation_steps = [step_map_eval, step_eval]
 
     # register model step that will be conditionally executed
     model_metrics = ModelMetrics(
         model_statistics=MetricsSource(
-            s3_uri="{}/evaluation.json".format(
-                step_eval.arguments["ProcessingOutputConfig"]["Outputs"][0]["S3Output"]["S3Uri"]
+            # a property reference keeps the definition free of the generated job name
+            s3_uri=Join(
+                on="/",
+                values=[
+                    step_eval.properties.ProcessingOutputConfig.Outputs[
+                        "evaluation"
+                    ].S3Output.S3Uri,
+                    "evaluation.json",
+                ],
             ),
             content_type="application/json"
         )
@@ -330,7 +661,7 @@ def get_pipeline(
     step_register = RegisterModel(
         name="RegisterAbaloneModel",
         estimator=xgb_train,
-        model_data=step_train.properties.ModelArtifacts.S3ModelArtifacts,
+        model_data=model_artifacts,
         content_types=["text/csv"],
         response_types=["text/csv"],
         inference_instances=["ml.t2.medium", "ml.m5.large"],
@@ -346,7 +677,9 @@ def get_pipeline(
         left=JsonGet(
             step=step_eval,
             property_file=evaluation_report,
-            json_path="regression_metrics.mse.value"
+            json_path="confidence_intervals.mse.upper"
+            if bootstrap_resamples
+            else "regression_metrics.mse.value"
         ),
         right=6.0,
     )
@@ -364,10 +697,12 @@ def get_pipeline(
             processing_instance_type,
             processing_instance_count,
             training_instance_type,
+            training_instance_count,
+            training_input_mode,
             model_approval_status,
             input_data,
         ],
-        steps=[step_process, step_train, step_eval, step_cond],
+        steps=[step_process, step_train, *evaluation_steps, step_cond],
         sagemaker_session=sagemaker_session,
     )
     return pipeline
@@ -1,16 +1,30 @@
 """Feature engineers the abalone dataset."""
 import argparse
+import collections
+import contextlib
+import cProfile
+import hashlib
+import io
+import itertools
+import json
 import logging
 import os
-import pathlib
 import requests
+import struct
 import tempfile
+import time
+import tracemalloc
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import boto3
+import joblib
 import numpy as np
 import pandas as pd
 
+from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.compose import ColumnTransformer
+from sklearn.datasets import dump_svmlight_file
 from sklearn.impute import SimpleImputer
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
@@ -45,6 +59,132 @@ feature_columns_dtype = {
 }
 label_column_dtype = {"rings": np.float64}
 
+# Dtypes of the compact mode: half the memory for numerics and integer codes for sex.
+compact_feature_columns_dtype = {
+    "sex": "category",
+    "length": np.float32,
+    "diameter": np.float32,
+    "height": np.float32,
+    "whole_weight": np.float32,
+    "shucked_weight": np.float32,
+    "viscera_weight": np.float32,
+    "shell_weight": np.float32,
+}
+compact_label_column_dtype = {"rings": np.float32}
+
+
+# Number of non-missing values per numeric column kept to estimate the imputer
+# median in streaming mode. The median is exact for inputs up to this size.
+DEFAULT_MEDIAN_SAMPLE_SIZE = 100000
+
+# File extension of each supported output format of the splits.
+OUTPUT_FORMATS = {
+    "csv": "csv",
+    "parquet": "parquet",
+    "libsvm": "libsvm",
+    "recordio-protobuf": "pbr",
+}
+SPLIT_NAMES = ["train", "validation", "test"]
+# Formats evaluate.py reads in the XGBoost container, which has no pyarrow.
+EVALUATION_FORMATS = ["csv", "libsvm"]
+
+# Rows gathered into one block when writing a split.
+WRITE_BLOCK_SIZE = 100000
+
+# Size of the ranged GETs reading the input and the number of GETs in flight.
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_CONCURRENCY = 8
+
+# Magic number of the RecordIO framing SageMaker built-in algorithms read.
+RECORDIO_MAGIC = 0xCED7230A
+
+# Arguments that do not change the outputs and are left out of the cache key.
+CACHE_KEY_IGNORED_ARGUMENTS = [
+    "input_data",
+    "exchange_prefix",
+    "cache_prefix",
+    "part_size",
+    "concurrency",
+    "write_workers",
+    "write_executor",
+    "profile",
+]
+
+# Written by SageMaker into every processing container.
+RESOURCE_CONFIG_PATH = "/opt/ml/config/resourceconfig.json"
+PROCESSING_JOB_CONFIG_PATH = "/opt/ml/config/processingjobconfig.json"
+
+# Profiling mode used when --profile is not given.
+PROFILE_ENVIRONMENT_VARIABLE = "PROCESSING_PROFILE"
+PROFILE_MODES = ["off", "basic", "cprofile"]
+
+
+class PhaseProfiler:
+    """Opt-in wall/CPU time, tracemalloc peak and cProfile of the phases of the job.
+
+    mode is "off", "basic" for the timers and memory peaks, or "cprofile" to
+    also dump a cProfile per phase. Phases must not nest, a phase entered
+    repeatedly is summed. Work done in worker processes is not traced.
+    """
+
+    def __init__(self, mode="off"):
+        """Starts a profiler without phases in mode."""
+        self.mode = mode
+        self.phases = collections.OrderedDict()
+        self.profiles = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Measures the enclosed block as the phase name."""
+        if self.mode == "off":
+            yield
+            return
+        # restarting clears the peak on every Python version
+        tracemalloc.stop()
+        tracemalloc.start()
+        profile = None
+        if self.mode == "cprofile":
+            profile = self.profiles.setdefault(name, cProfile.Profile())
+            profile.enable()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            if profile is not None:
+                profile.disable()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            totals = self.phases.setdefault(
+                name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "peak_bytes": 0}
+            )
+            totals["calls"] += 1
+            totals["wall_seconds"] += wall
+            totals["cpu_seconds"] += cpu
+            totals["peak_bytes"] = max(totals["peak_bytes"], peak)
+
+    def write(self, output_dir, host):
+        """Logs the phases and writes profile-<host>.json and the cProfile dumps."""
+        if self.mode == "off":
+            return
+        os.makedirs(output_dir, exist_ok=True)
+        for name, totals in self.phases.items():
+            logger.info(
+                "Phase %s: %.3fs wall, %.3fs CPU, %.1f MiB peak.",
+                name,
+                totals["wall_seconds"],
+                totals["cpu_seconds"],
+                totals["peak_bytes"] / 2 ** 20,
+            )
+        with open(f"{output_dir}/profile-{host}.json", "w") as f:
+            json.dump({"host": host, "mode": self.mode, "phases": self.phases}, f, indent=2)
+        for name, profile in self.profiles.items():
+            profile.dump_stats(f"{output_dir}/{name}-{host}.prof")
+
+
+# Configured by main(), the phases are instrumented throughout this module.
+profiler = PhaseProfiler()
+
 
 def merge_two_dicts(x, y):
     """Merges two dicts, returning a new copy."""
@@ -53,33 +193,87 @@ def merge_two_dicts(x, y):
     return z
 
 
-if __name__ == "__main__":
-    logger.info("Starting preprocessing.")
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--input-data", type=str, required=True)
-    args = parser.parse_args()
+def read_csv(source, chunk_size=None, compact=False):
+    """Reads the headerless abalone CSV, optionally as an iterator of chunks.
 
-    base_dir = "/opt/ml/processing"
-    pathlib.Path(f"{base_dir}/data").mkdir(parents=True, exist_ok=True)
-    input_data = args.input_data
-    bucket = input_data.split("/")[2]
-    key = "/".join(input_data.split("/")[3:])
-
-    logger.info("Downloading data from bucket: %s, key: %s", bucket, key)
-    fn = f"{base_dir}/data/abalone-dataset.csv"
-    s3 = boto3.resource("s3")
-    s3.Bucket(bucket).download_file(key, fn)
-
-    logger.info("Reading downloaded data.")
-    df = pd.read_csv(
-        fn,
+    source is a path or a callable opening a binary stream, such as
+    open_s3_input(), so the input can be read twice without a local copy.
+    With compact the numerics are float32 and sex is categorical.
+    """
+    if compact:
+        dtype = merge_two_dicts(compact_feature_columns_dtype, compact_label_column_dtype)
+    else:
+        dtype = merge_two_dicts(feature_columns_dtype, label_column_dtype)
+    return pd.read_csv(
+        source() if callable(source) else source,
         header=None,
         names=feature_columns_names + [label_column],
-        dtype=merge_two_dicts(feature_columns_dtype, label_column_dtype),
+        dtype=dtype,
+        chunksize=chunk_size,
     )
-    os.unlink(fn)
 
-    logger.info("Defining transformers.")
+
+def iter_chunks(source, chunk_size=None, compact=False):
+    """Yields the input in chunks of chunk_size rows, or as one chunk, nothing if it is empty."""
+    try:
+        chunks = read_csv(source, chunk_size, compact)
+    except pd.errors.EmptyDataError:
+        # the shard of a host in which no line starts is empty
+        return
+    if chunk_size:
+        with chunks as reader:
+            yield from reader
+    else:
+        yield chunks
+
+
+def one_hot(sex, categories, dtype=np.float64):
+    """One-hot encodes sex from its category codes, missing values as "missing".
+
+    Values outside categories are encoded as all zeros, like
+    OneHotEncoder(handle_unknown="ignore").
+    """
+    if not isinstance(sex.dtype, pd.CategoricalDtype):
+        sex = sex.astype("category")
+    positions = {c: i for i, c in enumerate(categories)}
+    # code -1 marks a missing value and picks the last entry of the lookup
+    lookup = np.array(
+        [positions.get(c, -1) for c in sex.cat.categories] + [positions.get("missing", -1)]
+    )
+    index = lookup[sex.cat.codes.to_numpy()]
+    encoded = np.zeros((len(sex), len(categories)), dtype=dtype)
+    rows = np.flatnonzero(index >= 0)
+    encoded[rows, index[rows]] = 1
+    return encoded
+
+
+class CategoryOneHotEncoder(BaseEstimator, TransformerMixin):
+    """One-hot encodes a categorical column from its codes, see one_hot()."""
+
+    def __init__(self, dtype=np.float32):
+        """Sets the dtype of the encoded columns."""
+        self.dtype = dtype
+
+    def fit(self, X, y=None):
+        """Learns the sorted categories, adding "missing" if values are missing."""
+        column = X.iloc[:, 0]
+        categories = set(column.dropna().unique())
+        if column.isna().any():
+            categories.add("missing")
+        self.categories_ = sorted(categories)
+        return self
+
+    def transform(self, X):
+        """One-hot encodes the column into a dense array."""
+        return one_hot(X.iloc[:, 0], self.categories_, self.dtype)
+
+
+def get_preprocessor(compact=False):
+    """Builds the column transformer used to engineer the features.
+
+    With compact the sex column must be categorical and is one-hot encoded from
+    its codes, and float32 numerics stay float32.
+    """
     numeric_features = list(feature_columns_names)
     numeric_features.remove("sex")
     numeric_transformer = Pipeline(
@@ -87,34 +281,1067 @@ if __name__ == "__main__":
     )
 
     categorical_features = ["sex"]
-    categorical_transformer = Pipeline(
-        steps=[
-            ("imputer", SimpleImputer(strategy="constant", fill_value="missing")),
-            ("onehot", OneHotEncoder(handle_unknown="ignore")),
-        ]
-    )
+    if compact:
+        categorical_transformer = CategoryOneHotEncoder()
+    else:
+        categorical_transformer = Pipeline(
+            steps=[
+                ("imputer", SimpleImputer(strategy="constant", fill_value="missing")),
+                ("onehot", OneHotEncoder(handle_unknown="ignore")),
+            ]
+        )
 
-    preprocess = ColumnTransformer(
+    return ColumnTransformer(
         transformers=[
             ("num", numeric_transformer, numeric_features),
             ("cat", categorical_transformer, categorical_features),
         ]
     )
 
-    logger.info("Applying transforms.")
-    y = df.pop("rings")
-    X_pre = preprocess.fit_transform(df)
-    y_pre = y.to_numpy().reshape(len(y), 1)
 
-    X = np.concatenate((y_pre, X_pre), axis=1)
+def get_split_sizes(n):
+    """Returns the number of train, validation and test rows for n rows."""
+    n_train = int(0.7 * n)
+    n_validation = int(0.85 * n) - n_train
+    return n_train, n_validation, n - n_train - n_validation
+
+
+def _quantile_subsample(values, k):
+    """Returns k evenly spaced order statistics of values."""
+    k = min(k, len(values))
+    if k == len(values):
+        return values
+    return np.sort(values)[np.linspace(0, len(values) - 1, k).round().astype(int)]
+
+
+class StreamingFeatureStats:
+    """Fits the feature transforms incrementally over chunks of the input.
+
+    Mirrors get_preprocessor(): numeric columns are imputed with the median and
+    standardized, and the sex column is imputed with "missing" and one-hot
+    encoded. Means and variances are merged chunk by chunk with Chan's parallel
+    algorithm, the median is estimated from a fixed-size reservoir sample.
+    With compact the chunks are read and transformed with the compact dtypes,
+    the statistics are always accumulated in float64.
+    """
+
+    def __init__(self, sample_size=DEFAULT_MEDIAN_SAMPLE_SIZE, seed=None, compact=False):
+        """Starts empty statistics with a reservoir of sample_size rows drawn with seed."""
+        self.numeric_features = [c for c in feature_columns_names if c != "sex"]
+        self.sample_size = sample_size
+        self.compact = compact
+        self.rows = 0
+        self._rng = np.random.default_rng(seed)
+        n_features = len(self.numeric_features)
+        self._count = np.zeros(n_features, dtype=np.int64)
+        self._mean = np.zeros(n_features)
+        self._m2 = np.zeros(n_features)
+        self._sample = np.empty((sample_size, n_features))
+        self._categories = set()
+        self._has_missing_category = False
+        self.medians = None
+        self.means = None
+        self.scales = None
+        self.categories = None
+
+    def update(self, df):
+        """Accumulates the statistics of one chunk."""
+        self.rows += len(df)
+        values = df[self.numeric_features].to_numpy(dtype=np.float64)
+        for j in range(values.shape[1]):
+            column = values[:, j]
+            column = column[~np.isnan(column)]
+            if len(column) == 0:
+                continue
+            self._update_moments(j, column)
+            self._update_sample(j, column)
+            self._count[j] += len(column)
+
+        sex = df["sex"]
+        self._has_missing_category |= bool(sex.isna().any())
+        self._categories.update(sex.dropna().unique())
+
+    def _update_moments(self, j, column):
+        n_a, n_b = self._count[j], len(column)
+        mean_b = column.mean()
+        m2_b = ((column - mean_b) ** 2).sum()
+        delta = mean_b - self._mean[j]
+        n = n_a + n_b
+        self._mean[j] += delta * n_b / n
+        self._m2[j] += m2_b + delta ** 2 * n_a * n_b / n
+
+    def _update_sample(self, j, column):
+        # Vectorized reservoir sampling (Algorithm R).
+        seen = self._count[j]
+        positions = seen + np.arange(len(column))
+        fill = positions < self.sample_size
+        self._sample[positions[fill], j] = column[fill]
+        slots = self._rng.integers(0, positions[~fill] + 1)
+        keep = slots < self.sample_size
+        self._sample[slots[keep], j] = column[~fill][keep]
+
+    def merge(self, other):
+        """Merges the statistics another host accumulated over its shard.
+
+        Merging is deterministic so every host reduces to the same result. When
+        the pooled median samples exceed sample_size, each side contributes
+        evenly spaced order statistics in proportion to its value count.
+        """
+        for j in range(len(self.numeric_features)):
+            n_a, n_b = self._count[j], other._count[j]
+            if n_b == 0:
+                continue
+            a = self._sample[: min(n_a, self.sample_size), j]
+            b = other._sample[: min(n_b, other.sample_size), j]
+            if len(a) + len(b) > self.sample_size:
+                a = _quantile_subsample(a, round(self.sample_size * n_a / (n_a + n_b)))
+                b = _quantile_subsample(b, self.sample_size - len(a))
+            merged = np.concatenate((a, b))
+            self._sample[: len(merged), j] = merged
+
+            delta = other._mean[j] - self._mean[j]
+            n = n_a + n_b
+            self._mean[j] += delta * n_b / n
+            self._m2[j] += other._m2[j] + delta ** 2 * n_a * n_b / n
+            self._count[j] = n
+        self.rows += other.rows
+        self._categories.update(other._categories)
+        self._has_missing_category |= other._has_missing_category
+        return self
+
+    def to_bytes(self):
+        """Serializes the accumulated statistics for the exchange between hosts."""
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            rows=self.rows,
+            count=self._count,
+            mean=self._mean,
+            m2=self._m2,
+            sample=self._sample[: min(self._count.max(initial=0), self.sample_size)],
+            categories=np.array(sorted(self._categories), dtype=str),
+            has_missing_category=self._has_missing_category,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data, sample_size=DEFAULT_MEDIAN_SAMPLE_SIZE):
+        """Restores statistics serialized by to_bytes()."""
+        stats = cls(sample_size=sample_size)
+        with np.load(io.BytesIO(data)) as f:
+            stats.rows = int(f["rows"])
+            stats._count = f["count"]
+            stats._mean = f["mean"]
+            stats._m2 = f["m2"]
+            sample = f["sample"][:sample_size]
+            stats._sample[: len(sample)] = sample
+            stats._categories = set(f["categories"].tolist())
+            stats._has_missing_category = bool(f["has_missing_category"])
+        return stats
+
+    def finalize(self):
+        """Derives the medians, means, scales and categories from the statistics."""
+        n_features = len(self.numeric_features)
+        self.medians = np.full(n_features, np.nan)
+        self.means = np.zeros(n_features)
+        self.scales = np.ones(n_features)
+        for j in range(n_features):
+            count = self._count[j]
+            if count == 0:
+                continue
+            self.medians[j] = np.median(self._sample[: min(count, self.sample_size), j])
+            # missing values are imputed with the median before scaling
+            missing = self.rows - count
+            delta = self.medians[j] - self._mean[j]
+            self.means[j] = self._mean[j] + delta * missing / self.rows
+            m2 = self._m2[j] + delta ** 2 * count * missing / self.rows
+            scale = np.sqrt(m2 / self.rows)
+            self.scales[j] = scale if scale > 0 else 1.0
+
+        categories = set(self._categories)
+        if self._has_missing_category:
+            categories.add("missing")
+        self.categories = np.array(sorted(categories), dtype=object)
+        self._sample = None
+        return self
+
+    def transform(self, df):
+        """Transforms one chunk into the same layout get_preprocessor() produces."""
+        dtype = np.float32 if self.compact else np.float64
+        values = df[self.numeric_features].to_numpy(dtype=dtype)
+        values = np.where(np.isnan(values), self.medians.astype(dtype), values)
+        numeric = (values - self.means.astype(dtype)) / self.scales.astype(dtype)
+        return np.concatenate((numeric, one_hot(df["sex"], self.categories, dtype)), axis=1)
+
+
+def _protobuf_varint(value):
+    """Encodes a non-negative integer as a protobuf varint."""
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def _protobuf_tensor_prefix(field_number, size):
+    """Returns the bytes of a Record map entry {"values": Float32Tensor} before its data.
+
+    Every row has the same number of features, so the prefix is the same for
+    all records and only the packed float data differs.
+    """
+    data_length = 4 * size
+    # Float32Tensor.values (field 1, packed)
+    prefix = b"\x0a" + _protobuf_varint(data_length)
+    # Value.float32_tensor (field 2)
+    prefix = b"\x12" + _protobuf_varint(len(prefix) + data_length) + prefix
+    # map entry with key "values" (field 1) and the value (field 2)
+    prefix = b"\x0a\x06values\x12" + _protobuf_varint(len(prefix) + data_length) + prefix
+    # Record.features (field 1) or Record.label (field 2)
+    tag = _protobuf_varint(field_number << 3 | 2)
+    return tag + _protobuf_varint(len(prefix) + data_length) + prefix
+
+
+def to_recordio_protobuf(X):
+    """Encodes rows of label followed by features as RecordIO-wrapped protobuf Records.
+
+    Produces the same bytes as sagemaker.amazon.common.write_numpy_to_dense_tensor,
+    vectorized over the rows since all records have the same layout.
+    """
+    n_rows, n_columns = X.shape
+    features_prefix = _protobuf_tensor_prefix(1, n_columns - 1)
+    label_prefix = _protobuf_tensor_prefix(2, 1)
+    length = len(features_prefix) + 4 * (n_columns - 1) + len(label_prefix) + 4
+    padding = -length % 4
+
+    values = X.astype("<f4")
+    parts = [
+        struct.pack("<II", RECORDIO_MAGIC, length),
+        features_prefix,
+        values[:, 1:],
+        label_prefix,
+        values[:, :1],
+        b"\x00" * padding,
+    ]
+    blocks = [
+        np.broadcast_to(np.frombuffer(p, dtype=np.uint8), (n_rows, len(p)))
+        if isinstance(p, bytes)
+        else np.ascontiguousarray(p).view(np.uint8)
+        for p in parts
+    ]
+    return np.concatenate(blocks, axis=1).tobytes()
+
+
+class SplitWriter:
+    """Appends blocks of rows, label first, to a split file in one of OUTPUT_FORMATS.
+
+    Parquet and RecordIO-protobuf store 32-bit floats natively, the text formats
+    write float32 values with their shorter representation when float32 is set.
+    """
+
+    def __init__(self, path, output_format="csv", float32=False):
+        """Opens the split file at path, a Parquet file is created on the first write."""
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {output_format}")
+        self.path = path
+        self.output_format = output_format
+        self.dtype = np.float32 if float32 else np.float64
+        self.rows = 0
+        self._parquet_writer = None
+        self._file = None
+        if output_format == "parquet":
+            import pyarrow  # noqa: F401 - fail early if the container lacks it
+        else:
+            self._file = open(path, "w" if output_format == "csv" else "wb")
+
+    def write(self, X):
+        """Appends the rows of X."""
+        X = X.astype(self.dtype, copy=False)
+        self.rows += len(X)
+        if self.output_format == "csv":
+            pd.DataFrame(X).to_csv(self._file, header=False, index=False)
+        elif self.output_format == "libsvm":
+            dump_svmlight_file(X[:, 1:], X[:, 0], self._file, zero_based=True)
+        elif self.output_format == "recordio-protobuf":
+            self._file.write(to_recordio_protobuf(X))
+        else:
+            self._write_parquet(X)
+
+    def _write_parquet(self, X):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(
+            pd.DataFrame(X, columns=[str(i) for i in range(X.shape[1])]), preserve_index=False
+        )
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+        self._parquet_writer.write_table(table)
+
+    def close(self):
+        """Flushes and closes the split file."""
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        """Returns the writer, which is closed on exit."""
+        return self
+
+    def __exit__(self, *exc):
+        """Closes the file."""
+        self.close()
+
+
+def get_split_files(base_dir, output_format="csv", part_name=None, parts=1):
+    """Returns the (path, format) of the part files of each of the three splits.
+
+    The test split only feeds evaluate.py, so it is written as CSV unless the
+    output format is one of EVALUATION_FORMATS.
+    """
+    suffix = f"-{part_name}" if part_name else ""
+    files = []
+    for split in SPLIT_NAMES:
+        split_format = output_format
+        if split == "test" and output_format not in EVALUATION_FORMATS:
+            split_format = "csv"
+        extension = OUTPUT_FORMATS[split_format]
+        if parts == 1:
+            names = [f"{split}{suffix}.{extension}"]
+        else:
+            names = [f"{split}{suffix}-part-{i:05d}.{extension}" for i in range(parts)]
+        files.append([(f"{base_dir}/{split}/{name}", split_format) for name in names])
+    return files
+
+
+def open_split_writers(base_dir, output_format="csv", float32=False, part_name=None, parts=1):
+    """Opens a SplitWriter for each part file of each of the three splits."""
+    return [
+        [SplitWriter(path, split_format, float32) for path, split_format in split_files]
+        for split_files in get_split_files(base_dir, output_format, part_name, parts)
+    ]
+
+
+def write_manifest(base_dir, writers, part_name=None):
+    """Lists the part files and their row counts in manifest/manifest.json.
+
+    The manifest is a separate processing output so the training channels only
+    contain data files.
+    """
+    manifest = {
+        split: [
+            {"file": os.path.basename(w.path), "format": w.output_format, "rows": w.rows}
+            for w in split_writers
+        ]
+        for split, split_writers in zip(SPLIT_NAMES, writers)
+    }
+    suffix = f"-{part_name}" if part_name else ""
+    os.makedirs(f"{base_dir}/manifest", exist_ok=True)
+    with open(f"{base_dir}/manifest/manifest{suffix}.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def get_rings_strata(y, n_bins):
+    """Assigns each label to one of at most n_bins quantile bins of rings."""
+    edges = np.unique(np.quantile(y, np.linspace(0, 1, n_bins + 1)[1:-1]))
+    return np.searchsorted(edges, y, side="right")
+
+
+def get_split_indices(n, rng, strata=None):
+    """Returns the row indices of the train, validation and test splits.
+
+    Only an index array is permuted, the rows themselves are never copied. With
+    strata every stratum is split in the train/validation/test proportions.
+    """
+    if strata is None:
+        return np.split(rng.permutation(n), [int(0.7 * n), int(0.85 * n)])
+
+    splits = [[], [], []]
+    for stratum in np.unique(strata):
+        members = rng.permutation(np.flatnonzero(strata == stratum))
+        sizes = get_split_sizes(len(members))
+        for split, part in zip(splits, np.split(members, np.cumsum(sizes)[:2])):
+            split.append(part)
+    return [rng.permutation(np.concatenate(split)) for split in splits]
+
+
+def write_rows(writer, y, X, indices=None):
+    """Gathers the indexed rows, label first, into the writer block by block."""
+    if indices is None:
+        indices = np.arange(len(y))
+    for start in range(0, len(indices), WRITE_BLOCK_SIZE):
+        block = indices[start : start + WRITE_BLOCK_SIZE]
+        writer.write(np.concatenate((y[block, None], X[block]), axis=1))
+
+
+def write_parts(writers, y, X, indices, executor=None):
+    """Deals the indexed rows evenly into the part writers, in parallel with a thread pool."""
+    parts = np.array_split(indices, len(writers))
+    if executor is None:
+        for writer, part in zip(writers, parts):
+            write_rows(writer, y, X, part)
+    else:
+        n = len(writers)
+        list(executor.map(write_rows, writers, [y] * n, [X] * n, parts))
+
+
+def write_part_file(path, output_format, float32, y, X):
+    """Writes one whole part file, the task of a process pool worker."""
+    writer = SplitWriter(path, output_format, float32)
+    with writer:
+        write_rows(writer, y, X)
+    return writer.rows
+
+
+class _WrittenPart:
+    """Path, format and row count of a part file written by a worker process."""
+
+    def __init__(self, path, output_format, rows):
+        self.path = path
+        self.output_format = output_format
+        self.rows = rows
+
+
+def write_splits(
+    base_dir,
+    y,
+    X,
+    splits,
+    output_format="csv",
+    float32=False,
+    part_name=None,
+    parts=1,
+    executor=None,
+):
+    """Writes the indexed rows of each split into parts part files and a manifest.
+
+    With a ProcessPoolExecutor every part file is gathered here and written by
+    a worker process, with a ThreadPoolExecutor the threads gather and write
+    the parts of one split at a time.
+    """
+    files = get_split_files(base_dir, output_format, part_name, parts)
+    if isinstance(executor, ProcessPoolExecutor):
+        futures = [
+            [
+                (
+                    path,
+                    split_format,
+                    executor.submit(write_part_file, path, split_format, float32, y[part], X[part]),
+                )
+                for (path, split_format), part in zip(split_files, np.array_split(indices, parts))
+            ]
+            for split_files, indices in zip(files, splits)
+        ]
+        writers = [[_WrittenPart(p, f, future.result()) for p, f, future in fs] for fs in futures]
+    else:
+        writers = open_split_writers(base_dir, output_format, float32, part_name, parts)
+        try:
+            for split_writers, indices in zip(writers, splits):
+                write_parts(split_writers, y, X, indices, executor)
+        finally:
+            for writer in itertools.chain.from_iterable(writers):
+                writer.close()
+    write_manifest(base_dir, writers, part_name)
+
+
+def preprocess_in_memory(
+    source,
+    base_dir,
+    output_format="csv",
+    float32=False,
+    seed=None,
+    stratify_bins=0,
+    compact=False,
+    parts=1,
+    executor=None,
+):
+    """Loads the whole input, transforms and writes the splits.
+
+    The splits are drawn with a generator seeded by seed, stratified on
+    stratify_bins quantile bins of rings if it is set. Each split is written
+    as parts part files, in parallel with an executor. Returns the fitted
+    transformer.
+    """
+    logger.info("Reading input data.")
+    with profiler.phase("read"):
+        df = read_csv(source, compact=compact)
+
+    logger.info("Defining transformers.")
+    preprocess = get_preprocessor(compact)
+
+    logger.info("Applying transforms.")
+    with profiler.phase("transform"):
+        y = df.pop("rings").to_numpy()
+        X = preprocess.fit_transform(df)
+        del df
 
     logger.info("Splitting %d rows of data into train, validation, test datasets.", len(X))
-    np.random.shuffle(X)
-    train, validation, test = np.split(X, [int(0.7 * len(X)), int(0.85 * len(X))])
+    with profiler.phase("split"):
+        rng = np.random.default_rng(seed)
+        strata = get_rings_strata(y, stratify_bins) if stratify_bins else None
+        splits = get_split_indices(len(X), rng, strata)
+
+    logger.info("Writing out datasets to %s as %d %s parts.", base_dir, parts, output_format)
+    with profiler.phase("write"):
+        write_splits(base_dir, y, X, splits, output_format, float32, parts=parts, executor=executor)
+    return preprocess
+
+
+def fit_streaming_stats(
+    source, chunk_size, sample_size=DEFAULT_MEDIAN_SAMPLE_SIZE, seed=None, compact=False
+):
+    """Accumulates the feature statistics over chunks of the input."""
+    stats = StreamingFeatureStats(sample_size=sample_size, seed=seed, compact=compact)
+    with profiler.phase("fit_pass"):
+        for df in iter_chunks(source, chunk_size, compact):
+            stats.update(df)
+    return stats
+
+
+def write_streaming_splits(
+    source,
+    base_dir,
+    stats,
+    chunk_size,
+    rows,
+    part_name=None,
+    output_format="csv",
+    float32=False,
+    seed=None,
+    parts=1,
+    executor=None,
+):
+    """Transforms the input chunk by chunk and deals its rows into the splits.
+
+    The number of rows each chunk contributes to a split is drawn from a
+    multivariate hypergeometric distribution, so the split sizes are exactly
+    those of the in-memory mode and each row is assigned uniformly at random.
+    The rows of a chunk are dealt evenly into the parts part files of a split,
+    in parallel with a thread pool executor.
+    """
+    logger.info("Splitting %d rows of data into train, validation, test datasets.", rows)
+    rng = np.random.default_rng(seed)
+    remaining = np.array(get_split_sizes(rows), dtype=np.int64)
+    writers = open_split_writers(base_dir, output_format, float32, part_name, parts)
+    try:
+        with profiler.phase("write_pass"):
+            for df in iter_chunks(source, chunk_size, stats.compact):
+                y = df.pop("rings").to_numpy()
+                X = stats.transform(df)
+
+                counts = rng.multivariate_hypergeometric(remaining, len(X))
+                remaining -= counts
+                permutation = rng.permutation(len(X))
+                splits = np.split(permutation, np.cumsum(counts)[:2])
+                for split_writers, indices in zip(writers, splits):
+                    write_parts(split_writers, y, X, indices, executor)
+    finally:
+        for writer in itertools.chain.from_iterable(writers):
+            writer.close()
+    write_manifest(base_dir, writers, part_name)
+
+
+def preprocess_streaming(
+    source,
+    base_dir,
+    chunk_size,
+    sample_size=DEFAULT_MEDIAN_SAMPLE_SIZE,
+    output_format="csv",
+    float32=False,
+    seed=None,
+    compact=False,
+    parts=1,
+    executor=None,
+):
+    """Transforms and writes the splits chunk by chunk with bounded memory.
+
+    The first pass over the input fits the feature statistics, the second pass
+    transforms each chunk and writes it out. Returns the fitted statistics.
+    """
+    logger.info("Fitting transformers over chunks of %d rows.", chunk_size)
+    stats = fit_streaming_stats(source, chunk_size, sample_size, seed, compact).finalize()
+    write_streaming_splits(
+        source,
+        base_dir,
+        stats,
+        chunk_size,
+        stats.rows,
+        output_format=output_format,
+        float32=float32,
+        seed=seed,
+        parts=parts,
+        executor=executor,
+    )
+    return stats
+
+
+def get_host_topology(path=RESOURCE_CONFIG_PATH):
+    """Returns the sorted hosts of the processing job and the current host."""
+    if not os.path.exists(path):
+        return ["algo-1"], "algo-1"
+    with open(path) as f:
+        config = json.load(f)
+    return sorted(config["hosts"]), config["current_host"]
+
+
+def get_job_name(path=PROCESSING_JOB_CONFIG_PATH):
+    """Returns the processing job name shared by all hosts of the job."""
+    if not os.path.exists(path):
+        return "local"
+    with open(path) as f:
+        return json.load(f)["ProcessingJobName"]
+
+
+def get_shard_range(size, hosts, current_host):
+    """Returns the [start, end) byte range of an object the current host owns.
+
+    A host owns every line whose first byte falls into its range.
+    """
+    index = hosts.index(current_host)
+    return size * index // len(hosts), size * (index + 1) // len(hosts)
+
+
+def list_input_objects(s3_client, url):
+    """Lists (bucket, key, size, etag) of the input object, or of every object under a prefix."""
+    bucket = url.split("/")[2]
+    prefix = "/".join(url.split("/")[3:])
+    objects = []
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        response = s3_client.list_objects_v2(**kwargs)
+        objects += [
+            (bucket, o["Key"], o["Size"], o["ETag"])
+            for o in response.get("Contents", [])
+            if o["Size"] > 0
+        ]
+        if not response.get("IsTruncated"):
+            break
+        kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+    if not objects:
+        raise ValueError(f"No input data found at {url}")
+    exact = [o for o in objects if o[1] == prefix]
+    return exact or sorted(objects)
+
+
+def iter_object_range(s3_client, executor, bucket, key, size, start, end, part_size, concurrency):
+    """Yields the bytes of the lines starting in the [start, end) byte range of an object.
+
+    The range is fetched in parts of part_size bytes with up to concurrency
+    ranged GETs in flight, so memory use is bounded by part_size * concurrency.
+    The line running past end is completed with further GETs, and a missing
+    newline at the end of the object is added so objects can be concatenated.
+    """
+
+    def get_range(first, last):
+        r = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={first}-{last}")
+        return r["Body"].read()
+
+    if start >= end:
+        return
+
+    # look one byte back to know whether a line starts exactly at start
+    offsets = iter(range(max(start - 1, 0), end, part_size))
+    pending = collections.deque(
+        executor.submit(get_range, o, min(o + part_size, end) - 1)
+        for o in itertools.islice(offsets, concurrency)
+    )
+    skip = start > 0
+    data = b""
+    last_byte = b""
+    while pending:
+        data = pending.popleft().result()
+        for o in itertools.islice(offsets, 1):
+            pending.append(executor.submit(get_range, o, min(o + part_size, end) - 1))
+        if skip:
+            newline = data.find(b"\n")
+            if newline < 0:
+                continue
+            skip = False
+            data = data[newline + 1 :]
+            # the skipped newline ends the previous host's line, a line starts after it
+            last_byte = b"\n"
+        if data:
+            last_byte = data[-1:]
+            yield data
+    if skip:
+        # a single line spans the whole range and belongs to a previous host
+        return
+
+    position = end
+    while last_byte != b"\n" and position < size:
+        tail = get_range(position, min(position + part_size, size) - 1)
+        newline = tail.find(b"\n")
+        if newline >= 0:
+            yield tail[: newline + 1]
+            return
+        last_byte = tail[-1:]
+        position += len(tail)
+        yield tail
+    if last_byte != b"\n":
+        yield b"\n"
+
+
+class _BlockStream(io.RawIOBase):
+    """Readable binary stream over an iterator of byte blocks."""
+
+    def __init__(self, blocks):
+        self._blocks = blocks
+        self._block = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._block:
+            block = next(self._blocks, None)
+            if block is None:
+                return 0
+            self._block = memoryview(block)
+        n = min(len(b), len(self._block))
+        b[:n] = self._block[:n]
+        self._block = self._block[n:]
+        return n
+
+    def close(self):
+        self._blocks.close()
+        super().close()
+
+
+def open_s3_input(
+    s3_client,
+    objects,
+    hosts=("algo-1",),
+    current_host="algo-1",
+    part_size=DEFAULT_PART_SIZE,
+    concurrency=DEFAULT_CONCURRENCY,
+):
+    """Opens the input objects as one stream of lines, read straight from S3 into memory.
 
-    logger.info("Writing out datasets to %s.", base_dir)
-    pd.DataFrame(train).to_csv(f"{base_dir}/train/train.csv", header=False, index=False)
-    pd.DataFrame(validation).to_csv(
-        f"{base_dir}/validation/validation.csv", header=False, index=False
+    With several hosts each host reads the lines starting in its byte range of
+    every object, see get_shard_range().
+    """
+
+    def blocks():
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for bucket, key, size, _ in objects:
+                start, end = get_shard_range(size, list(hosts), current_host)
+                yield from iter_object_range(
+                    s3_client, executor, bucket, key, size, start, end, part_size, concurrency
+                )
+
+    return io.BufferedReader(_BlockStream(blocks()), buffer_size=part_size)
+
+
+def exchange_stats(stats, s3_client, prefix, hosts, current_host, poll_interval=5, timeout=3600):
+    """Shares the partial statistics of every host through S3 and reduces them.
+
+    Each host uploads its statistics under prefix, waits until all hosts have
+    done so, and merges them in host order so every host fits the same
+    transformers.
+    """
+    bucket = prefix.split("/")[2]
+    key_prefix = "/".join(prefix.split("/")[3:]).rstrip("/")
+    s3_client.put_object(
+        Bucket=bucket, Key=f"{key_prefix}/{current_host}.npz", Body=stats.to_bytes()
+    )
+
+    keys = [f"{key_prefix}/{host}.npz" for host in hosts]
+    deadline = time.time() + timeout
+    while True:
+        response = s3_client.list_objects_v2(Bucket=bucket, Prefix=f"{key_prefix}/")
+        available = {o["Key"] for o in response.get("Contents", [])}
+        if all(k in available for k in keys):
+            break
+        if time.time() > deadline:
+            raise TimeoutError(f"Statistics of all hosts not available under {prefix}")
+        logger.info("Waiting for %d of %d hosts.", len(set(keys) - available), len(hosts))
+        time.sleep(poll_interval)
+
+    merged = StreamingFeatureStats(sample_size=stats.sample_size, compact=stats.compact)
+    for k in keys:
+        data = s3_client.get_object(Bucket=bucket, Key=k)["Body"].read()
+        merged.merge(StreamingFeatureStats.from_bytes(data, stats.sample_size))
+    return merged
+
+
+def preprocess_sharded(
+    s3_client,
+    source,
+    base_dir,
+    exchange_prefix,
+    hosts,
+    current_host,
+    chunk_size,
+    sample_size=DEFAULT_MEDIAN_SAMPLE_SIZE,
+    output_format="csv",
+    float32=False,
+    seed=None,
+    compact=False,
+    parts=1,
+    executor=None,
+):
+    """Preprocesses the current host's shard of the input.
+
+    source reads the shard of the current host, see open_s3_input(). Phase one
+    fits partial statistics over the shard and reduces them with the other
+    hosts, phase two transforms the shard and writes per-host part files. Each
+    host draws from its own stream of the seed.
+    """
+    if seed is not None:
+        seed = [seed, hosts.index(current_host)]
+    stats = fit_streaming_stats(source, chunk_size, sample_size, seed, compact)
+    rows = stats.rows
+    logger.info("Exchanging statistics of %d rows with %d hosts.", rows, len(hosts))
+    with profiler.phase("exchange"):
+        stats = exchange_stats(stats, s3_client, exchange_prefix, hosts, current_host).finalize()
+    write_streaming_splits(
+        source,
+        base_dir,
+        stats,
+        chunk_size,
+        rows,
+        current_host,
+        output_format,
+        float32,
+        seed,
+        parts,
+        executor,
+    )
+    return stats
+
+
+def get_cache_key(objects, arguments, code_path=__file__):
+    """Hashes the input object versions, this script and the arguments shaping the outputs."""
+    h = hashlib.sha256()
+    with open(code_path, "rb") as f:
+        h.update(f.read())
+    content = {
+        "objects": [[bucket, key, etag] for bucket, key, _, etag in objects],
+        "arguments": {k: v for k, v in arguments.items() if k not in CACHE_KEY_IGNORED_ARGUMENTS},
+    }
+    h.update(json.dumps(content, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def restore_from_cache(s3_client, cache_url, base_dir):
+    """Downloads the cached splits into base_dir, returns False on a cache miss.
+
+    An entry is complete once its manifest exists, the manifest is written last.
+    """
+    bucket = cache_url.split("/")[2]
+    prefix = "/".join(cache_url.split("/")[3:])
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=f"{prefix}/manifest.json")["Body"]
+    except s3_client.exceptions.NoSuchKey:
+        return False
+
+    for path in json.loads(body.read())["files"]:
+        logger.info("Restoring %s from cache.", path)
+        os.makedirs(os.path.dirname(f"{base_dir}/{path}"), exist_ok=True)
+        s3_client.download_file(bucket, f"{prefix}/{path}", f"{base_dir}/{path}")
+    return True
+
+
+def save_to_cache(s3_client, cache_url, base_dir, transformer):
+    """Uploads the fitted transformer and the splits in base_dir to the cache."""
+    bucket = cache_url.split("/")[2]
+    prefix = "/".join(cache_url.split("/")[3:])
+    files = sorted(
+        f"{directory}/{name}"
+        for directory in SPLIT_NAMES + ["manifest"]
+        for name in os.listdir(f"{base_dir}/{directory}")
     )
-    pd.DataFrame(test).to_csv(f"{base_dir}/test/test.csv", header=False, index=False)
+    for path in files:
+        s3_client.upload_file(f"{base_dir}/{path}", bucket, f"{prefix}/{path}")
+
+    buffer = io.BytesIO()
+    joblib.dump(transformer, buffer)
+    s3_client.put_object(Bucket=bucket, Key=f"{prefix}/transformer.joblib", Body=buffer.getvalue())
+    s3_client.put_object(
+        Bucket=bucket, Key=f"{prefix}/manifest.json", Body=json.dumps({"files": files}).encode()
+    )
+
+
+def main():
+    """Parses the job arguments and writes the datasets."""
+    logger.info("Starting preprocessing.")
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input-data",
+        type=str,
+        required=True,
+        help="S3 URL of the input object, or of a prefix whose objects are read in key order.",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=0,
+        help="Process the input in chunks of this many rows, 0 loads it at once.",
+    )
+    parser.add_argument("--median-sample-size", type=int, default=DEFAULT_MEDIAN_SAMPLE_SIZE)
+    parser.add_argument(
+        "--exchange-prefix",
+        type=str,
+        default=None,
+        help="S3 prefix the hosts of a multi-instance job share their statistics under.",
+    )
+    parser.add_argument("--output-format", type=str, default="csv", choices=sorted(OUTPUT_FORMATS))
+    parser.add_argument(
+        "--float32", action="store_true", help="Write the splits with 32-bit floats."
+    )
+    parser.add_argument(
+        "--part-size", type=int, default=DEFAULT_PART_SIZE, help="Bytes per ranged GET."
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Ranged GETs in flight."
+    )
+    parser.add_argument(
+        "--seed", type=int, default=None, help="Seed of the train/validation/test split."
+    )
+    parser.add_argument(
+        "--stratify-bins",
+        type=int,
+        default=0,
+        help="Stratify the split on this many quantile bins of rings, in-memory mode only.",
+    )
+    parser.add_argument(
+        "--compact-dtypes",
+        action="store_true",
+        help="Parse numerics as float32 and sex as a categorical, best with --float32.",
+    )
+    parser.add_argument(
+        "--cache-prefix",
+        type=str,
+        default=None,
+        help="S3 prefix caching the splits by input, code and arguments, needs --seed.",
+    )
+    parser.add_argument(
+        "--split-parts",
+        type=int,
+        default=1,
+        help="Write each split as this many part files, for ShardedByS3Key channels.",
+    )
+    parser.add_argument(
+        "--write-workers", type=int, default=1, help="Part files written concurrently."
+    )
+    parser.add_argument(
+        "--write-executor",
+        type=str,
+        default="thread",
+        choices=["thread", "process"],
+        help="Write the parts with threads or, in-memory mode only, processes.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=os.environ.get(PROFILE_ENVIRONMENT_VARIABLE, "off"),
+        choices=PROFILE_MODES,
+        help="Time and trace the memory of each phase into profile/, cprofile also dumps cProfile.",
+    )
+    args = parser.parse_args()
+    profiler.mode = args.profile
+    if args.split_parts < 1 or args.write_workers < 1:
+        raise ValueError("--split-parts and --write-workers must be positive")
+    if args.write_executor == "process" and (
+        args.chunk_size > 0 or len(get_host_topology()[0]) > 1
+    ):
+        raise ValueError(
+            "--write-executor process requires the in-memory mode on a single instance"
+        )
+    if args.stratify_bins and (args.chunk_size > 0 or len(get_host_topology()[0]) > 1):
+        raise ValueError("--stratify-bins requires the in-memory mode on a single instance")
+
+    base_dir = "/opt/ml/processing"
+    s3_client = boto3.client("s3")
+    with profiler.phase("list_input"):
+        objects = list_input_objects(s3_client, args.input_data)
+    hosts, current_host = get_host_topology()
+    logger.info("Reading %d objects from %s.", len(objects), args.input_data)
+
+    # an unseeded split differs on every run, and the part files of a
+    # multi-instance job depend on the exchange between hosts
+    cache_url = None
+    if args.cache_prefix and args.seed is not None and len(hosts) == 1:
+        cache_key = get_cache_key(objects, vars(args))
+        cache_url = f"{args.cache_prefix.rstrip('/')}/{cache_key}"
+        with profiler.phase("cache_restore"):
+            restored = restore_from_cache(s3_client, cache_url, base_dir)
+        if restored:
+            logger.info("Restored the datasets from cache %s.", cache_url)
+            profiler.write(f"{base_dir}/profile", current_host)
+            return
+        logger.info("No cached datasets at %s.", cache_url)
+
+    def source():
+        return open_s3_input(
+            s3_client, objects, hosts, current_host, args.part_size, args.concurrency
+        )
+
+    executor = None
+    if args.write_workers > 1 and args.split_parts > 1:
+        if args.write_executor == "process":
+            executor = ProcessPoolExecutor(args.write_workers)
+        else:
+            executor = ThreadPoolExecutor(args.write_workers)
+
+    if len(hosts) > 1:
+        if not args.exchange_prefix:
+            raise ValueError("--exchange-prefix is required with more than one instance")
+        transformer = preprocess_sharded(
+            s3_client,
+            source,
+            base_dir,
+            f"{args.exchange_prefix.rstrip('/')}/{get_job_name()}",
+            hosts,
+            current_host,
+            args.chunk_size,
+            args.median_sample_size,
+            args.output_format,
+            args.float32,
+            args.seed,
+            args.compact_dtypes,
+            args.split_parts,
+            executor,
+        )
+    elif args.chunk_size > 0:
+        transformer = preprocess_streaming(
+            source,
+            base_dir,
+            args.chunk_size,
+            args.median_sample_size,
+            args.output_format,
+            args.float32,
+            args.seed,
+            args.compact_dtypes,
+            args.split_parts,
+            executor,
+        )
+    else:
+        transformer = preprocess_in_memory(
+            source,
+            base_dir,
+            args.output_format,
+            args.float32,
+            args.seed,
+            args.stratify_bins,
+            args.compact_dtypes,
+            args.split_parts,
+            executor,
+        )
+    if executor is not None:
+        executor.shutdown()
+
+    if cache_url:
+        logger.info("Saving the datasets to cache %s.", cache_url)
+        with profiler.phase("cache_save"):
+            save_to_cache(s3_client, cache_url, base_dir, transformer)
+    profiler.write(f"{base_dir}/profile", current_host)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+# Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Runs a pipeline once for each of many parameter sets."""
+from __future__ import absolute_import
+
+import asyncio
+import csv
+import functools
+import json
+import random
+import time
+import uuid
+
+from datetime import datetime, timedelta, timezone
+
+from pipelines.monitor import TERMINAL_STATUSES, format_duration
+
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_POLL_INTERVAL = 30
+
+# Error codes of calls that are retried with backoff, ResourceLimitExceeded is
+# returned when the account runs too many executions at the same time.
+RETRIED_ERROR_CODES = [
+    "ThrottlingException",
+    "Throttling",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "ResourceLimitExceeded",
+]
+MAX_ATTEMPTS = 8
+BASE_DELAY = 1
+MAX_DELAY = 60
+
+RESULT_COLUMNS = [
+    "index",
+    "display_name",
+    "status",
+    "duration_seconds",
+    "execution_arn",
+    "failure_reason",
+]
+
+
+def load_parameter_sets(path):
+    """Reads a JSON array of objects, each the pipeline parameter values of an execution."""
+    with open(path) as f:
+        parameter_sets = json.load(f)
+    if not isinstance(parameter_sets, list) or not all(isinstance(p, dict) for p in parameter_sets):
+        raise ValueError(f"{path} must hold a JSON array of parameter objects")
+    return parameter_sets
+
+
+def call_with_backoff(method, **kwargs):
+    """Calls a client method, retrying throttled calls with exponential backoff and jitter."""
+    from botocore.exceptions import ClientError
+
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return method(**kwargs)
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code not in RETRIED_ERROR_CODES or attempt == MAX_ATTEMPTS - 1:
+                raise
+            # full jitter spreads out the retries of the concurrent calls
+            time.sleep(random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2**attempt)))
+
+
+def list_execution_statuses(sm_client, pipeline_name, created_after):
+    """Returns the summaries of the executions created after a time by execution ARN."""
+    summaries = {}
+    paginator = sm_client.get_paginator("list_pipeline_executions")
+    for page in paginator.paginate(PipelineName=pipeline_name, CreatedAfter=created_after):
+        for summary in page["PipelineExecutionSummaries"]:
+            summaries[summary["PipelineExecutionArn"]] = summary
+    return summaries
+
+
+async def run_batch(
+    sm_client,
+    pipeline_name,
+    parameter_sets,
+    max_concurrency=DEFAULT_MAX_CONCURRENCY,
+    poll_interval=DEFAULT_POLL_INTERVAL,
+    on_event=None,
+):
+    """Runs an execution of the pipeline for each parameter set, max_concurrency at a time.
+
+    An execution is started when fewer than max_concurrency executions of the batch
+    run. A single poller lists the executions of the pipeline every poll_interval
+    seconds and completes those that ended. Throttled calls are retried with
+    backoff, and each start has its own client request token, so a retried start
+    does not launch a second execution. If polling fails, the executions still
+    running get the status Unknown and the remaining sets are not started.
+
+    Args:
+        sm_client: SageMaker client.
+        pipeline_name: the name of the pipeline.
+        parameter_sets: list of dicts of the parameter values of each execution.
+        max_concurrency: most executions of the batch running at the same time.
+        poll_interval: seconds between two polls of the execution statuses.
+        on_event: callable receiving each result as its execution ends. Prints a
+            line by default.
+
+    Returns:
+        A list of the result dicts of the parameter sets, with the RESULT_COLUMNS
+        and the parameters.
+    """
+    on_event = on_event or (lambda result: print(format_result(result), flush=True))
+    loop = asyncio.get_event_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    # executions are listed from a minute before the batch to allow for clock skew
+    created_after = datetime.now(timezone.utc) - timedelta(minutes=1)
+    running = {}
+    # the error that stopped the poller, the executions can no longer be tracked after it
+    poll_errors = []
+
+    def call(function, **kwargs):
+        return loop.run_in_executor(None, functools.partial(function, **kwargs))
+
+    async def run(index, parameters):
+        display_name = f"batch-{index}"
+        result = {"index": index, "display_name": display_name, "parameters": parameters}
+        async with semaphore:
+            if poll_errors:
+                result.update(
+                    status="NotStarted", failure_reason=f"Polling failed: {poll_errors[0]}"
+                )
+                on_event(result)
+                return result
+            try:
+                response = await call(
+                    call_with_backoff,
+                    method=sm_client.start_pipeline_execution,
+                    PipelineName=pipeline_name,
+                    PipelineExecutionDisplayName=display_name,
+                    PipelineParameters=[
+                        {"Name": name, "Value": str(value)} for name, value in parameters.items()
+                    ],
+                    ClientRequestToken=uuid.uuid4().hex,
+                )
+            except Exception as e:  # pylint: disable=W0703
+                result.update(status="NotStarted", failure_reason=str(e))
+                on_event(result)
+                return result
+            execution_arn = response["PipelineExecutionArn"]
+            result["execution_arn"] = execution_arn
+            future = loop.create_future()
+            if poll_errors:
+                future.set_exception(poll_errors[0])
+            else:
+                running[execution_arn] = future
+            try:
+                summary = await future
+            except Exception as e:  # pylint: disable=W0703
+                result.update(status="Unknown", failure_reason=f"Polling failed: {e}")
+                on_event(result)
+                return result
+
+        try:
+            execution = await call(
+                call_with_backoff,
+                method=sm_client.describe_pipeline_execution,
+                PipelineExecutionArn=execution_arn,
+            )
+        except Exception as e:  # pylint: disable=W0703
+            # keep the results of the other sets, which gather would drop on an exception
+            result.update(status="Unknown", failure_reason=f"Describing the execution failed: {e}")
+            on_event(result)
+            return result
+        result.update(
+            status=summary["PipelineExecutionStatus"],
+            duration_seconds=(
+                execution["LastModifiedTime"] - execution["CreationTime"]
+            ).total_seconds(),
+            failure_reason=summary.get("PipelineExecutionFailureReason"),
+        )
+        on_event(result)
+        return result
+
+    async def poll():
+        try:
+            while True:
+                await asyncio.sleep(poll_interval)
+                if not running:
+                    continue
+                summaries = await call(
+                    call_with_backoff,
+                    method=list_execution_statuses,
+                    sm_client=sm_client,
+                    pipeline_name=pipeline_name,
+                    created_after=created_after,
+                )
+                for execution_arn in list(running):
+                    summary = summaries.get(execution_arn)
+                    if summary and summary["PipelineExecutionStatus"] in TERMINAL_STATUSES:
+                        running.pop(execution_arn).set_result(summary)
+        except Exception as e:  # pylint: disable=W0703
+            # fail the waiting executions instead of leaving them to wait forever
+            poll_errors.append(e)
+            for future in running.values():
+                future.set_exception(e)
+            running.clear()
+
+    poller = asyncio.ensure_future(poll())
+    try:
+        return await asyncio.gather(*(run(i, p) for i, p in enumerate(parameter_sets)))
+    finally:
+        poller.cancel()
+
+
+def format_result(result):
+    """Formats the result of a parameter set as a line of the live log."""
+    line = f"{result['display_name']}: {result['status']}"
+    if result.get("duration_seconds") is not None:
+        line += f" after {format_duration(result['duration_seconds'])}"
+    if result.get("failure_reason"):
+        line += f" ({result['failure_reason']})"
+    return line
+
+
+def write_results(path, results):
+    """Writes the results as a CSV table with a column for each parameter."""
+    parameter_names = sorted({name for r in results for name in r["parameters"]})
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(RESULT_COLUMNS + parameter_names)
+        for result in results:
+            writer.writerow(
+                [result.get(column) for column in RESULT_COLUMNS]
+                + [result["parameters"].get(name) for name in parameter_names]
+            )
+
+
+def run(sm_client, pipeline_name, parameter_sets, **kwargs):
+    """Runs the batch from synchronous code.
+
+    Returns:
+        The results of run_batch.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            run_batch(sm_client, pipeline_name, parameter_sets, **kwargs)
+        )
+    finally:
+        loop.close()
@@ -0,0 +1,171 @@
+"""Resolves the data science environment configuration of a SageMaker project."""
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Seconds a resolved environment is reused, 0 disables the cache.
+DEFAULT_CACHE_TTL = 300
+CACHE_TTL_VARIABLE = "SM_ENVIRONMENT_CACHE_TTL"
+CACHE_DIR_VARIABLE = "SM_ENVIRONMENT_CACHE_DIR"
+
+# Most names a single ssm:GetParameters call accepts.
+SSM_BATCH_SIZE = 10
+
+_cache = {}
+
+
+def get_environment(
+    project_name, ssm_params, ttl=None, sm_client=None, ssm_client=None, sts_client=None
+):
+    """Gets the environment of the project's SageMaker domain and its SSM parameters.
+
+    Results are cached in-process and in a file under the system temporary
+    directory for ttl seconds, keyed by the account of the credentials, the
+    region, the project name and the parameters.
+
+    Args:
+        project_name: name of the SageMaker project
+        ssm_params: list of dicts with the VariableName to set from the ParameterName
+            of the environment
+        ttl: seconds to reuse a cached environment, SM_ENVIRONMENT_CACHE_TTL or
+            DEFAULT_CACHE_TTL by default
+        sm_client: SageMaker client, created if omitted
+        ssm_client: SSM client, created if omitted
+        sts_client: STS client to read the account of the credentials, created if omitted
+
+    Returns:
+        a dict of the domain settings, its EnvironmentName and EnvironmentType tags and
+        the parameter values, an empty string for each parameter that cannot be read
+    """
+    if ttl is None:
+        ttl = float(os.environ.get(CACHE_TTL_VARIABLE, DEFAULT_CACHE_TTL))
+    if sm_client is None or ssm_client is None or sts_client is None:
+        import boto3
+
+        sm_client = sm_client or boto3.client("sagemaker")
+        ssm_client = ssm_client or boto3.client("ssm")
+        sts_client = sts_client or boto3.client("sts")
+    # a host deploying to several accounts or regions must not mix up their environments
+    account = sts_client.get_caller_identity()["Account"]
+    key = hashlib.sha256(
+        json.dumps(
+            [account, sm_client.meta.region_name, project_name, ssm_params], sort_keys=True
+        ).encode()
+    ).hexdigest()
+    cache_path = os.path.join(get_cache_dir(), f"{key}.json")
+
+    if ttl > 0:
+        entry = _cache.get(key) or read_cache_file(cache_path)
+        if entry and time.time() - entry["time"] < ttl:
+            _cache[key] = entry
+            return dict(entry["environment"])
+
+    environment = resolve_environment(project_name, ssm_params, sm_client, ssm_client)
+    if ttl > 0:
+        entry = {"time": time.time(), "environment": environment}
+        _cache[key] = entry
+        write_cache_file(cache_path, entry)
+    return dict(environment)
+
+
+def load_environment_file(path, ssm_params=(), required=()):
+    """Reads the environment from a JSON file instead of the project, for offline use.
+
+    Args:
+        path: JSON file with an object of the environment values, such as a saved
+            get_environment result
+        ssm_params: list of dicts with the VariableName of each expected parameter
+        required: other names the environment must have
+
+    Returns:
+        a dict of the environment values
+    """
+    with open(path) as f:
+        environment = json.load(f)
+    missing = [
+        name
+        for name in [*required, *(p["VariableName"] for p in ssm_params)]
+        if name not in environment
+    ]
+    if missing:
+        raise ValueError(f"Environment file {path} lacks {', '.join(missing)}")
+    return environment
+
+
+def resolve_environment(project_name, ssm_params, sm_client, ssm_client):
+    """Reads the environment with the domain calls and the parameter batches in parallel."""
+    project = sm_client.describe_project(ProjectName=project_name)
+    domain_id = project["CreatedBy"]["DomainId"]
+    # the domain ARN shares the partition, region and account of the project ARN
+    domain_arn = f"{project['ProjectArn'].rsplit(':', 1)[0]}:domain/{domain_id}"
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        domain = executor.submit(sm_client.describe_domain, DomainId=domain_id)
+        tags = executor.submit(sm_client.list_tags, ResourceArn=domain_arn)
+
+        r = domain.result()
+        del r["ResponseMetadata"]
+        del r["CreationTime"]
+        del r["LastModifiedTime"]
+        r = {**r, **r["DefaultUserSettings"]}
+        del r["DefaultUserSettings"]
+
+        i = {
+            **r,
+            **{
+                t["Key"]: t["Value"]
+                for t in tags.result()["Tags"]
+                if t["Key"] in ["EnvironmentName", "EnvironmentType"]
+            },
+        }
+
+        prefix = f"{i.get('EnvironmentName')}-{i.get('EnvironmentType')}"
+        names = [f"{prefix}-{p['ParameterName']}" for p in ssm_params]
+        batches = [names[n : n + SSM_BATCH_SIZE] for n in range(0, len(names), SSM_BATCH_SIZE)]
+        values = {}
+        for batch_values in executor.map(lambda b: get_parameters(ssm_client, b), batches):
+            values.update(batch_values)
+
+    for p, name in zip(ssm_params, names):
+        i[p["VariableName"]] = values.get(name, "")
+    return i
+
+
+def get_parameters(ssm_client, names):
+    """Returns the values of the parameters, leaving out those that cannot be read."""
+    try:
+        response = ssm_client.get_parameters(Names=names)
+    except Exception:
+        return {}
+    return {p["Name"]: p["Value"] for p in response["Parameters"]}
+
+
+def get_cache_dir():
+    """Returns the directory of the on-disk environment cache."""
+    return os.environ.get(
+        CACHE_DIR_VARIABLE, os.path.join(tempfile.gettempdir(), "sagemaker-environment")
+    )
+
+
+def read_cache_file(path):
+    """Returns the cache entry in path, None if it is missing or unreadable."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache_file(path, entry):
+    """Writes the cache entry readable by the current user only, atomically."""
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        json.dump(entry, f, default=str)
+    os.replace(temporary_path, path)
@@ -16,7 +16,7 @@ from __future__ import absolute_import
 import argparse
 import sys
 
-from pipelines._utils import get_pipeline_driver
+from pipelines._utils import get_pipeline_driver, convert_struct
 
 
 def main():  # pragma: no cover
@@ -48,6 +48,14 @@ def main():  # pragma: no cover
         default=None,
         help="Dict string of keyword arguments for the pipeline generation (if supported)",
     )
+    parser.add_argument(
+        "-environment-file",
+        "--environment-file",
+        dest="environment_file",
+        type=str,
+        default=None,
+        help="JSON file with the environment values to render the definition without AWS calls.",
+    )
     args = parser.parse_args()
 
     if args.module_name is None:
@@ -55,7 +63,10 @@ def main():  # pragma: no cover
         sys.exit(2)
 
     try:
-        pipeline = get_pipeline_driver(args.module_name, args.kwargs)
+        kwargs = convert_struct(args.kwargs)
+        if args.environment_file:
+            kwargs["environment_file"] = args.environment_file
+        pipeline = get_pipeline_driver(args.module_name, kwargs)
         content = pipeline.definition()
         if args.file_name:
             with open(args.file_name, "w") as f:
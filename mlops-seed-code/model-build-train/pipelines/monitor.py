@@ -0,0 +1,303 @@
+# Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Watches pipeline executions and reports step transitions as they happen."""
+from __future__ import absolute_import
+
+import argparse
+import asyncio
+import functools
+import json
+import sys
+
+# Pipeline execution statuses after which nothing changes anymore.
+TERMINAL_STATUSES = ["Succeeded", "Failed", "Stopped"]
+
+DEFAULT_MIN_INTERVAL = 5
+DEFAULT_MAX_INTERVAL = 60
+# Growth of the polling interval after each poll that saw no change.
+INTERVAL_BACKOFF = 1.5
+
+
+def list_steps(sm_client, execution_arn):
+    """Lists the step summaries of an execution, in the order they were created."""
+    steps = []
+    paginator = sm_client.get_paginator("list_pipeline_execution_steps")
+    for page in paginator.paginate(PipelineExecutionArn=execution_arn, SortOrder="Ascending"):
+        steps += page["PipelineExecutionSteps"]
+    return steps
+
+
+def get_step_dependencies(definition):
+    """Maps each step of a pipeline definition to the steps it waits for.
+
+    A step waits for the steps whose properties it references, the steps in its
+    DependsOn and, for the steps of a condition branch, the condition step.
+    """
+    dependencies = {}
+
+    def references(value):
+        if isinstance(value, dict):
+            reference = value.get("Get")
+            if isinstance(reference, str) and reference.startswith("Steps."):
+                yield reference.split(".")[1].split("[")[0]
+            for v in value.values():
+                yield from references(v)
+        elif isinstance(value, list):
+            for v in value:
+                yield from references(v)
+
+    def add(step, parent=None):
+        arguments = step.get("Arguments", {})
+        branches = arguments.get("IfSteps", []) + arguments.get("ElseSteps", [])
+        if step["Type"] == "Condition":
+            arguments = {k: v for k, v in arguments.items() if k not in ["IfSteps", "ElseSteps"]}
+        names = set(references(arguments)) | set(step.get("DependsOn", []))
+        if parent:
+            names.add(parent)
+        dependencies[step["Name"]] = sorted(names)
+        for branch_step in branches:
+            add(branch_step, step["Name"])
+
+    for step in json.loads(definition)["Steps"]:
+        add(step)
+    return dependencies
+
+
+def get_critical_path(steps, dependencies):
+    """Gets the chain of steps that determined when the execution finished.
+
+    Starts from the step that ended last and walks back to the dependency that
+    ended last, as a step can only start once all its dependencies have ended.
+
+    Args:
+        steps: step summaries with StepName, StartTime and EndTime.
+        dependencies: dict of the steps each step waits for.
+
+    Returns:
+        The step summaries of the critical path, first step first.
+    """
+    ended = {s["StepName"]: s for s in steps if s.get("StartTime") and s.get("EndTime")}
+    if not ended:
+        return []
+    path = [max(ended.values(), key=lambda s: s["EndTime"])]
+    while True:
+        parents = [ended[d] for d in dependencies.get(path[-1]["StepName"], []) if d in ended]
+        if not parents:
+            return path[::-1]
+        path.append(max(parents, key=lambda s: s["EndTime"]))
+
+
+def get_step_seconds(step):
+    """Returns the seconds a step ran, None if it has not both started and ended."""
+    if step.get("StartTime") and step.get("EndTime"):
+        return (step["EndTime"] - step["StartTime"]).total_seconds()
+    return None
+
+
+def format_duration(seconds):
+    """Formats seconds as 1h02m03s, 2m03s or 3s."""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h{minutes:02d}m{seconds:02d}s"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
+
+
+def format_event(event):
+    """Formats a step transition as a line of the live log."""
+    line = f"{event['step']}: {event['status']}"
+    if event.get("time"):
+        line = f"{event['time']:%H:%M:%S} {line}"
+    if event.get("duration") is not None:
+        line += f" after {format_duration(event['duration'])}"
+    if event.get("reason"):
+        line += f" ({event['reason']})"
+    return line
+
+
+async def watch_execution(
+    sm_client,
+    execution_arn,
+    on_event=None,
+    min_interval=DEFAULT_MIN_INTERVAL,
+    max_interval=DEFAULT_MAX_INTERVAL,
+):
+    """Polls an execution until it ends, reporting each step transition.
+
+    The polling interval starts at min_interval, grows by INTERVAL_BACKOFF after
+    every poll without a transition up to max_interval, and drops back to
+    min_interval on a transition. The blocking client calls run in the default
+    executor, so several executions can be watched concurrently.
+
+    Args:
+        sm_client: SageMaker client.
+        execution_arn: the ARN of the pipeline execution.
+        on_event: callable receiving a dict with the step, status, time and, once the
+            step has ended, duration and failure reason. Prints the event by default.
+        min_interval: shortest seconds between polls.
+        max_interval: longest seconds between polls.
+
+    Returns:
+        A dict with the final execution status, its start and end time, the step
+        summaries and the critical path.
+    """
+    on_event = on_event or (lambda event: print(format_event(event), flush=True))
+    loop = asyncio.get_event_loop()
+
+    def call(function, **kwargs):
+        return loop.run_in_executor(None, functools.partial(function, **kwargs))
+
+    seen = {}
+
+    def report(steps):
+        changed = False
+        for step in steps:
+            name, status = step["StepName"], step["StepStatus"]
+            if seen.get(name) == status:
+                continue
+            seen[name] = status
+            changed = True
+            ended = step.get("EndTime") is not None and status not in ["Starting", "Executing"]
+            on_event(
+                {
+                    "step": name,
+                    "status": status,
+                    "time": step["EndTime"] if ended else step.get("StartTime"),
+                    "duration": get_step_seconds(step) if ended else None,
+                    "reason": step.get("FailureReason"),
+                }
+            )
+        return changed
+
+    interval = min_interval
+    while True:
+        execution, steps = await asyncio.gather(
+            call(sm_client.describe_pipeline_execution, PipelineExecutionArn=execution_arn),
+            call(list_steps, sm_client=sm_client, execution_arn=execution_arn),
+        )
+        if execution["PipelineExecutionStatus"] in TERMINAL_STATUSES:
+            # the steps were listed concurrently, list them again for their final state
+            steps = await call(list_steps, sm_client=sm_client, execution_arn=execution_arn)
+            report(steps)
+            break
+        changed = report(steps)
+        interval = min_interval if changed else min(interval * INTERVAL_BACKOFF, max_interval)
+        await asyncio.sleep(interval)
+
+    definition = (
+        await call(
+            sm_client.describe_pipeline_definition_for_execution,
+            PipelineExecutionArn=execution_arn,
+        )
+    )["PipelineDefinition"]
+    return {
+        "execution_arn": execution_arn,
+        "status": execution["PipelineExecutionStatus"],
+        "start_time": execution["CreationTime"],
+        "end_time": execution["LastModifiedTime"],
+        "steps": steps,
+        "critical_path": get_critical_path(steps, get_step_dependencies(definition)),
+    }
+
+
+def format_summary(result):
+    """Formats the timings of a watched execution and its critical path."""
+    start = result["start_time"]
+    lines = [
+        f"Execution {result['status']} after "
+        f"{format_duration((result['end_time'] - start).total_seconds())}",
+        f"{'Step':<40} {'Status':<10} {'Started':>9} {'Duration':>9}",
+    ]
+    for step in sorted(result["steps"], key=lambda s: s.get("StartTime") or result["end_time"]):
+        started = duration = "-"
+        if step.get("StartTime"):
+            started = "+" + format_duration((step["StartTime"] - start).total_seconds())
+            if step.get("EndTime"):
+                duration = format_duration(get_step_seconds(step))
+        lines.append(f"{step['StepName']:<40} {step['StepStatus']:<10} {started:>9} {duration:>9}")
+    if result["critical_path"]:
+        path = result["critical_path"]
+        busy = sum(get_step_seconds(s) for s in path)
+        lines.append(
+            f"Critical path, {format_duration(busy)} running: "
+            + " -> ".join(f"{s['StepName']} ({format_duration(get_step_seconds(s))})" for s in path)
+        )
+    return "\n".join(lines)
+
+
+def watch(sm_client, execution_arn, **kwargs):
+    """Watches an execution from synchronous code and prints its summary.
+
+    Returns:
+        The result of watch_execution.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        result = loop.run_until_complete(watch_execution(sm_client, execution_arn, **kwargs))
+    finally:
+        loop.close()
+    print(format_summary(result))
+    return result
+
+
+def main():  # pragma: no cover
+    """The main harness that watches a pipeline execution.
+
+    Exits with 1 unless the execution succeeds.
+    """
+    parser = argparse.ArgumentParser("Watches a pipeline execution until it ends.")
+    parser.add_argument(
+        "-execution-arn",
+        "--execution-arn",
+        dest="execution_arn",
+        type=str,
+        help="The ARN of the pipeline execution to watch.",
+    )
+    parser.add_argument(
+        "-min-interval",
+        "--min-interval",
+        dest="min_interval",
+        type=float,
+        default=DEFAULT_MIN_INTERVAL,
+        help="Shortest seconds between two polls.",
+    )
+    parser.add_argument(
+        "-max-interval",
+        "--max-interval",
+        dest="max_interval",
+        type=float,
+        default=DEFAULT_MAX_INTERVAL,
+        help="Longest seconds between two polls.",
+    )
+    args = parser.parse_args()
+
+    if args.execution_arn is None:
+        parser.print_help()
+        sys.exit(2)
+
+    import boto3
+
+    result = watch(
+        boto3.client("sagemaker"),
+        args.execution_arn,
+        min_interval=args.min_interval,
+        max_interval=args.max_interval,
+    )
+    if result["status"] != "Succeeded":
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,7 +17,134 @@ import argparse
 import json
 import sys
 
-from pipelines._utils import get_pipeline_driver, convert_struct
+from pipelines._utils import (
+    get_pipeline_driver,
+    convert_struct,
+    get_definition_hash,
+    get_parameter_values,
+)
+from pipelines import batch
+from pipelines.monitor import watch
+
+
+def is_pipeline_unchanged(sm_client, pipeline_name, definition, role_arn, description=None):
+    """Checks if the deployed pipeline has the same definition, role and description.
+
+    Returns:
+        False if the pipeline does not exist or differs, True otherwise.
+    """
+    from botocore.exceptions import ClientError
+
+    try:
+        deployed = sm_client.describe_pipeline(PipelineName=pipeline_name)
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ResourceNotFound":
+            return False
+        raise
+    return (
+        get_definition_hash(deployed["PipelineDefinition"]) == get_definition_hash(definition)
+        and deployed.get("RoleArn") == role_arn
+        and (description is None or deployed.get("PipelineDescription") == description)
+    )
+
+
+def get_last_successful_execution(sm_client, pipeline_name):
+    """Gets the description of the latest succeeded execution of the pipeline, or None."""
+    paginator = sm_client.get_paginator("list_pipeline_executions")
+    for page in paginator.paginate(
+        PipelineName=pipeline_name, SortBy="CreationTime", SortOrder="Descending"
+    ):
+        for summary in page["PipelineExecutionSummaries"]:
+            if summary["PipelineExecutionStatus"] == "Succeeded":
+                return sm_client.describe_pipeline_execution(
+                    PipelineExecutionArn=summary["PipelineExecutionArn"]
+                )
+    return None
+
+
+def is_execution_unchanged(sm_client, execution_arn, definition, parameters=None):
+    """Checks if an execution ran the same definition with the same parameter values."""
+    executed = sm_client.describe_pipeline_definition_for_execution(
+        PipelineExecutionArn=execution_arn
+    )["PipelineDefinition"]
+    paginator = sm_client.get_paginator("list_pipeline_parameters_for_execution")
+    executed_parameters = {
+        p["Name"]: p["Value"]
+        for page in paginator.paginate(PipelineExecutionArn=execution_arn)
+        for p in page["PipelineParameters"]
+    }
+    return get_definition_hash(executed, executed_parameters) == get_definition_hash(
+        definition, get_parameter_values(definition, parameters)
+    )
+
+
+def upsert(pipeline, role_arn, description=None, tags=None, force=False, definition=None):
+    """Creates or updates the pipeline unless the deployed one is the same.
+
+    The deployed pipeline is the same if it has the same definition, role and
+    description.
+    """
+    sm_client = pipeline.sagemaker_session.sagemaker_client
+    definition = definition or pipeline.definition()
+
+    if not force and is_pipeline_unchanged(
+        sm_client, pipeline.name, definition, role_arn, description
+    ):
+        print(f"\n###### Pipeline {pipeline.name} is unchanged, skipping the upsert")
+    else:
+        upsert_response = pipeline.upsert(role_arn=role_arn, description=description, tags=tags)
+        print("\n###### Created/Updated SageMaker Pipeline: Response received:")
+        print(upsert_response)
+
+
+def upsert_and_start(
+    pipeline,
+    role_arn,
+    description=None,
+    tags=None,
+    skip_unchanged_execution=False,
+    force=False,
+    definition=None,
+):
+    """Creates or updates the pipeline and starts an execution, skipping what is unchanged.
+
+    The upsert is skipped when the deployed pipeline has the same definition, role
+    and description. With skip_unchanged_execution, the execution is also skipped
+    when the last successful execution ran the same definition with the same
+    parameter values.
+
+    Args:
+        pipeline: the SageMaker Workflow pipeline.
+        role_arn: the role arn for the pipeline service execution role.
+        description: the description of the pipeline.
+        tags: list of tags of the pipeline.
+        skip_unchanged_execution: skip the execution if it would repeat the last successful one.
+        force: always upsert and start.
+        definition: the definition of the pipeline if already rendered.
+
+    Returns:
+        The started execution, None if it was skipped.
+    """
+    sm_client = pipeline.sagemaker_session.sagemaker_client
+    definition = definition or pipeline.definition()
+    upsert(pipeline, role_arn, description, tags, force, definition)
+
+    if skip_unchanged_execution and not force:
+        last_execution = get_last_successful_execution(sm_client, pipeline.name)
+        if last_execution and is_execution_unchanged(
+            sm_client, last_execution["PipelineExecutionArn"], definition
+        ):
+            duration = last_execution["LastModifiedTime"] - last_execution["CreationTime"]
+            print(
+                "\n###### Skipping the execution, the last successful execution "
+                f"{last_execution['PipelineExecutionArn']} ran the same definition and "
+                f"parameters, saving about {duration.total_seconds() / 60:.1f} minutes"
+            )
+            return None
+
+    execution = pipeline.start()
+    print(f"\n###### Execution started with PipelineExecutionArn: {execution.arn}")
+    return execution
 
 
 def main():  # pragma: no cover
@@ -65,6 +192,44 @@ def main():  # pragma: no cover
         default=None,
         help="""List of dict strings of '[{"Key": "string", "Value": "string"}, ..]'""",
     )
+    parser.add_argument(
+        "-skip-unchanged-execution",
+        "--skip-unchanged-execution",
+        dest="skip_unchanged_execution",
+        action="store_true",
+        help="Do not start an execution if the last successful one ran the same definition.",
+    )
+    parser.add_argument(
+        "-force",
+        "--force",
+        dest="force",
+        action="store_true",
+        help="Upsert and start the pipeline even if it is unchanged.",
+    )
+    parser.add_argument(
+        "-parameter-sets",
+        "--parameter-sets",
+        dest="parameter_sets",
+        type=str,
+        default=None,
+        help="JSON file of a list of pipeline parameter dicts, runs an execution for each.",
+    )
+    parser.add_argument(
+        "-max-concurrency",
+        "--max-concurrency",
+        dest="max_concurrency",
+        type=int,
+        default=batch.DEFAULT_MAX_CONCURRENCY,
+        help="Most executions of the parameter sets running at the same time.",
+    )
+    parser.add_argument(
+        "-results",
+        "--results",
+        dest="results",
+        type=str,
+        default="batch-results.csv",
+        help="CSV file of the results of the parameter sets.",
+    )
     args = parser.parse_args()
 
     if args.module_name is None or args.role_arn is None:
@@ -76,25 +241,47 @@ def main():  # pragma: no cover
         print(f"###### Get the pipeline defintion from {args.module_name}")
         pipeline = get_pipeline_driver(args.module_name, args.kwargs)
         print("###### Creating/updating a SageMaker Pipeline with the following definition:")
-        parsed = json.loads(pipeline.definition())
+        definition = pipeline.definition()
+        parsed = json.loads(definition)
         print(json.dumps(parsed, indent=2, sort_keys=True))
 
         print(f'##### Pipeline execution role arn: {args.role_arn}')
-        upsert_response = pipeline.upsert(
-            role_arn=args.role_arn, description=args.description, tags=tags
-        )
-        print("\n###### Created/Updated SageMaker Pipeline: Response received:")
-        print(upsert_response)
+        if args.parameter_sets:
+            parameter_sets = batch.load_parameter_sets(args.parameter_sets)
+            upsert(pipeline, args.role_arn, args.description, tags, args.force, definition)
+            print(
+                f"\n###### Running {len(parameter_sets)} executions, "
+                f"{args.max_concurrency} at a time"
+            )
+            results = batch.run(
+                pipeline.sagemaker_session.sagemaker_client,
+                pipeline.name,
+                parameter_sets,
+                max_concurrency=args.max_concurrency,
+            )
+            batch.write_results(args.results, results)
+            print(f"\n###### Wrote the results to {args.results}")
+            if any(r["status"] != "Succeeded" for r in results):
+                sys.exit(1)
+            return
 
-        execution = pipeline.start()
-        print(f"\n###### Execution started with PipelineExecutionArn: {execution.arn}")
+        execution = upsert_and_start(
+            pipeline,
+            args.role_arn,
+            description=args.description,
+            tags=tags,
+            skip_unchanged_execution=args.skip_unchanged_execution,
+            force=args.force,
+            definition=definition,
+        )
+        if execution is None:
+            return
 
         print("Waiting for the execution to finish...")
-        execution.wait()
-        print("\n#####Execution completed. Execution step details:")
-
-        print(execution.list_steps())
-        # Todo print the status?
+        result = watch(pipeline.sagemaker_session.sagemaker_client, execution.arn)
+        if result["status"] != "Succeeded":
+            print(f"\n###### Execution {result['status']}")
+            sys.exit(1)
     except Exception as e:  # pylint: disable=W0703
         print(f"Exception in pipelines.run_pipeline:main: {e}")
         sys.exit(1)
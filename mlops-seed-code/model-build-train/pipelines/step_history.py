@@ -0,0 +1,401 @@
+# Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Records the step durations of pipeline executions and detects slowdowns."""
+from __future__ import absolute_import
+
+import argparse
+import itertools
+import math
+import random
+import sqlite3
+import statistics
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+
+from pipelines.monitor import TERMINAL_STATUSES, format_duration, list_steps
+
+DEFAULT_DATABASE = "step-history.sqlite"
+DEFAULT_MAX_EXECUTIONS = 50
+DEFAULT_WORKERS = 8
+
+# Regression test: the last DEFAULT_RECENT runs of a step against the DEFAULT_WINDOW
+# runs before them, flagged at p < DEFAULT_ALPHA if at least DEFAULT_MIN_SLOWDOWN slower.
+DEFAULT_WINDOW = 20
+DEFAULT_RECENT = 3
+DEFAULT_ALPHA = 0.01
+DEFAULT_MIN_SLOWDOWN = 0.1
+# Most splits the permutation test enumerates, it samples this many above that.
+MAX_PERMUTATIONS = 100000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS executions (
+    execution_arn TEXT PRIMARY KEY,
+    pipeline_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    start_time REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS step_runs (
+    execution_arn TEXT NOT NULL REFERENCES executions (execution_arn),
+    pipeline_name TEXT NOT NULL,
+    step_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    start_time REAL,
+    end_time REAL,
+    duration REAL,
+    instance_type TEXT,
+    instance_count INTEGER,
+    PRIMARY KEY (execution_arn, step_name)
+);
+CREATE INDEX IF NOT EXISTS step_runs_by_step ON step_runs (pipeline_name, step_name, start_time);
+"""
+
+
+def connect(path=DEFAULT_DATABASE):
+    """Opens the history database, creating its tables if needed."""
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def get_instance_config(sm_client, metadata):
+    """Returns the instance type and count of the job a step ran, (None, None) for other steps."""
+    if "TrainingJob" in metadata:
+        job = sm_client.describe_training_job(
+            TrainingJobName=metadata["TrainingJob"]["Arn"].rsplit("/", 1)[-1]
+        )
+        return job["ResourceConfig"]["InstanceType"], job["ResourceConfig"]["InstanceCount"]
+    if "ProcessingJob" in metadata:
+        job = sm_client.describe_processing_job(
+            ProcessingJobName=metadata["ProcessingJob"]["Arn"].rsplit("/", 1)[-1]
+        )
+        cluster = job["ProcessingResources"]["ClusterConfig"]
+        return cluster["InstanceType"], cluster["InstanceCount"]
+    return None, None
+
+
+def get_step_runs(sm_client, pipeline_name, execution_arn):
+    """Returns the rows of the step runs of an execution."""
+    rows = []
+    for step in list_steps(sm_client, execution_arn):
+        start, end = step.get("StartTime"), step.get("EndTime")
+        instance_type, instance_count = get_instance_config(sm_client, step.get("Metadata", {}))
+        rows.append(
+            (
+                execution_arn,
+                pipeline_name,
+                step["StepName"],
+                step["StepStatus"],
+                start.timestamp() if start else None,
+                end.timestamp() if end else None,
+                (end - start).total_seconds() if start and end else None,
+                instance_type,
+                instance_count,
+            )
+        )
+    return rows
+
+
+def collect(
+    connection,
+    sm_client,
+    pipeline_name,
+    max_executions=DEFAULT_MAX_EXECUTIONS,
+    workers=DEFAULT_WORKERS,
+):
+    """Stores the step runs of the latest ended executions not in the history yet.
+
+    The steps of the executions are listed concurrently. Running executions are
+    left for a later collection.
+
+    Returns:
+        The number of executions added.
+    """
+    stored = {
+        arn
+        for (arn,) in connection.execute(
+            "SELECT execution_arn FROM executions WHERE pipeline_name = ?", (pipeline_name,)
+        )
+    }
+    paginator = sm_client.get_paginator("list_pipeline_executions")
+    pages = paginator.paginate(
+        PipelineName=pipeline_name,
+        SortBy="CreationTime",
+        SortOrder="Descending",
+        PaginationConfig={"MaxItems": max_executions},
+    )
+    executions = [
+        e
+        for page in pages
+        for e in page["PipelineExecutionSummaries"]
+        if e["PipelineExecutionStatus"] in TERMINAL_STATUSES
+        and e["PipelineExecutionArn"] not in stored
+    ]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        step_runs = executor.map(
+            lambda e: get_step_runs(sm_client, pipeline_name, e["PipelineExecutionArn"]),
+            executions,
+        )
+        with connection:
+            for execution, rows in zip(executions, step_runs):
+                connection.execute(
+                    "INSERT INTO executions VALUES (?, ?, ?, ?)",
+                    (
+                        execution["PipelineExecutionArn"],
+                        pipeline_name,
+                        execution["PipelineExecutionStatus"],
+                        execution["StartTime"].timestamp(),
+                    ),
+                )
+                connection.executemany(
+                    "INSERT OR REPLACE INTO step_runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+                )
+    return len(executions)
+
+
+def permutation_p_value(recent, baseline, seed=0):
+    """Computes the one-sided p-value of the recent durations being longer than the baseline.
+
+    The p-value is the share of the ways to split the pooled durations into groups of
+    their sizes whose recent group has at least the observed mean. The splits are
+    enumerated exactly up to MAX_PERMUTATIONS and sampled with the seed above that.
+    """
+    pooled = list(recent) + list(baseline)
+    observed = sum(recent)
+    k = len(recent)
+    total = math.factorial(len(pooled)) // math.factorial(k) // math.factorial(len(pooled) - k)
+    if total <= MAX_PERMUTATIONS:
+        splits = itertools.combinations(pooled, k)
+    else:
+        rng = random.Random(seed)
+        splits = (rng.sample(pooled, k) for _ in range(MAX_PERMUTATIONS))
+        total = MAX_PERMUTATIONS
+    # a small tolerance counts ties of the floating point sums as at least the observed
+    at_least = sum(1 for split in splits if sum(split) >= observed - 1e-9)
+    return at_least / total
+
+
+def get_min_baseline(recent, alpha):
+    """Returns the fewest baseline runs with which an exact p-value can fall below alpha.
+
+    The smallest p-value of the permutation test is 1 / C(baseline + recent, recent).
+    """
+    baseline = 1
+    while (
+        math.factorial(baseline + recent) // math.factorial(recent) // math.factorial(baseline)
+        <= 1 / alpha
+    ):
+        baseline += 1
+    return max(baseline, recent)
+
+
+def find_regressions(
+    connection,
+    pipeline_name,
+    window=DEFAULT_WINDOW,
+    recent=DEFAULT_RECENT,
+    alpha=DEFAULT_ALPHA,
+    min_slowdown=DEFAULT_MIN_SLOWDOWN,
+    on_skip=None,
+):
+    """Finds the steps whose last runs are significantly slower than the runs before them.
+
+    Only succeeded runs count, and runs of a step are only compared with runs on the
+    same instance type and count. A step is only tested once its baseline is long
+    enough for a p-value below alpha, see get_min_baseline().
+
+    Args:
+        on_skip: callable receiving a dict with the step, instance type and count,
+            baseline runs and the baseline runs needed of each step not tested.
+
+    Returns:
+        A list of dicts with the step, instance type and count, recent and baseline
+        median durations, slowdown and p-value of each regression.
+    """
+    min_baseline = get_min_baseline(recent, alpha)
+    if window < min_baseline:
+        raise ValueError(
+            f"A window of {window} runs cannot reach p < {alpha} with {recent} recent runs, "
+            f"it needs at least {min_baseline}"
+        )
+    groups = connection.execute(
+        "SELECT DISTINCT step_name, instance_type, instance_count FROM step_runs "
+        "WHERE pipeline_name = ? AND status = 'Succeeded' AND duration IS NOT NULL",
+        (pipeline_name,),
+    ).fetchall()
+    regressions = []
+    for step_name, instance_type, instance_count in groups:
+        durations = [
+            d
+            for (d,) in connection.execute(
+                "SELECT duration FROM step_runs WHERE pipeline_name = ? AND step_name = ? "
+                "AND instance_type IS ? AND instance_count IS ? AND status = 'Succeeded' "
+                "AND duration IS NOT NULL ORDER BY start_time DESC LIMIT ?",
+                (pipeline_name, step_name, instance_type, instance_count, window + recent),
+            )
+        ]
+        latest, baseline = durations[:recent], durations[recent:]
+        if len(latest) < recent or len(baseline) < min_baseline:
+            if on_skip:
+                on_skip(
+                    {
+                        "step": step_name,
+                        "instance_type": instance_type,
+                        "instance_count": instance_count,
+                        "runs": len(baseline),
+                        "needed": min_baseline,
+                    }
+                )
+            continue
+        recent_median = statistics.median(latest)
+        baseline_median = statistics.median(baseline)
+        slowdown = recent_median / baseline_median - 1 if baseline_median else math.inf
+        if slowdown < min_slowdown:
+            continue
+        p_value = permutation_p_value(latest, baseline)
+        if p_value < alpha:
+            regressions.append(
+                {
+                    "step": step_name,
+                    "instance_type": instance_type,
+                    "instance_count": instance_count,
+                    "recent_median": recent_median,
+                    "baseline_median": baseline_median,
+                    "slowdown": slowdown,
+                    "p_value": p_value,
+                }
+            )
+    return regressions
+
+
+def format_regression(regression):
+    """Formats a regression as a line of the report."""
+    instances = ""
+    if regression["instance_type"]:
+        instances = f" on {regression['instance_count']} x {regression['instance_type']}"
+    return (
+        f"{regression['step']}{instances}: {format_duration(regression['recent_median'])} "
+        f"recently, {format_duration(regression['baseline_median'])} before, "
+        f"{regression['slowdown']:.0%} slower (p={regression['p_value']:.4f})"
+    )
+
+
+def main():  # pragma: no cover
+    """The main harness that updates the step history and reports regressions.
+
+    Exits with 1 if a step got significantly slower.
+    """
+    parser = argparse.ArgumentParser(
+        "Records the step durations of a pipeline and reports slowdowns."
+    )
+    parser.add_argument(
+        "-pipeline-name",
+        "--pipeline-name",
+        dest="pipeline_name",
+        type=str,
+        help="The name of the pipeline.",
+    )
+    parser.add_argument(
+        "-database",
+        "--database",
+        dest="database",
+        type=str,
+        default=DEFAULT_DATABASE,
+        help="The SQLite file of the step history.",
+    )
+    parser.add_argument(
+        "-max-executions",
+        "--max-executions",
+        dest="max_executions",
+        type=int,
+        default=DEFAULT_MAX_EXECUTIONS,
+        help="The number of latest executions to collect.",
+    )
+    parser.add_argument(
+        "-workers",
+        "--workers",
+        dest="workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Executions whose steps are read concurrently.",
+    )
+    parser.add_argument(
+        "-window",
+        "--window",
+        dest="window",
+        type=int,
+        default=DEFAULT_WINDOW,
+        help="Runs of a step in the baseline.",
+    )
+    parser.add_argument(
+        "-recent",
+        "--recent",
+        dest="recent",
+        type=int,
+        default=DEFAULT_RECENT,
+        help="Latest runs of a step compared with the baseline.",
+    )
+    parser.add_argument(
+        "-alpha",
+        "--alpha",
+        dest="alpha",
+        type=float,
+        default=DEFAULT_ALPHA,
+        help="Significance level of the slowdowns.",
+    )
+    parser.add_argument(
+        "-min-slowdown",
+        "--min-slowdown",
+        dest="min_slowdown",
+        type=float,
+        default=DEFAULT_MIN_SLOWDOWN,
+        help="Smallest slowdown reported, 0.1 is 10%%.",
+    )
+    args = parser.parse_args()
+
+    if args.pipeline_name is None:
+        parser.print_help()
+        sys.exit(2)
+
+    import boto3
+
+    connection = connect(args.database)
+    added = collect(
+        connection,
+        boto3.client("sagemaker"),
+        args.pipeline_name,
+        max_executions=args.max_executions,
+        workers=args.workers,
+    )
+    print(f"Added {added} executions of {args.pipeline_name} to {args.database}")
+
+    regressions = find_regressions(
+        connection,
+        args.pipeline_name,
+        window=args.window,
+        recent=args.recent,
+        alpha=args.alpha,
+        min_slowdown=args.min_slowdown,
+        on_skip=lambda s: print(
+            f"Not checked: {s['step']} has {s['runs']} baseline runs, {s['needed']} needed"
+        ),
+    )
+    for regression in regressions:
+        print(f"Regression: {format_regression(regression)}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
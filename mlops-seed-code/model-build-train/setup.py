@@ -19,11 +19,14 @@ extras = {
         "coverage",
         "flake8",
         "mock",
+        "pyarrow",
         "pydocstyle",
         "pytest",
         "pytest-cov",
         "sagemaker",
+        "scikit-learn",
         "tox",
+        "xgboost",
     ]
 }
 setuptools.setup(
@@ -45,6 +48,8 @@ setuptools.setup(
         "console_scripts": [
             "get-pipeline-definition=pipelines.get_pipeline_definition:main",
             "run-pipeline=pipelines.run_pipeline:main",
+            "watch-pipeline=pipelines.monitor:main",
+            "pipeline-step-history=pipelines.step_history:main",
         ]
     },
     classifiers=[
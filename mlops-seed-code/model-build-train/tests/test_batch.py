@@ -0,0 +1,213 @@
+import asyncio
+import csv
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+from mock import MagicMock, patch
+
+from pipelines import batch
+
+PIPELINE_ARN = "arn:aws:sagemaker:eu-west-1:111111111111:pipeline/abalone"
+START = datetime(2021, 7, 1, 12, tzinfo=timezone.utc)
+PARAMETER_SETS = [
+    {"InputDataUrl": f"s3://data/abalone-{i}.csv", "TrainingInstanceType": "ml.m5.xlarge"}
+    for i in range(5)
+]
+
+
+def throttled(operation):
+    return ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate"}}, operation)
+
+
+class FakeSageMaker:
+    """Runs each started execution for two polls, the executions of odd sets fail."""
+
+    def __init__(self, throttled_starts=0):
+        self.throttled_starts = throttled_starts
+        self.polls = {}
+        self.running = 0
+        self.most_running = 0
+        self.starts = []
+        self.list_calls = 0
+
+    def start_pipeline_execution(self, **kwargs):
+        if self.throttled_starts:
+            self.throttled_starts -= 1
+            raise throttled("StartPipelineExecution")
+        self.starts.append(kwargs)
+        arn = f"{PIPELINE_ARN}/execution/{kwargs['PipelineExecutionDisplayName']}"
+        self.polls[arn] = 0
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        return {"PipelineExecutionArn": arn}
+
+    def list_executions(self, **kwargs):
+        self.list_calls += 1
+        summaries = []
+        for arn in self.polls:
+            self.polls[arn] += 1
+            status = "Executing"
+            if self.polls[arn] == 2:
+                self.running -= 1
+            if self.polls[arn] >= 2:
+                status = "Failed" if int(arn[-1]) % 2 else "Succeeded"
+            summary = {"PipelineExecutionArn": arn, "PipelineExecutionStatus": status}
+            if status == "Failed":
+                summary["PipelineExecutionFailureReason"] = "Step Train failed"
+            summaries.append(summary)
+        return [{"PipelineExecutionSummaries": summaries}]
+
+    def describe_pipeline_execution(self, PipelineExecutionArn):
+        return {"CreationTime": START, "LastModifiedTime": START + timedelta(minutes=20)}
+
+    def get_client(self):
+        sm_client = MagicMock()
+        sm_client.start_pipeline_execution.side_effect = self.start_pipeline_execution
+        sm_client.get_paginator.return_value.paginate.side_effect = self.list_executions
+        sm_client.describe_pipeline_execution.side_effect = self.describe_pipeline_execution
+        return sm_client
+
+
+def run(fake, **kwargs):
+    events = []
+    with patch.object(batch.time, "sleep") as sleep:
+        results = batch.run(
+            fake.get_client(),
+            "abalone",
+            PARAMETER_SETS,
+            poll_interval=0,
+            on_event=events.append,
+            **kwargs,
+        )
+    return results, events, sleep
+
+
+def test_batch_limits_running_executions_and_polls_them_together():
+    fake = FakeSageMaker()
+    results, events, _ = run(fake, max_concurrency=2)
+
+    assert fake.most_running == 2
+    assert len(fake.starts) == 5
+    assert fake.starts[1]["PipelineParameters"] == [
+        {"Name": "InputDataUrl", "Value": "s3://data/abalone-1.csv"},
+        {"Name": "TrainingInstanceType", "Value": "ml.m5.xlarge"},
+    ]
+    assert len({s["ClientRequestToken"] for s in fake.starts}) == 5
+    # one list call polls all the running executions
+    assert fake.list_calls < 10
+    assert [r["status"] for r in results] == [
+        "Succeeded",
+        "Failed",
+        "Succeeded",
+        "Failed",
+        "Succeeded",
+    ]
+    assert results[1]["failure_reason"] == "Step Train failed"
+    assert results[0]["duration_seconds"] == 1200
+    assert len(events) == 5
+
+
+def test_batch_retries_throttled_starts():
+    fake = FakeSageMaker(throttled_starts=3)
+    results, _, sleep = run(fake, max_concurrency=5)
+
+    assert sleep.call_count == 3
+    assert all(0 <= call.args[0] <= batch.MAX_DELAY for call in sleep.call_args_list)
+    assert all(r["status"] != "NotStarted" for r in results)
+
+
+def test_batch_records_sets_that_could_not_start():
+    fake = FakeSageMaker(throttled_starts=batch.MAX_ATTEMPTS)
+    results, _, _ = run(fake, max_concurrency=1)
+
+    assert results[0]["status"] == "NotStarted"
+    assert "ThrottlingException" in results[0]["failure_reason"]
+    assert [r["status"] for r in results[1:]] == ["Failed", "Succeeded", "Failed", "Succeeded"]
+
+
+def test_write_results(tmp_path):
+    results = [
+        {
+            "index": 0,
+            "display_name": "batch-0",
+            "status": "Succeeded",
+            "duration_seconds": 1200.0,
+            "execution_arn": f"{PIPELINE_ARN}/execution/batch-0",
+            "parameters": {"InputDataUrl": "s3://data/a.csv"},
+        },
+        {
+            "index": 1,
+            "display_name": "batch-1",
+            "status": "NotStarted",
+            "failure_reason": "Throttled",
+            "parameters": {"TrainingInstanceType": "ml.m5.xlarge"},
+        },
+    ]
+    path = tmp_path / "results.csv"
+    batch.write_results(str(path), results)
+
+    with open(path) as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == batch.RESULT_COLUMNS + ["InputDataUrl", "TrainingInstanceType"]
+    assert rows[0]["status"] == "Succeeded"
+    assert rows[0]["InputDataUrl"] == "s3://data/a.csv"
+    assert rows[1]["failure_reason"] == "Throttled"
+    assert rows[1]["TrainingInstanceType"] == "ml.m5.xlarge"
+
+
+def test_batch_fails_running_executions_when_polling_fails():
+    fake = FakeSageMaker()
+    sm_client = fake.get_client()
+    sm_client.get_paginator.return_value.paginate.side_effect = ClientError(
+        {"Error": {"Code": "AccessDeniedException", "Message": "Denied"}},
+        "ListPipelineExecutions",
+    )
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(
+            asyncio.wait_for(
+                batch.run_batch(
+                    sm_client,
+                    "abalone",
+                    PARAMETER_SETS,
+                    max_concurrency=2,
+                    poll_interval=0,
+                    on_event=lambda result: None,
+                ),
+                timeout=5,
+            )
+        )
+    finally:
+        loop.close()
+
+    assert len(fake.starts) == 2
+    assert [r["status"] for r in results] == ["Unknown"] * 2 + ["NotStarted"] * 3
+    assert results[0]["execution_arn"] == f"{PIPELINE_ARN}/execution/batch-0"
+    assert "AccessDeniedException" in results[0]["failure_reason"]
+
+
+def test_batch_keeps_other_results_when_describing_an_execution_fails():
+    fake = FakeSageMaker()
+    sm_client = fake.get_client()
+
+    def describe_pipeline_execution(PipelineExecutionArn):
+        if PipelineExecutionArn.endswith("batch-2"):
+            raise ClientError(
+                {"Error": {"Code": "ValidationException", "Message": "Gone"}},
+                "DescribePipelineExecution",
+            )
+        return fake.describe_pipeline_execution(PipelineExecutionArn)
+
+    sm_client.describe_pipeline_execution.side_effect = describe_pipeline_execution
+    results = batch.run(
+        sm_client, "abalone", PARAMETER_SETS, poll_interval=0, on_event=lambda result: None
+    )
+
+    assert [r["status"] for r in results] == [
+        "Succeeded",
+        "Failed",
+        "Unknown",
+        "Failed",
+        "Succeeded",
+    ]
+    assert "ValidationException" in results[2]["failure_reason"]
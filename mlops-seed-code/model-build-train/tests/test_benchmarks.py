@@ -0,0 +1,120 @@
+import importlib.util
+import multiprocessing
+import os
+import queue
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mock import MagicMock
+
+BENCHMARKS = os.path.join(os.path.dirname(__file__), "..", "benchmarks")
+
+
+def load_benchmark(name="preprocess_benchmark"):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(BENCHMARKS, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.parametrize(
+    "mode, phases",
+    [
+        ("in-memory", {"read", "transform", "split", "write"}),
+        ("streaming", {"fit_pass", "write_pass"}),
+    ],
+)
+def test_benchmark_case_reports_every_phase(tmp_path, mode, phases):
+    benchmark = load_benchmark()
+    benchmark.generate_csv(tmp_path / "abalone.csv", 2000, missing_rate=0.01)
+
+    results = queue.Queue()
+    benchmark.run_case(str(tmp_path), "abalone.csv", mode, 300, results)
+    result = results.get_nowait()
+
+    assert result["rows"] == 2000
+    assert set(result["seconds"]) == phases | {"total"}
+    assert result["peak_rss_bytes"] > 0
+    assert benchmark.preprocess.profiler.mode == "off"
+
+
+def test_case_that_dies_or_hangs_is_reported_as_failed():
+    benchmark = load_benchmark()
+    context = multiprocessing.get_context("spawn")
+
+    process = context.Process(target=os._exit, args=(3,))
+    process.start()
+    assert benchmark.wait_for_case(process, context.Queue()) == (
+        None,
+        "exited with code 3 without a result",
+    )
+
+    process = context.Process(target=time.sleep, args=(60,))
+    process.start()
+    result, error = benchmark.wait_for_case(process, context.Queue(), timeout=0)
+    assert result is None and error == "timed out after 0s"
+    assert not process.is_alive()
+
+
+def test_find_regressions_flags_slower_phases():
+    benchmark = load_benchmark()
+    baseline = [{"rows": 10, "mode": "in-memory", "seconds": {"fit": 1.0, "write": 1.0}}]
+    results = [{"rows": 10, "mode": "in-memory", "seconds": {"fit": 1.1, "write": 1.5}}]
+
+    regressions = benchmark.find_regressions(results, baseline, tolerance=0.2)
+    assert len(regressions) == 1 and "write" in regressions[0]
+
+
+def test_training_input_benchmark_times_first_round():
+    benchmark = load_benchmark("training_input_benchmark")
+    start = datetime(2021, 7, 1, tzinfo=timezone.utc)
+    sm_client = MagicMock()
+    sm_client.describe_training_job.return_value = {
+        "InputDataConfig": [
+            {"ChannelName": "train", "InputMode": "FastFile"},
+            {"ChannelName": "validation", "InputMode": "FastFile"},
+        ],
+        "AlgorithmSpecification": {"TrainingInputMode": "File"},
+        "ResourceConfig": {"InstanceCount": 2},
+        "TrainingStartTime": start,
+        "TrainingEndTime": start + timedelta(seconds=300),
+        "SecondaryStatusTransitions": [
+            {
+                "Status": "Downloading",
+                "StartTime": start + timedelta(seconds=60),
+                "EndTime": start + timedelta(seconds=70),
+            },
+        ],
+    }
+    first_round = (start + timedelta(seconds=95)).timestamp() * 1000
+    logs_client = MagicMock()
+    logs_client.get_paginator.return_value.paginate.return_value = [
+        {"events": [{"timestamp": first_round - 5000, "message": "Train matrix has 100 rows"}]},
+        {
+            "events": [
+                {"timestamp": first_round + 2000, "message": "[0]#011train-rmse:9.1"},
+                {"timestamp": first_round, "message": "[0]\ttrain-rmse:9.2\tvalidation-rmse:9.3"},
+            ]
+        },
+    ]
+
+    result = benchmark.measure_job(sm_client, logs_client, "job")
+    assert result["input_mode"] == "FastFile"
+    assert result["download_seconds"] == 10
+    assert result["first_round_seconds"] == 95
+    assert result["training_seconds"] == 300
+
+    summary = benchmark.summarize([result, {**result, "first_round_seconds": 105}])
+    assert summary["FastFile"]["jobs"] == 2
+    assert summary["FastFile"]["first_round_seconds"] == 100
+
+
+def test_startup_benchmark_flags_slower_phases():
+    benchmark = load_benchmark("startup_benchmark")
+    results = [{"case": "cli_help", "seconds": benchmark.measure_cli_help()}]
+    assert results[0]["seconds"]["total"] > 0
+
+    baseline = [{"case": "cli_help", "seconds": {"total": results[0]["seconds"]["total"] / 2}}]
+    regressions = benchmark.find_regressions(results, baseline, tolerance=0.2)
+    assert len(regressions) == 1 and "cli_help" in regressions[0]
@@ -0,0 +1,90 @@
+import datetime
+
+import pytest
+from mock import MagicMock
+
+from pipelines import environment
+
+SSM_PARAMS = [{"VariableName": f"Var{i}", "ParameterName": f"param-{i}"} for i in range(12)]
+
+
+def make_clients(account="111111111111", region="eu-west-1"):
+    sm = MagicMock()
+    sm.meta.region_name = region
+    sm.describe_project.return_value = {
+        "ProjectArn": "arn:aws:sagemaker:eu-west-1:111111111111:project/p",
+        "CreatedBy": {"DomainId": "d-1"},
+    }
+    sm.describe_domain.side_effect = lambda DomainId: {
+        "ResponseMetadata": {},
+        "CreationTime": datetime.datetime(2021, 1, 1),
+        "LastModifiedTime": datetime.datetime(2021, 1, 1),
+        "DomainArn": "arn:aws:sagemaker:eu-west-1:111111111111:domain/d-1",
+        "SubnetIds": ["subnet-1"],
+        "DefaultUserSettings": {"ExecutionRole": "role", "SecurityGroups": ["sg-1"]},
+    }
+    sm.list_tags.return_value = {
+        "Tags": [
+            {"Key": "EnvironmentName", "Value": "ds"},
+            {"Key": "EnvironmentType", "Value": "dev"},
+            {"Key": "Other", "Value": "x"},
+        ]
+    }
+    ssm = MagicMock()
+    # every parameter but the last exists
+    ssm.get_parameters.side_effect = lambda Names: {
+        "Parameters": [{"Name": n, "Value": n.upper()} for n in Names if n != "ds-dev-param-11"],
+        "InvalidParameters": [n for n in Names if n == "ds-dev-param-11"],
+    }
+    sts = MagicMock()
+    sts.get_caller_identity.return_value = {"Account": account}
+    return {"sm_client": sm, "ssm_client": ssm, "sts_client": sts}
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv(environment.CACHE_DIR_VARIABLE, str(tmp_path))
+    monkeypatch.setattr(environment, "_cache", {})
+
+
+def test_parameters_are_fetched_in_batches_of_ten():
+    clients = make_clients()
+    sm, ssm = clients["sm_client"], clients["ssm_client"]
+    env = environment.get_environment("p", SSM_PARAMS, ttl=0, **clients)
+
+    sm.list_tags.assert_called_once_with(
+        ResourceArn="arn:aws:sagemaker:eu-west-1:111111111111:domain/d-1"
+    )
+    assert [len(c.kwargs["Names"]) for c in ssm.get_parameters.call_args_list] == [10, 2]
+    assert env["Var0"] == "DS-DEV-PARAM-0"
+    assert env["Var11"] == ""
+    assert env["ExecutionRole"] == "role"
+    assert env["EnvironmentType"] == "dev"
+    assert "Other" not in env and "DefaultUserSettings" not in env
+
+
+def test_environment_is_cached_in_process_and_on_disk(monkeypatch):
+    clients = make_clients()
+    sm = clients["sm_client"]
+    first = environment.get_environment("p", SSM_PARAMS, ttl=60, **clients)
+    assert environment.get_environment("p", SSM_PARAMS, ttl=60, **clients) == first
+
+    # a new process only has the file
+    monkeypatch.setattr(environment, "_cache", {})
+    assert environment.get_environment("p", SSM_PARAMS, ttl=60, **clients) == first
+    assert sm.describe_project.call_count == 1
+
+    environment.get_environment("other", SSM_PARAMS, ttl=60, **clients)
+    assert sm.describe_project.call_count == 2
+
+    monkeypatch.setattr(environment.time, "time", lambda: 2e10)
+    environment.get_environment("p", SSM_PARAMS, ttl=60, **clients)
+    assert sm.describe_project.call_count == 3
+
+
+def test_cached_environment_is_not_shared_across_accounts_or_regions():
+    clients = make_clients()
+    environment.get_environment("p", SSM_PARAMS, ttl=60, **clients)
+    for other in [make_clients(account="222222222222"), make_clients(region="us-east-1")]:
+        environment.get_environment("p", SSM_PARAMS, ttl=60, **other)
+        other["sm_client"].describe_project.assert_called_once()
@@ -0,0 +1,214 @@
+import io
+import json
+import os
+import pickle
+import sys
+import tarfile
+
+import numpy as np
+import pytest
+import xgboost
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+
+from pipelines.abalone import evaluate, preprocess
+
+DATASET = os.path.join(os.path.dirname(__file__), "..", "dataset", "abalone-dataset.csv")
+
+
+def write_test_split(base_dir, output_format):
+    for split in ["train", "validation", "test"]:
+        os.makedirs(os.path.join(base_dir, split), exist_ok=True)
+    preprocess.preprocess_in_memory(
+        DATASET, str(base_dir), output_format=output_format, seed=1, parts=2
+    )
+    return os.path.join(base_dir, "test")
+
+
+def train_model(test_dir):
+    y, X = next(evaluate.iter_test_batches(test_dir, batch_size=1000))
+    return xgboost.train({"max_depth": 3}, xgboost.DMatrix(X, label=y), num_boost_round=5)
+
+
+def test_regression_moments_match_numpy_per_segment():
+    rng = np.random.default_rng(0)
+    y = rng.integers(1, 30, 10007).astype(float)
+    predictions = y + rng.normal(0.5, 2.0, len(y))
+    segments = rng.integers(0, 3, len(y))
+    moments = evaluate.RegressionMoments((3,))
+    for batch in np.array_split(np.arange(len(y)), 13):
+        moments.update(y[batch], predictions[batch], segments[batch])
+
+    for segment in range(3):
+        y_s, predictions_s = y[segments == segment], predictions[segments == segment]
+        residuals = y_s - predictions_s
+        metrics = moments.metrics(segment)
+        assert metrics["count"] == len(y_s)
+        assert metrics["mse"] == pytest.approx(mean_squared_error(y_s, predictions_s), rel=1e-12)
+        assert metrics["mae"] == pytest.approx(mean_absolute_error(y_s, predictions_s), rel=1e-12)
+        assert metrics["r2"] == pytest.approx(r2_score(y_s, predictions_s), rel=1e-12)
+        assert metrics["residual_standard_deviation"] == pytest.approx(np.std(residuals), rel=1e-12)
+
+
+def test_residual_histogram_quantiles_are_exact_to_bin_width():
+    residuals = np.random.default_rng(1).normal(0.0, 3.0, 100000)
+    histogram = evaluate.ResidualHistogram()
+    for batch in np.array_split(residuals, 7):
+        histogram.update(batch)
+    qs = [0.05, 0.5, 0.95]
+    np.testing.assert_allclose(
+        histogram.quantiles(qs), np.quantile(residuals, qs), atol=histogram.width
+    )
+    edges, counts = histogram.coarse(1.0)
+    assert len(edges) == len(counts) + 1
+    assert counts.sum() == len(residuals)
+
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet", "libsvm"])
+def test_batched_evaluation_matches_single_pass(tmp_path, output_format):
+    test_dir = write_test_split(tmp_path, output_format)
+    model = train_model(test_dir)
+    batches = list(evaluate.iter_test_batches(test_dir, batch_size=10 ** 9))
+    y = np.concatenate([y for y, _ in batches])
+    predictions = np.concatenate([model.predict(xgboost.DMatrix(X)) for _, X in batches])
+
+    report = evaluate.evaluate(model, test_dir, batch_size=97).report()
+    metrics = report["regression_metrics"]
+    assert metrics["mse"]["value"] == pytest.approx(mean_squared_error(y, predictions), rel=1e-9)
+    assert metrics["mse"]["standard_deviation"] == pytest.approx(np.std(y - predictions), rel=1e-9)
+    assert metrics["r2"]["value"] == pytest.approx(r2_score(y, predictions), rel=1e-9)
+    assert sum(s["count"] for s in report["segments"]["sex"].values()) == len(y)
+    assert sum(s["count"] for s in report["segments"]["rings"].values()) == len(y)
+    assert set(report["segments"]["sex"]) <= {"F", "I", "M"}
+    json.dumps(report)
+
+
+@pytest.mark.parametrize("output_format", sorted(preprocess.OUTPUT_FORMATS))
+def test_every_output_format_is_evaluated_without_pyarrow(tmp_path, monkeypatch, output_format):
+    test_dir = write_test_split(tmp_path, output_format)
+    # like the XGBoost container
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    monkeypatch.setitem(sys.modules, "pyarrow.parquet", None)
+
+    assert {os.path.splitext(f)[1] for f in os.listdir(test_dir)} <= {".csv", ".libsvm"}
+    report = evaluate.evaluate(train_model(test_dir), test_dir).report()
+    manifest = json.loads((tmp_path / "manifest" / "manifest.json").read_text())
+    rows = sum(part["rows"] for part in manifest["test"])
+    assert sum(s["count"] for s in report["segments"]["sex"].values()) == rows
+
+
+def test_bootstrap_intervals_are_reproducible_and_cover_the_estimate():
+    rng = np.random.default_rng(2)
+    y = rng.integers(1, 30, 500).astype(float)
+    predictions = y + rng.normal(0.0, 2.0, len(y))
+    buckets = evaluate.BootstrapBuckets()
+    for batch in np.array_split(np.arange(len(y)), 3):
+        buckets.update(y[batch], predictions[batch])
+
+    intervals = buckets.confidence_intervals(400, seed=7, workers=1)
+    assert intervals == buckets.confidence_intervals(400, seed=7, workers=2)
+    mse = mean_squared_error(y, predictions)
+    assert intervals["mse"]["lower"] < mse < intervals["mse"]["upper"]
+    assert intervals["r2"]["lower"] < r2_score(y, predictions) < intervals["r2"]["upper"]
+
+    # with fewer rows than buckets this is a row bootstrap
+    indices = np.random.default_rng(3).integers(0, len(y), (2000, len(y)))
+    resampled = np.mean(np.square(y - predictions)[indices], axis=1)
+    expected = np.quantile(resampled, [0.025, 0.975])
+    np.testing.assert_allclose(
+        [intervals["mse"]["lower"], intervals["mse"]["upper"]], expected, rtol=0.05
+    )
+
+
+def test_empty_test_set_has_no_bootstrap_intervals():
+    empty = evaluate.RegressionEvaluation()
+    assert empty.bootstrap.confidence_intervals(400, seed=7, workers=1) == {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        report = empty.report(resamples=400, seed=7, workers=1)
+    assert "confidence_intervals" not in report
+
+    # an empty partial of a map instance merges into the others unchanged
+    buckets = evaluate.BootstrapBuckets()
+    buckets.update(np.array([3.0, 5.0]), np.array([2.0, 5.0]))
+    buckets.merge(evaluate.BootstrapBuckets())
+    assert buckets.rows == 2
+    assert set(buckets.confidence_intervals(10, seed=7, workers=1)) == set(
+        evaluate.BOOTSTRAP_METRICS
+    )
+
+
+def write_model_tar(path, name, data):
+    with tarfile.open(path, "w:gz") as tar:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+
+@pytest.mark.parametrize("model_format", ["json", "ubj", "pickle"])
+def test_load_model_from_tar_stream(tmp_path, model_format):
+    test_dir = write_test_split(tmp_path, "csv")
+    model = train_model(test_dir)
+    if model_format == "pickle":
+        name, data = "./xgboost-model", pickle.dumps(model)
+    else:
+        name, data = f"xgboost-model.{model_format}", bytes(model.save_raw(model_format))
+    write_model_tar(tmp_path / "model.tar.gz", name, data)
+
+    loaded = evaluate.load_model(str(tmp_path / "model.tar.gz"))
+    assert evaluate.load_model(str(tmp_path / "model.tar.gz")) is loaded
+    assert not os.path.exists("xgboost-model")
+    _, X = next(evaluate.iter_test_batches(test_dir))
+    np.testing.assert_array_equal(
+        loaded.predict(xgboost.DMatrix(X)), model.predict(xgboost.DMatrix(X))
+    )
+
+
+def test_partial_evaluations_reduce_to_the_full_evaluation(tmp_path):
+    test_dir = write_test_split(tmp_path, "csv")
+    model = train_model(test_dir)
+    full = evaluate.evaluate(model, test_dir).report()
+
+    partials_dir = tmp_path / "partials"
+    partials_dir.mkdir()
+    for host, part in enumerate(sorted(os.listdir(test_dir)) + [None]):
+        shard_dir = tmp_path / f"shard-{host}"
+        shard_dir.mkdir()
+        if part:
+            os.link(os.path.join(test_dir, part), shard_dir / part)
+        partial = evaluate.evaluate(model, str(shard_dir))
+        (partials_dir / f"partial-algo-{host + 1}.npz").write_bytes(partial.to_bytes())
+    reduced = evaluate.reduce_partials(str(partials_dir)).report()
+
+    for name in ["mse", "rmse", "mae", "r2"]:
+        assert reduced["regression_metrics"][name]["value"] == pytest.approx(
+            full["regression_metrics"][name]["value"], rel=1e-9
+        )
+    assert reduced["residuals"]["histogram"] == full["residuals"]["histogram"]
+    assert reduced["segments"]["sex"].keys() == full["segments"]["sex"].keys()
+    for segment, metrics in full["segments"]["rings"].items():
+        assert reduced["segments"]["rings"][segment]["mse"] == pytest.approx(metrics["mse"])
+
+
+def test_bootstrap_buckets_merge_across_label_shifts():
+    rng = np.random.default_rng(4)
+    y = rng.integers(1, 30, 300).astype(float)
+    predictions = y + rng.normal(0.0, 2.0, len(y))
+    merged = evaluate.BootstrapBuckets()
+    for batch in [np.arange(100), np.arange(100, 300)]:
+        part = evaluate.BootstrapBuckets()
+        part.update(y[batch], predictions[batch])
+        merged.merge(part)
+
+    count, _, _, labels, label_squares = merged.sums.sum(axis=0)
+    assert merged.rows == count == len(y)
+    assert label_squares - labels ** 2 / count == pytest.approx(np.var(y) * len(y))
+
+
+def test_profiler_sums_the_phases_of_each_batch(tmp_path, monkeypatch):
+    test_dir = write_test_split(tmp_path, "csv")
+    model = train_model(test_dir)
+    profiler = evaluate.PhaseProfiler("basic")
+    monkeypatch.setattr(evaluate, "profiler", profiler)
+    evaluate.evaluate(model, test_dir, batch_size=100)
+
+    assert list(profiler.phases) == ["read", "predict", "metrics"]
+    assert profiler.phases["predict"]["calls"] == profiler.phases["read"]["calls"] - 1 > 2
@@ -0,0 +1,139 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from mock import MagicMock, patch
+
+from pipelines import monitor
+
+EXECUTION_ARN = "arn:aws:sagemaker:eu-west-1:111111111111:pipeline/abalone/execution/1"
+START = datetime(2021, 7, 1, 12, tzinfo=timezone.utc)
+DEFINITION = {
+    "Steps": [
+        {"Name": "Preprocess", "Type": "Processing", "Arguments": {}},
+        {
+            "Name": "Train",
+            "Type": "Training",
+            "Arguments": {
+                "Input": {"Get": "Steps.Preprocess.ProcessingOutputConfig.Outputs['train']"}
+            },
+        },
+        {
+            "Name": "Evaluate",
+            "Type": "Processing",
+            "Arguments": {"Model": {"Get": "Steps.Train.ModelArtifacts.S3ModelArtifacts"}},
+            "DependsOn": ["Preprocess"],
+        },
+        {
+            "Name": "Check",
+            "Type": "Condition",
+            "Arguments": {
+                "Conditions": [{"LeftValue": {"Get": "Steps.Evaluate.PropertyFiles.Report"}}],
+                "IfSteps": [
+                    {
+                        "Name": "Register",
+                        "Type": "RegisterModel",
+                        "Arguments": {"Model": {"Get": "Steps.Train.ModelArtifacts"}},
+                    }
+                ],
+                "ElseSteps": [],
+            },
+        },
+    ]
+}
+
+
+def step(name, status, start, end=None, reason=None):
+    summary = {
+        "StepName": name,
+        "StepStatus": status,
+        "StartTime": START + timedelta(minutes=start),
+    }
+    if end is not None:
+        summary["EndTime"] = START + timedelta(minutes=end)
+    if reason:
+        summary["FailureReason"] = reason
+    return summary
+
+
+def get_client(polls, final_steps):
+    sm_client = MagicMock()
+    sm_client.describe_pipeline_execution.side_effect = [
+        {
+            "PipelineExecutionStatus": status,
+            "CreationTime": START,
+            "LastModifiedTime": START + timedelta(minutes=30),
+        }
+        for status, _ in polls
+    ]
+    sm_client.get_paginator.return_value.paginate.side_effect = [
+        [{"PipelineExecutionSteps": steps}] for _, steps in polls
+    ] + [[{"PipelineExecutionSteps": final_steps}]]
+    sm_client.describe_pipeline_definition_for_execution.return_value = {
+        "PipelineDefinition": json.dumps(DEFINITION)
+    }
+    return sm_client
+
+
+def test_step_dependencies():
+    assert monitor.get_step_dependencies(json.dumps(DEFINITION)) == {
+        "Preprocess": [],
+        "Train": ["Preprocess"],
+        "Evaluate": ["Preprocess", "Train"],
+        "Check": ["Evaluate"],
+        "Register": ["Check", "Train"],
+    }
+
+
+def test_watch_reports_transitions_and_backs_off(capsys):
+    preprocessing = [step("Preprocess", "Executing", 0)]
+    training = [step("Preprocess", "Succeeded", 0, 10), step("Train", "Executing", 11)]
+    final_steps = [
+        step("Preprocess", "Succeeded", 0, 10),
+        step("Train", "Failed", 11, 25, reason="AlgorithmError"),
+    ]
+    polls = [
+        ("Executing", preprocessing),
+        ("Executing", preprocessing),
+        ("Executing", preprocessing),
+        ("Executing", training),
+        ("Failed", training),
+    ]
+    sm_client = get_client(polls, final_steps)
+    intervals = []
+
+    async def sleep(seconds):
+        intervals.append(seconds)
+
+    events = []
+    with patch.object(monitor.asyncio, "sleep", sleep):
+        result = monitor.watch(
+            sm_client, EXECUTION_ARN, on_event=events.append, min_interval=1, max_interval=2
+        )
+
+    assert intervals == [1, 1.5, 2, 1]
+    assert [(e["step"], e["status"], e["duration"]) for e in events] == [
+        ("Preprocess", "Executing", None),
+        ("Preprocess", "Succeeded", 600),
+        ("Train", "Executing", None),
+        ("Train", "Failed", 840),
+    ]
+    assert events[-1]["reason"] == "AlgorithmError"
+    assert result["status"] == "Failed"
+    assert [s["StepName"] for s in result["critical_path"]] == ["Preprocess", "Train"]
+
+    summary = capsys.readouterr().out
+    assert "Execution Failed after 30m00s" in summary
+    assert "Critical path, 24m00s running: Preprocess (10m00s) -> Train (14m00s)" in summary
+
+
+def test_critical_path_follows_the_latest_dependency():
+    steps = [
+        step("Preprocess", "Succeeded", 0, 10),
+        step("Train", "Succeeded", 10, 20),
+        step("Evaluate", "Succeeded", 21, 25),
+        step("Check", "Succeeded", 25, 26),
+        step("Register", "Succeeded", 26, 28),
+    ]
+    dependencies = monitor.get_step_dependencies(json.dumps(DEFINITION))
+    path = monitor.get_critical_path(steps, dependencies)
+    assert [s["StepName"] for s in path] == ["Preprocess", "Train", "Evaluate", "Check", "Register"]
@@ -0,0 +1,126 @@
+import json
+import os
+
+import boto3
+import pytest
+import sagemaker
+import sagemaker.tuner
+from mock import MagicMock, patch
+
+from pipelines._utils import get_step_cache_keys
+from pipelines.abalone import pipeline
+
+ENVIRONMENT = {
+    "SecurityGroups": ["sg-1"],
+    "SubnetIds": ["subnet-1"],
+    "ExecutionRole": "arn:aws:iam::111111111111:role/execution",
+    "DataBucketName": "data",
+    "ModelBucketName": "models",
+    "EbsKmsKeyArn": "ebs-key",
+    "S3KmsKeyId": "s3-key",
+}
+CACHED_STEPS = {"PreprocessAbaloneData", "TrainAbaloneModel", "EvaluateAbaloneModel"}
+
+
+def get_session(region, default_bucket):
+    boto_session = boto3.Session(
+        region_name=region, aws_access_key_id="key", aws_secret_access_key="secret"
+    )
+    session = sagemaker.session.Session(
+        boto_session=boto_session,
+        sagemaker_client=MagicMock(),
+        sagemaker_runtime_client=MagicMock(),
+        default_bucket=default_bucket,
+    )
+    session.default_bucket = lambda: default_bucket
+    session.upload_data = (
+        lambda path, bucket, key_prefix: f"s3://{bucket}/{key_prefix}/{os.path.basename(path)}"
+    )
+    return session
+
+
+def get_definition(**kwargs):
+    kwargs.setdefault("step_caching", True)
+    with patch.object(pipeline, "get_environment", return_value=ENVIRONMENT), patch.object(
+        pipeline, "get_session", get_session
+    ):
+        return pipeline.get_pipeline("eu-west-1", project_name="project", **kwargs).definition()
+
+
+@pytest.fixture(scope="module")
+def cache_keys():
+    return get_step_cache_keys(get_definition())
+
+
+def test_identical_definitions_have_identical_cache_keys(cache_keys):
+    assert set(cache_keys) == CACHED_STEPS
+    assert get_step_cache_keys(get_definition()) == cache_keys
+
+
+def test_caching_is_off_by_default():
+    assert get_step_cache_keys(get_definition(step_caching=False)) == {}
+
+
+def test_training_arguments_have_no_timestamped_profiler_rule():
+    steps = {s["Name"]: s for s in json.loads(get_definition())["Steps"]}
+    assert "ProfilerRuleConfigurations" not in steps["TrainAbaloneModel"]["Arguments"]
+
+
+def test_input_data_invalidates_every_step(cache_keys):
+    keys = get_step_cache_keys(get_definition(), {"InputDataUrl": "s3://data/other.csv"})
+    assert all(keys[step] != cache_keys[step] for step in CACHED_STEPS)
+
+
+def test_hyperparameters_invalidate_training_and_evaluation(cache_keys):
+    keys = get_step_cache_keys(get_definition(training_hyperparameters={"max_depth": 6}))
+    assert keys["PreprocessAbaloneData"] == cache_keys["PreprocessAbaloneData"]
+    assert keys["TrainAbaloneModel"] != cache_keys["TrainAbaloneModel"]
+    assert keys["EvaluateAbaloneModel"] != cache_keys["EvaluateAbaloneModel"]
+
+
+def test_unseeded_preprocessing_is_not_cached():
+    keys = get_step_cache_keys(get_definition(split_seed=None))
+    assert "PreprocessAbaloneData" not in keys
+
+
+@pytest.mark.skipif(
+    not hasattr(sagemaker.tuner, "HyperbandStrategyConfig"),
+    reason="tuning steps need a newer SageMaker SDK than buildspec.yml installs",
+)
+@pytest.mark.parametrize("strategy", pipeline.TUNING_STRATEGIES)
+def test_tuning_replaces_training(strategy):
+    keys = get_step_cache_keys(get_definition(tuning_strategy=strategy))
+    assert set(keys) == {"PreprocessAbaloneData", "TuneAbaloneModel", "EvaluateAbaloneModel"}
+    other = get_step_cache_keys(get_definition(tuning_strategy=strategy, tuning_max_jobs=10))
+    assert other["TuneAbaloneModel"] != keys["TuneAbaloneModel"]
+    assert other["EvaluateAbaloneModel"] != keys["EvaluateAbaloneModel"]
+
+
+def test_training_instance_count_invalidates_training_and_evaluation(cache_keys):
+    keys = get_step_cache_keys(get_definition(), {"TrainingInstanceCount": 4})
+    assert keys["PreprocessAbaloneData"] == cache_keys["PreprocessAbaloneData"]
+    assert keys["TrainAbaloneModel"] != cache_keys["TrainAbaloneModel"]
+    assert keys["EvaluateAbaloneModel"] != cache_keys["EvaluateAbaloneModel"]
+
+
+def test_offline_definition_matches_the_online_one(tmp_path):
+    environment_file = tmp_path / "environment.json"
+    environment_file.write_text(json.dumps(ENVIRONMENT))
+
+    def make_api_call(client, operation, params):
+        raise AssertionError(f"{operation} called offline")
+
+    with patch("botocore.client.BaseClient._make_api_call", make_api_call):
+        definition = pipeline.get_pipeline(
+            "eu-west-1", environment_file=str(environment_file), step_caching=True
+        ).definition()
+    assert get_step_cache_keys(definition) == get_step_cache_keys(get_definition())
+
+
+def test_offline_environment_needs_every_value(tmp_path):
+    environment_file = tmp_path / "environment.json"
+    environment_file.write_text(
+        json.dumps({k: v for k, v in ENVIRONMENT.items() if k != "ModelBucketName"})
+    )
+    with pytest.raises(ValueError, match="ModelBucketName"):
+        pipeline.get_pipeline("eu-west-1", environment_file=str(environment_file))
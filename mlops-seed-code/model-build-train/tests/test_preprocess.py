@@ -0,0 +1,303 @@
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipelines.abalone import preprocess
+
+DATASET = os.path.join(os.path.dirname(__file__), "..", "dataset", "abalone-dataset.csv")
+
+
+def make_output_dirs(base_dir):
+    for split in ["train", "validation", "test"]:
+        os.makedirs(os.path.join(base_dir, split), exist_ok=True)
+
+
+def read_split(base_dir, split):
+    return pd.read_csv(os.path.join(base_dir, split, f"{split}.csv"), header=None)
+
+
+def test_streaming_stats_match_column_transformer():
+    df = preprocess.read_csv(DATASET)
+    df.loc[::7, "length"] = np.nan
+    df.loc[::11, "sex"] = np.nan
+
+    expected = preprocess.get_preprocessor().fit_transform(df.drop(columns="rings"))
+
+    stats = preprocess.StreamingFeatureStats()
+    for start in range(0, len(df), 500):
+        stats.update(df.iloc[start : start + 500])
+    stats.finalize()
+
+    np.testing.assert_allclose(stats.transform(df), expected, atol=1e-9)
+
+
+def test_streaming_mode_writes_same_schema(tmp_path):
+    make_output_dirs(tmp_path)
+    preprocess.preprocess_streaming(DATASET, str(tmp_path), chunk_size=1000)
+
+    rows = len(preprocess.read_csv(DATASET))
+    splits = [read_split(tmp_path, s) for s in ["train", "validation", "test"]]
+    assert tuple(len(s) for s in splits) == preprocess.get_split_sizes(rows)
+    assert all(s.shape[1] == 11 for s in splits)
+
+    labels = np.sort(np.concatenate([s[0].to_numpy() for s in splits]))
+    np.testing.assert_array_equal(labels, np.sort(preprocess.read_csv(DATASET)["rings"]))
+
+
+class FakeS3Client:
+    """Keeps objects in memory and serves the calls preprocess.py makes."""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+    def get_object(self, Bucket, Key, Range=None):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        data = self.objects[(Bucket, Key)]
+        if Range:
+            first, last = Range[len("bytes=") :].split("-")
+            data = data[int(first) : int(last) + 1]
+        return {"Body": io.BytesIO(data)}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body
+
+    def upload_file(self, Filename, Bucket, Key):
+        with open(Filename, "rb") as f:
+            self.objects[(Bucket, Key)] = f.read()
+
+    def download_file(self, Bucket, Key, Filename):
+        with open(Filename, "wb") as f:
+            f.write(self.objects[(Bucket, Key)])
+
+    def list_objects_v2(self, Bucket, Prefix):
+        keys = sorted(k for b, k in self.objects if b == Bucket and k.startswith(Prefix))
+        return {
+            "Contents": [
+                {"Key": k, "Size": len(self.objects[(Bucket, k)]), "ETag": f'"{k}-etag"'}
+                for k in keys
+            ]
+        }
+
+
+def test_s3_input_streams_every_line_once():
+    with open(DATASET, "rb") as f:
+        data = f.read()
+    # the second object lacks the trailing newline
+    s3 = FakeS3Client(
+        {("bucket", "data/part-1.csv"): data, ("bucket", "data/part-2.csv"): data.rstrip()}
+    )
+    objects = preprocess.list_input_objects(s3, "s3://bucket/data/")
+    assert [o[1] for o in objects] == ["data/part-1.csv", "data/part-2.csv"]
+
+    hosts = ["algo-1", "algo-2", "algo-3"]
+    shards = []
+    for host in hosts:
+        with preprocess.open_s3_input(s3, objects, hosts, host, part_size=1000) as f:
+            shards.append(f.read())
+
+    assert all(shards)
+    assert sorted(b"".join(shards).splitlines()) == sorted(data.splitlines() * 2)
+
+
+def test_byte_ranges_assign_every_line_to_one_host():
+    data = b"1,a\n22,bb\n\n333,ccc\n4\n55555,e"
+    s3 = FakeS3Client({("bucket", "data.csv"): data})
+    expected = sorted(data.splitlines())
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for shard_size in range(1, len(data) + 1):
+            for part_size in [1, 2, 5]:
+                lines = []
+                for start in range(0, len(data), shard_size):
+                    end = min(start + shard_size, len(data))
+                    blocks = preprocess.iter_object_range(
+                        s3, executor, "bucket", "data.csv", len(data), start, end, part_size, 2
+                    )
+                    lines += b"".join(blocks).splitlines()
+                assert sorted(lines) == expected, (shard_size, part_size)
+
+
+def test_empty_shard_writes_no_rows(tmp_path):
+    make_output_dirs(tmp_path)
+    stats = preprocess.fit_streaming_stats(lambda: io.BytesIO(b""), chunk_size=100)
+    assert stats.rows == 0
+
+    reference = preprocess.StreamingFeatureStats()
+    reference.update(preprocess.read_csv(DATASET))
+    preprocess.write_streaming_splits(
+        lambda: io.BytesIO(b""), str(tmp_path), reference.finalize(), 100, 0, "algo-2"
+    )
+    for split in ["train", "validation", "test"]:
+        assert all(os.path.getsize(tmp_path / split / f) == 0 for f in os.listdir(tmp_path / split))
+
+
+def test_s3_input_prefers_exact_key():
+    s3 = FakeS3Client({("bucket", "a.csv"): b"1\n", ("bucket", "a.csv.bak"): b"2\n"})
+    objects = preprocess.list_input_objects(s3, "s3://bucket/a.csv")
+    assert objects == [("bucket", "a.csv", 2, '"a.csv-etag"')]
+
+
+def test_exchanged_stats_match_single_host(tmp_path):
+    df = preprocess.read_csv(DATASET)
+    expected = preprocess.StreamingFeatureStats()
+    expected.update(df)
+    expected.finalize()
+
+    s3 = FakeS3Client()
+    hosts = ["algo-1", "algo-2"]
+    for host, rows in zip(hosts, np.array_split(np.arange(len(df)), len(hosts))):
+        stats = preprocess.StreamingFeatureStats()
+        stats.update(df.iloc[rows])
+        s3.put_object("bucket", f"exchange/{host}.npz", stats.to_bytes())
+
+    merged = preprocess.exchange_stats(stats, s3, "s3://bucket/exchange", hosts, "algo-2")
+    merged.finalize()
+
+    assert merged.rows == expected.rows
+    np.testing.assert_allclose(merged.medians, expected.medians)
+    np.testing.assert_allclose(merged.means, expected.means)
+    np.testing.assert_allclose(merged.scales, expected.scales)
+    np.testing.assert_array_equal(merged.categories, expected.categories)
+
+
+def test_recordio_protobuf_matches_sagemaker_sdk():
+    from sagemaker.amazon.common import write_numpy_to_dense_tensor
+
+    X = np.random.default_rng(0).random((10, 11))
+    expected = io.BytesIO()
+    write_numpy_to_dense_tensor(expected, X[:, 1:].astype(np.float32), X[:, 0].astype(np.float32))
+
+    assert preprocess.to_recordio_protobuf(X) == expected.getvalue()
+
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet", "libsvm"])
+def test_split_formats_round_trip(tmp_path, output_format):
+    from pipelines.abalone.evaluate import iter_test_batches
+
+    X = np.random.default_rng(0).random((100, 11))
+    (tmp_path / "test").mkdir()
+    path = tmp_path / "test" / f"test.{preprocess.OUTPUT_FORMATS[output_format]}"
+    with preprocess.SplitWriter(str(path), output_format, float32=True) as writer:
+        writer.write(X[:60])
+        writer.write(X[60:])
+
+    [(y, features)] = iter_test_batches(str(tmp_path / "test"))
+    if output_format == "libsvm":
+        features = features.toarray()
+    np.testing.assert_allclose(y, X[:, 0], rtol=1e-6)
+    np.testing.assert_allclose(features, X[:, 1:], rtol=1e-6)
+
+
+def test_seeded_split_is_reproducible_and_stratified(tmp_path):
+    outputs = []
+    for run in ["a", "b"]:
+        make_output_dirs(tmp_path / run)
+        preprocess.preprocess_in_memory(DATASET, str(tmp_path / run), seed=7, stratify_bins=5)
+        outputs.append([read_split(tmp_path / run, s) for s in ["train", "validation", "test"]])
+
+    for first, second in zip(*outputs):
+        pd.testing.assert_frame_equal(first, second)
+
+    y = preprocess.read_csv(DATASET)["rings"].to_numpy()
+    strata = preprocess.get_rings_strata(y, 5)
+    train, validation, test = preprocess.get_split_indices(len(y), np.random.default_rng(7), strata)
+    assert sorted(np.concatenate([train, validation, test])) == list(range(len(y)))
+    for stratum in np.unique(strata):
+        share = np.mean(strata[train] == stratum) - np.mean(strata == stratum)
+        assert abs(share) < 0.01
+
+
+def test_cache_key_covers_input_and_split_arguments():
+    objects = [("bucket", "abalone.csv", 100, '"v1"')]
+    arguments = {"input_data": "s3://bucket/abalone.csv", "seed": 1, "concurrency": 8}
+    key = preprocess.get_cache_key(objects, arguments)
+
+    assert preprocess.get_cache_key(objects, {**arguments, "concurrency": 16}) == key
+    assert preprocess.get_cache_key(objects, {**arguments, "seed": 2}) != key
+    assert preprocess.get_cache_key([("bucket", "abalone.csv", 100, '"v2"')], arguments) != key
+
+
+def test_cache_round_trip(tmp_path):
+    make_output_dirs(tmp_path / "run")
+    transformer = preprocess.preprocess_in_memory(DATASET, str(tmp_path / "run"), seed=3)
+    s3 = FakeS3Client()
+
+    assert not preprocess.restore_from_cache(s3, "s3://bucket/cache/key", str(tmp_path / "rerun"))
+    preprocess.save_to_cache(s3, "s3://bucket/cache/key", str(tmp_path / "run"), transformer)
+    assert ("bucket", "cache/key/transformer.joblib") in s3.objects
+
+    make_output_dirs(tmp_path / "rerun")
+    assert preprocess.restore_from_cache(s3, "s3://bucket/cache/key", str(tmp_path / "rerun"))
+    for split in ["train", "validation", "test"]:
+        pd.testing.assert_frame_equal(
+            read_split(tmp_path / "rerun", split), read_split(tmp_path / "run", split)
+        )
+
+
+def test_compact_dtypes_match_default_within_tolerance():
+    df = preprocess.read_csv(DATASET)
+    compact_df = preprocess.read_csv(DATASET, compact=True)
+    for frame in [df, compact_df]:
+        frame.loc[::9, "height"] = np.nan
+        frame.loc[::13, "sex"] = np.nan
+    assert compact_df["sex"].dtype == "category"
+    assert compact_df["length"].dtype == np.float32
+
+    expected = preprocess.get_preprocessor().fit_transform(df.drop(columns="rings"))
+    compact = preprocess.get_preprocessor(compact=True).fit_transform(
+        compact_df.drop(columns="rings")
+    )
+    assert compact.dtype == np.float32
+    np.testing.assert_allclose(compact, expected, atol=1e-5)
+
+    stats = preprocess.StreamingFeatureStats(compact=True)
+    stats.update(compact_df)
+    stats.finalize()
+    np.testing.assert_allclose(stats.transform(compact_df), expected, atol=1e-5)
+
+
+@pytest.mark.parametrize("executor_class", [ThreadPoolExecutor, ProcessPoolExecutor])
+def test_split_parts_are_listed_in_manifest(tmp_path, executor_class):
+    make_output_dirs(tmp_path)
+    with executor_class(2) as executor:
+        preprocess.preprocess_in_memory(DATASET, str(tmp_path), seed=5, parts=3, executor=executor)
+    expected_dir = tmp_path / "expected"
+    make_output_dirs(expected_dir)
+    preprocess.preprocess_in_memory(DATASET, str(expected_dir), seed=5)
+
+    manifest = json.loads((tmp_path / "manifest" / "manifest.json").read_text())
+    for split in ["train", "validation", "test"]:
+        assert [part["file"] for part in manifest[split]] == [
+            f"{split}-part-{i:05d}.csv" for i in range(3)
+        ]
+        parts = pd.concat(
+            [pd.read_csv(tmp_path / split / part["file"], header=None) for part in manifest[split]],
+            ignore_index=True,
+        )
+        assert sum(part["rows"] for part in manifest[split]) == len(parts)
+        pd.testing.assert_frame_equal(parts, read_split(expected_dir, split))
+
+
+def test_profiler_records_phases(tmp_path, monkeypatch):
+    profiler = preprocess.PhaseProfiler("cprofile")
+    monkeypatch.setattr(preprocess, "profiler", profiler)
+    make_output_dirs(tmp_path)
+    preprocess.preprocess_in_memory(DATASET, str(tmp_path), seed=1)
+    profiler.write(str(tmp_path / "profile"), "algo-1")
+
+    profile = json.loads((tmp_path / "profile" / "profile-algo-1.json").read_text())
+    assert list(profile["phases"]) == ["read", "transform", "split", "write"]
+    assert all(phase["peak_bytes"] > 0 for phase in profile["phases"].values())
+    assert (tmp_path / "profile" / "transform-algo-1.prof").exists()
@@ -0,0 +1,151 @@
+import json
+from datetime import datetime, timedelta
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+from mock import MagicMock
+
+from pipelines.run_pipeline import upsert_and_start
+
+PIPELINE_NAME = "AbalonePipeline"
+ROLE_ARN = "arn:aws:iam::111111111111:role/pipeline"
+EXECUTION_ARN = f"arn:aws:sagemaker:eu-west-1:111111111111:pipeline/{PIPELINE_NAME}/execution/1"
+DEFINITION = {
+    "Version": "2020-12-01",
+    "Parameters": [
+        {"Name": "TrainingInstanceCount", "Type": "Integer", "DefaultValue": 1},
+        {"Name": "InputDataUrl", "Type": "String", "DefaultValue": "s3://data/abalone.csv"},
+    ],
+    "Steps": [{"Name": "TrainAbaloneModel", "Type": "Training", "Arguments": {}}],
+}
+PARAMETERS = {"TrainingInstanceCount": "1", "InputDataUrl": "s3://data/abalone.csv"}
+
+
+@pytest.fixture
+def sm_client():
+    client = boto3.client(
+        "sagemaker",
+        region_name="eu-west-1",
+        aws_access_key_id="key",
+        aws_secret_access_key="secret",
+    )
+    with Stubber(client) as stubber:
+        client.stubber = stubber
+        yield client
+        stubber.assert_no_pending_responses()
+
+
+def get_pipeline(sm_client, definition=DEFINITION):
+    pipeline = MagicMock()
+    pipeline.name = PIPELINE_NAME
+    pipeline.definition.return_value = json.dumps(definition)
+    pipeline.sagemaker_session.sagemaker_client = sm_client
+    return pipeline
+
+
+def add_deployed_pipeline(sm_client, definition=DEFINITION):
+    sm_client.stubber.add_response(
+        "describe_pipeline",
+        # the service returns the definition with its own formatting and key order
+        {
+            "PipelineDefinition": json.dumps(definition, indent=2, sort_keys=True),
+            "RoleArn": ROLE_ARN,
+        },
+        {"PipelineName": PIPELINE_NAME},
+    )
+
+
+def add_last_execution(sm_client, definition=DEFINITION, parameters=PARAMETERS):
+    stubber = sm_client.stubber
+    stubber.add_response(
+        "list_pipeline_executions",
+        {
+            "PipelineExecutionSummaries": [
+                {
+                    "PipelineExecutionArn": f"{EXECUTION_ARN}-failed",
+                    "PipelineExecutionStatus": "Failed",
+                },
+                {"PipelineExecutionArn": EXECUTION_ARN, "PipelineExecutionStatus": "Succeeded"},
+            ]
+        },
+        {"PipelineName": PIPELINE_NAME, "SortBy": "CreationTime", "SortOrder": "Descending"},
+    )
+    created = datetime(2021, 7, 1)
+    stubber.add_response(
+        "describe_pipeline_execution",
+        {
+            "PipelineExecutionArn": EXECUTION_ARN,
+            "CreationTime": created,
+            "LastModifiedTime": created + timedelta(minutes=40),
+        },
+        {"PipelineExecutionArn": EXECUTION_ARN},
+    )
+    stubber.add_response(
+        "describe_pipeline_definition_for_execution",
+        {"PipelineDefinition": json.dumps(definition)},
+        {"PipelineExecutionArn": EXECUTION_ARN},
+    )
+    stubber.add_response(
+        "list_pipeline_parameters_for_execution",
+        {"PipelineParameters": [{"Name": k, "Value": v} for k, v in parameters.items()]},
+        {"PipelineExecutionArn": EXECUTION_ARN},
+    )
+
+
+def test_unchanged_pipeline_skips_upsert_and_execution(sm_client, capsys):
+    add_deployed_pipeline(sm_client)
+    add_last_execution(sm_client)
+    pipeline = get_pipeline(sm_client)
+
+    assert upsert_and_start(pipeline, ROLE_ARN, skip_unchanged_execution=True) is None
+    pipeline.upsert.assert_not_called()
+    pipeline.start.assert_not_called()
+    assert "saving about 40.0 minutes" in capsys.readouterr().out
+
+
+def test_unchanged_pipeline_still_starts_by_default(sm_client):
+    add_deployed_pipeline(sm_client)
+    pipeline = get_pipeline(sm_client)
+
+    assert upsert_and_start(pipeline, ROLE_ARN) is pipeline.start.return_value
+    pipeline.upsert.assert_not_called()
+
+
+def test_changed_definition_is_upserted_and_started(sm_client):
+    changed = json.loads(json.dumps(DEFINITION))
+    changed["Parameters"][0]["DefaultValue"] = 2
+    add_deployed_pipeline(sm_client)
+    add_last_execution(sm_client)
+    pipeline = get_pipeline(sm_client, changed)
+
+    upsert_and_start(pipeline, ROLE_ARN, skip_unchanged_execution=True)
+    pipeline.upsert.assert_called_once()
+    pipeline.start.assert_called_once()
+
+
+def test_changed_parameters_of_last_execution_start_a_new_one(sm_client):
+    add_deployed_pipeline(sm_client)
+    add_last_execution(sm_client, parameters={**PARAMETERS, "InputDataUrl": "s3://data/other.csv"})
+    pipeline = get_pipeline(sm_client)
+
+    upsert_and_start(pipeline, ROLE_ARN, skip_unchanged_execution=True)
+    pipeline.upsert.assert_not_called()
+    pipeline.start.assert_called_once()
+
+
+def test_missing_pipeline_is_created(sm_client):
+    sm_client.stubber.add_client_error("describe_pipeline", service_error_code="ResourceNotFound")
+    pipeline = get_pipeline(sm_client)
+
+    upsert_and_start(pipeline, ROLE_ARN)
+    pipeline.upsert.assert_called_once()
+    pipeline.start.assert_called_once()
+
+
+def test_force_skips_the_checks(sm_client):
+    pipeline = get_pipeline(sm_client)
+
+    upsert_and_start(pipeline, ROLE_ARN, skip_unchanged_execution=True, force=True)
+    pipeline.upsert.assert_called_once()
+    pipeline.start.assert_called_once()
@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mock import MagicMock
+
+from pipelines import step_history
+
+PIPELINE_NAME = "AbalonePipeline"
+START = datetime(2021, 7, 1, tzinfo=timezone.utc)
+
+
+def get_client(executions):
+    """Stubs a client with executions of a processing and a condition step."""
+    sm_client = MagicMock()
+
+    def paginate(**kwargs):
+        if "PipelineName" in kwargs:
+            return [{"PipelineExecutionSummaries": executions}]
+        return [
+            {
+                "PipelineExecutionSteps": [
+                    {
+                        "StepName": "PreprocessAbaloneData",
+                        "StepStatus": "Succeeded",
+                        "StartTime": START,
+                        "EndTime": START + timedelta(minutes=5),
+                        "Metadata": {
+                            "ProcessingJob": {"Arn": "arn:aws:sagemaker:::processing-job/p"}
+                        },
+                    },
+                    {"StepName": "CheckMSEAbaloneEvaluation", "StepStatus": "Executing"},
+                ]
+            }
+        ]
+
+    sm_client.get_paginator.return_value.paginate.side_effect = paginate
+    sm_client.describe_processing_job.return_value = {
+        "ProcessingResources": {
+            "ClusterConfig": {"InstanceType": "ml.m5.xlarge", "InstanceCount": 2}
+        }
+    }
+    return sm_client
+
+
+def test_collect_stores_ended_executions_once():
+    connection = step_history.connect(":memory:")
+    executions = [
+        {"PipelineExecutionArn": f"arn:{i}", "PipelineExecutionStatus": status, "StartTime": START}
+        for i, status in enumerate(["Executing", "Succeeded", "Failed"])
+    ]
+    sm_client = get_client(executions)
+
+    assert step_history.collect(connection, sm_client, PIPELINE_NAME) == 2
+    rows = connection.execute(
+        "SELECT execution_arn, step_name, duration, instance_type, instance_count FROM step_runs "
+        "ORDER BY execution_arn, step_name"
+    ).fetchall()
+    assert rows == [
+        ("arn:1", "CheckMSEAbaloneEvaluation", None, None, None),
+        ("arn:1", "PreprocessAbaloneData", 300.0, "ml.m5.xlarge", 2),
+        ("arn:2", "CheckMSEAbaloneEvaluation", None, None, None),
+        ("arn:2", "PreprocessAbaloneData", 300.0, "ml.m5.xlarge", 2),
+    ]
+    assert step_history.collect(connection, sm_client, PIPELINE_NAME) == 0
+
+
+def add_runs(connection, step_name, durations, instance_type="ml.m5.xlarge"):
+    with connection:
+        for i, duration in enumerate(durations):
+            arn = f"arn:{step_name}:{instance_type}:{i}"
+            connection.execute(
+                "INSERT INTO executions VALUES (?, ?, 'Succeeded', ?)", (arn, PIPELINE_NAME, i)
+            )
+            connection.execute(
+                "INSERT INTO step_runs VALUES (?, ?, ?, 'Succeeded', ?, ?, ?, ?, 1)",
+                (arn, PIPELINE_NAME, step_name, i, i + duration, duration, instance_type),
+            )
+
+
+def test_find_regressions_flags_significant_slowdowns():
+    connection = step_history.connect(":memory:")
+    baseline = [600 + 10 * (i % 5) for i in range(20)]
+    add_runs(connection, "TrainAbaloneModel", baseline + [720, 700, 710])
+    add_runs(connection, "EvaluateAbaloneModel", baseline + [620, 610, 630])
+    # a noisy step whose slow runs are within its usual spread
+    add_runs(
+        connection, "PreprocessAbaloneData", [300 + 200 * (i % 2) for i in range(20)] + [500] * 3
+    )
+    # faster instances are not the baseline of slower ones
+    add_runs(connection, "RegisterAbaloneModel", [60] * 20)
+    add_runs(connection, "RegisterAbaloneModel", [90] * 3, instance_type="ml.t3.medium")
+
+    regressions = step_history.find_regressions(connection, PIPELINE_NAME)
+    assert [r["step"] for r in regressions] == ["TrainAbaloneModel"]
+    assert regressions[0]["recent_median"] == 710
+    assert regressions[0]["baseline_median"] == 620
+    assert regressions[0]["p_value"] < 0.01
+    assert "15% slower" in step_history.format_regression(regressions[0])
+
+
+def test_steps_with_a_short_baseline_are_reported_as_not_checked():
+    connection = step_history.connect(":memory:")
+    # 1 / C(9, 3) is above 0.01, so even a doubling cannot be significant after 6 runs
+    add_runs(connection, "TrainAbaloneModel", [600] * 6 + [1200] * 3)
+    skipped = []
+
+    assert step_history.find_regressions(connection, PIPELINE_NAME, on_skip=skipped.append) == []
+    assert [(s["step"], s["runs"], s["needed"]) for s in skipped] == [("TrainAbaloneModel", 6, 7)]
+
+    add_runs(connection, "EvaluateAbaloneModel", [600] * 7 + [1200] * 3)
+    regressions = step_history.find_regressions(connection, PIPELINE_NAME)
+    assert [r["step"] for r in regressions] == ["EvaluateAbaloneModel"]
+
+
+def test_window_too_short_for_alpha_is_rejected():
+    connection = step_history.connect(":memory:")
+    with pytest.raises(ValueError, match="at least 7"):
+        step_history.find_regressions(connection, PIPELINE_NAME, window=6)
+
+
+def test_permutation_p_value_samples_large_groups():
+    p_value = step_history.permutation_p_value([10] * 10, [1] * 100)
+    assert p_value < 1e-3
+    assert step_history.permutation_p_value([1, 1], [1, 1, 1]) == 1